@@ -0,0 +1,99 @@
+import time
+from threading import Condition
+from typing import Callable
+
+from requests.exceptions import Timeout, ConnectionError
+
+from exceptions.tinyurl_exceptions import NetworkError, NoTokenAvailable
+
+DEFAULT_MAX_CONCURRENCY = 32
+DEFAULT_LATENCY_THRESHOLD = 2.0
+DEFAULT_BACKOFF = 0.5
+DEFAULT_COOLDOWN = 1.0
+OVERLOAD_STATUSES = (429, 500, 502, 503, 504)
+
+
+def is_overload(exc: Exception) -> bool:
+    """
+    Timeouts, refused connections, 429/5xx and exhausted tokens mean we push too hard.
+    """
+    if isinstance(exc, (Timeout, ConnectionError, NetworkError, NoTokenAvailable)):
+        return True
+    return getattr(exc, 'status_code', None) in OVERLOAD_STATUSES
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for worker pools: every healthy call raises the limit by 1/limit (so +1 per
+    full window), a slow call, timeout or 429 halves it. Halving happens at most once per cooldown,
+    a burst of failures from one window counts once.
+
+    Pools are sized to max_limit and every task runs through run(), which blocks while limit is reached.
+    """
+
+    def __init__(self, max_limit: int = DEFAULT_MAX_CONCURRENCY, min_limit: int = 1, initial: int = None,
+                 latency_threshold: float = DEFAULT_LATENCY_THRESHOLD, backoff: float = DEFAULT_BACKOFF,
+                 cooldown: float = DEFAULT_COOLDOWN):
+        self.max_limit = max(min_limit, max_limit)
+        self.min_limit = min_limit
+        self.limit = float(initial or max(min_limit, self.max_limit // 4))
+        self.latency_threshold = latency_threshold
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.overloads = 0
+        self.condition = Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency: float = None, overloaded: bool = False):
+        with self.condition:
+            self.in_flight -= 1
+            if overloaded or (latency is not None and latency > self.latency_threshold):
+                self._decrease()
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def record_overload(self):
+        """
+        For overload signals seen outside of run(), e.g. a 429 that was retried inside the api client.
+        """
+        with self.condition:
+            self._decrease()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self.last_decrease < self.cooldown:
+            return
+        self.last_decrease = now
+        self.overloads += 1
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+
+    def run(self, func: Callable, *args, **kwargs):
+        self.acquire()
+        start = time.monotonic()
+        overloaded = False
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            overloaded = is_overload(e)
+            raise
+        finally:
+            self.release(time.monotonic() - start, overloaded)
+
+    def set_max(self, max_limit: int):
+        with self.condition:
+            self.max_limit = max(self.min_limit, max_limit)
+            self.limit = min(self.limit, self.max_limit)
+            self.condition.notify_all()
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {'current': self.in_flight, 'target': int(self.limit), 'max': self.max_limit,
+                    'overloads': self.overloads}
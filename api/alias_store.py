@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import time
+from collections.abc import MutableMapping
+from threading import Event, Lock, Thread
+from typing import Dict, Optional
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+
+class AliasTokenStore(MutableMapping):
+    """
+    alias -> auth token mapping persisted in SQLite (WAL mode), so tinyurls created in earlier runs can still be
+    updated. Drop-in replacement for the old in-memory dict.
+
+    Nothing is loaded at startup: lookups go to the primary key index and are cached, writes are buffered and
+    committed in batches of batch_size or every flush_interval seconds. A background thread commits what is left
+    when no further write comes.
+    """
+
+    def __init__(self, path: Optional[str] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        self.path = path or ':memory:'
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS alias_token ('
+                                'alias TEXT PRIMARY KEY, token TEXT NOT NULL) WITHOUT ROWID')
+        self.connection.commit()
+        self.cache: Dict[str, str] = {}
+        self.pending: Dict[str, Optional[str]] = {}  # None marks a pending delete
+        self.last_flush = time.monotonic()
+        self.closed = Event()
+        if flush_interval > 0:
+            Thread(target=self._flush_loop, daemon=True).start()
+
+    def __getitem__(self, alias: str) -> str:
+        with self.lock:
+            if alias in self.pending:
+                token = self.pending[alias]
+            elif alias in self.cache:
+                token = self.cache[alias]
+            else:
+                row = self.connection.execute('SELECT token FROM alias_token WHERE alias = ?', (alias,)).fetchone()
+                token = row[0] if row else None
+                if token:
+                    self.cache[alias] = token
+        if token is None:
+            raise KeyError(alias)
+        return token
+
+    def __setitem__(self, alias: str, token: str):
+        with self.lock:
+            self.pending[alias] = token
+            self.cache[alias] = token
+            self._flush_if_due()
+
+    def __delitem__(self, alias: str):
+        self[alias]  # Raises KeyError like a dict would
+        with self.lock:
+            self.pending[alias] = None
+            self.cache.pop(alias, None)
+            self._flush_if_due()
+
+    def __iter__(self):
+        self.flush()
+        with self.lock:
+            aliases = [row[0] for row in self.connection.execute('SELECT alias FROM alias_token')]
+        return iter(aliases)
+
+    def __len__(self) -> int:
+        self.flush()
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM alias_token').fetchone()[0]
+
+    def update_many(self, mapping: Dict[str, str]):
+        with self.lock:
+            self.pending.update(mapping)
+            self.cache.update(mapping)
+            self._flush_if_due()
+
+    def _flush_if_due(self):
+        if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self._flush()
+
+    def _flush(self):
+        if self.pending:
+            upserts = [(alias, token) for alias, token in self.pending.items() if token is not None]
+            deletes = [(alias,) for alias, token in self.pending.items() if token is None]
+            with self.connection:
+                self.connection.executemany('INSERT OR REPLACE INTO alias_token (alias, token) VALUES (?, ?)',
+                                            upserts)
+                self.connection.executemany('DELETE FROM alias_token WHERE alias = ?', deletes)
+            self.pending.clear()
+        self.last_flush = time.monotonic()
+
+    def _flush_loop(self):
+        while not self.closed.wait(self.flush_interval):
+            with self.lock:
+                if self.pending and not self.closed.is_set():
+                    self._flush_if_due()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        self.closed.set()
+        with self.lock:
+            self._flush()
+            self.connection.close()
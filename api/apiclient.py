@@ -1,49 +1,268 @@
 import json
-import time
+import os
 from typing import Optional, List, Dict
 from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError, RequestException, Timeout
 from urllib3.exceptions import LocationParseError
 
-from exceptions.tinyurl_exceptions import TinyUrlUpdateError, TinyUrlCreationError, NetworkError, RequestError
-from tunneling.tunnelservicehandler import TunnelServiceHandler
-from utility.url_tools import generate_string_5_30
+from api.adaptive_limiter import AdaptiveLimiter, DEFAULT_MAX_CONCURRENCY, DEFAULT_LATENCY_THRESHOLD
+from api.alias_store import AliasTokenStore
+from api.journal import MutationJournal, journal_path, DEFAULT_FSYNC_INTERVAL, INTENT, DONE, FAILED
+from api.retry import RetryPolicy, RetryBudget, CircuitBreakerRegistry, DEFAULT_ATTEMPTS, DEFAULT_BASE_DELAY, \
+    DEFAULT_MAX_DELAY, DEFAULT_BUDGET_RATIO, DEFAULT_FAILURE_THRESHOLD, DEFAULT_RESET_TIMEOUT
+from api.token_scheduler import TokenScheduler, DEFAULT_TOKEN_RATE, DEFAULT_TOKEN_BURST, DEFAULT_QUARANTINE_TIME
+from exceptions.tinyurl_exceptions import TinyUrlUpdateError, TinyUrlCreationError, NetworkError, RequestError, \
+    CircuitOpenError
+from tunneling.tunnelservicehandler import TunnelServiceHandler, DEFAULT_PROBE_INTERVAL
+from utility.alias_generator import AliasGenerator
+from utility.ansi_codes import AnsiCodes
+from utility.ttl_cache import TTLCache, MISSING
+from utility.url_tools import preflight_cache_key
 
 BASE_URL = "https://api.tinyurl.com"
+BASE_URL_ENV = 'TUM_API_BASE_URL'  # Point tum at another api, e.g. local fakeapi server
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+DEFAULT_TIMEOUT = 3
+DEFAULT_PREFLIGHT_CACHE_SIZE = 4096
+DEFAULT_PREFLIGHT_TTL = 600
+DEFAULT_PREFLIGHT_NEGATIVE_TTL = 30
+ALIAS_NOT_AVAILABLE = 'Alias is not available.'
+RATE_LIMITED = 429
+UNAUTHORIZED = (401, 403)
+
+
+def create_payload(target_url: str, alias: str, expires_at: str = None) -> dict:
+    return {
+        'url': target_url,
+        'alias': alias,
+        'expires_at': expires_at
+    }
+
+
+def change_payload(alias: str, target_url: str) -> dict:
+    return {
+        'domain': 'tinyurl.com',
+        'url': target_url,
+        'alias': alias,
+    }
+
+
+def resolve_base_url(config: dict) -> str:
+    return (config.get('api_base_url') or os.environ.get(BASE_URL_ENV) or BASE_URL).rstrip('/')
+
+
+def taken_aliases_path(config: dict) -> Optional[str]:
+    state_path = config.get('state_path')
+    return os.path.join(state_path, 'taken_aliases.bloom') if state_path else None
+
+
+def alias_store_path(config: dict) -> Optional[str]:
+    state_path = config.get('state_path')
+    return os.path.join(state_path, 'aliases.db') if state_path else None
+
+
+def build_preflight_cache(config: dict) -> TTLCache:
+    return TTLCache(max_size=config.get('preflight_cache_size', DEFAULT_PREFLIGHT_CACHE_SIZE),
+                    ttl=config.get('preflight_ttl', DEFAULT_PREFLIGHT_TTL))
+
+
+def preflight_failure(error) -> tuple:
+    """
+    Cached form of a failed preflight. Caching the exception itself would share (and grow) its traceback between all
+    callers, so a new one is raised from this on every hit.
+    """
+    return type(error), error.message.replace(AnsiCodes.RED, '', 1), getattr(error, 'url', None)
+
+
+def raise_preflight_failure(failure: tuple):
+    error_type, message, url = failure
+    raise RequestError(message, url=url) if error_type is RequestError else NetworkError(message)
+
+
+def build_resilience(config: dict):
+    """
+    :return: (RetryPolicy, CircuitBreakerRegistry) configured from app config
+    """
+    retry_policy = RetryPolicy(attempts=config.get('retry_attempts', DEFAULT_ATTEMPTS),
+                               base_delay=config.get('retry_base_delay', DEFAULT_BASE_DELAY),
+                               max_delay=config.get('retry_max_delay', DEFAULT_MAX_DELAY),
+                               budget=RetryBudget(ratio=config.get('retry_budget', DEFAULT_BUDGET_RATIO)))
+    circuit_breakers = CircuitBreakerRegistry(failure_threshold=config.get('breaker_threshold',
+                                                                           DEFAULT_FAILURE_THRESHOLD),
+                                              reset_timeout=config.get('breaker_reset', DEFAULT_RESET_TIMEOUT))
+    return retry_policy, circuit_breakers
 
 
 class ApiClient:
-    def __init__(self, auth_tokens: [], fallback_urls=None):
+    def __init__(self, auth_tokens: [], fallback_urls=None, config: dict = None, alias_generator=None):
+        config = config or {}
+        self.base_url: str = resolve_base_url(config)
         self.auth_tokens: List[str] = auth_tokens
         self.token_selected = self.auth_tokens[0]
-        self.alias_token_mapping: Dict[int, str] = {}
-        self.tunneling_service: TunnelServiceHandler = TunnelServiceHandler(fallback_urls)
+        self.pinned_token: Optional[str] = None  # Set when user explicitly selects a token in cli
+        self.alias_token_mapping: AliasTokenStore = AliasTokenStore(alias_store_path(config))
+        self.token_scheduler = TokenScheduler(self.auth_tokens,
+                                              rate=config.get('token_rate', DEFAULT_TOKEN_RATE),
+                                              burst=config.get('token_burst', DEFAULT_TOKEN_BURST),
+                                              quarantine_time=config.get('token_quarantine', DEFAULT_QUARANTINE_TIME))
+        self.alias_generator = alias_generator or AliasGenerator(filter_path=taken_aliases_path(config))
+        self.retry_policy, self.circuit_breakers = build_resilience(config)
+        self.concurrency_limiter = AdaptiveLimiter(
+            max_limit=config.get('max_threads', DEFAULT_MAX_CONCURRENCY),
+            latency_threshold=config.get('latency_threshold', DEFAULT_LATENCY_THRESHOLD))
+        self.preflight_cache: TTLCache = build_preflight_cache(config)
+        self.preflight_negative_ttl: float = config.get('preflight_negative_ttl', DEFAULT_PREFLIGHT_NEGATIVE_TTL)
+        self.preflight_by_host: bool = config.get('preflight_cache_by_host', True)
+        path = journal_path(config)
+        self.journal: Optional[MutationJournal] = MutationJournal(
+            path, config.get('journal_fsync_interval', DEFAULT_FSYNC_INTERVAL)) if path else None
+
+        self.pool_connections: int = config.get('pool_connections', DEFAULT_POOL_CONNECTIONS)
+        self.pool_maxsize: int = config.get('pool_maxsize', DEFAULT_POOL_MAXSIZE)
+        self.keep_alive: bool = config.get('keep_alive', True)
+        self.timeout = (config.get('connect_timeout', DEFAULT_TIMEOUT), config.get('read_timeout', DEFAULT_TIMEOUT))
+
+        #  One keep-alive session per token, headers are built once and stored on the session
+        self.token_headers: Dict[str, dict] = {token: self.build_headers(token=token) for token in self.auth_tokens}
+        self.sessions: Dict[str, requests.Session] = {token: self._build_session(self.token_headers[token])
+                                                      for token in self.auth_tokens}
+        self.preflight_session: requests.Session = self._build_session()
+        self.tunneling_service: TunnelServiceHandler = TunnelServiceHandler(
+            fallback_urls, probe_interval=config.get('fallback_probe_interval', DEFAULT_PROBE_INTERVAL),
+            session=self.preflight_session, circuit_breakers=self.circuit_breakers)
+
+    def _build_session(self, headers: Optional[dict] = None) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if headers:
+            session.headers.update(headers)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def get_session(self, token: str) -> requests.Session:
+        if token not in self.sessions:
+            self.token_headers[token] = self.build_headers(token=token)
+            self.sessions[token] = self._build_session(self.token_headers[token])
+        return self.sessions[token]
+
+    def _is_token_rejected(self, token: str, response: requests.Response) -> bool:
+        """
+        Feeds 429 and 401/403 responses back to the token scheduler.
+        """
+        if response.status_code == RATE_LIMITED:
+            self.token_scheduler.report_rate_limited(token, response.headers.get('Retry-After'))
+            self.concurrency_limiter.record_overload()
+            return True
+        if response.status_code in UNAUTHORIZED:
+            self.token_scheduler.report_unauthorized(token)
+            return True
+        return False
+
+    def _send(self, method: str, request_url: str, token: Optional[str], payload: dict,
+              headers: dict = None, timeout=None, retry_policy: RetryPolicy = None):
+        """
+        Every API call goes through here: circuit breaker of the host, token scheduler and the shared retry policy.
+        Retries timeouts, connection errors, 429 and 5xx. If token is None the scheduler picks one per attempt,
+        so a rate limited or rejected token is swapped for another one.
+
+        :return: (token used, last response)
+        :raises: CircuitOpenError, requests exceptions when retries are exhausted
+        """
+        retry_policy = retry_policy or self.retry_policy
+        breaker = self.circuit_breakers.get(request_url)
+        retry_policy.start()
+        attempt = 0
+        while True:
+            trial = breaker.before_call()
+            try:
+                if token:
+                    used_token = token
+                    self.token_scheduler.acquire_for(token)
+                else:
+                    used_token = self.token_scheduler.acquire(preferred=self.pinned_token)
+                try:
+                    response = self.get_session(used_token).request(method, request_url, headers=headers,
+                                                                    data=json.dumps(payload),
+                                                                    timeout=timeout or self.timeout)
+                except RequestException as e:
+                    if not retry_policy.is_retryable_exception(e):
+                        raise
+                    breaker.record_failure()
+                    if not retry_policy.allow_retry(attempt):
+                        raise
+                    retry_policy.sleep(attempt)
+                    attempt += 1
+                    continue
+
+                breaker.record_status(response.status_code)
+                rejected = self._is_token_rejected(used_token, response)
+                if rejected and not token and retry_policy.allow_retry(attempt):
+                    attempt += 1  # Scheduler hands out another token or waits for Retry-After
+                    continue
+                if retry_policy.is_retryable_status(response.status_code) and retry_policy.allow_retry(attempt):
+                    if response.status_code != RATE_LIMITED:  # For 429 token scheduler already waits Retry-After
+                        retry_policy.sleep(attempt)
+                    attempt += 1
+                    continue
+                if response.status_code < 400:
+                    self.token_scheduler.report_success(used_token)
+                return used_token, response
+            finally:
+                breaker.release_trial(trial)  # Nothing recorded, e.g. InvalidURL or no usable token
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+        self.tunneling_service.close()  # Probes use preflight_session
+        self.preflight_session.close()
+        self.alias_generator.save()
+        self.alias_token_mapping.close()
+        if self.journal:
+            self.journal.close()
 
-    def create_tinyurl(self, target_url: str, expires_at: str = None, no_check: bool = False):
-        headers = self.build_headers(token=self.token_selected)
-        request_url = f'{BASE_URL}/create'
+    def record_mutation(self, phase: str, op: str, **fields):
+        if self.journal:
+            self.journal.append(op, phase, **fields)
+
+    def create_tinyurl(self, target_url: str, expires_at: str = None, no_check: bool = False, ref: int = None,
+                       alias: str = None):
+        """
+        :param ref: id of the tinyurl in the manager, stored in the journal so replay can rebuild it
+        :param alias: use exactly this alias (journal replay), a collision raises instead of picking another one
+        """
+        request_url = f'{self.base_url}/create'
         if not no_check:
             self.check_target_url(target_url)
 
-        length = 5
+        forced_alias = alias
+        collisions = 0
         while True:
             try:
-                payload = {
-                           'url': target_url,
-                           'alias': generate_string_5_30(length=length),
-                           'expires_at': expires_at
-                           }
-                response = requests.post(url=request_url, headers=headers, data=json.dumps(payload), timeout=3)
+                alias = forced_alias or self.alias_generator.generate(collisions)
+                payload = create_payload(target_url, alias, expires_at)
+                self.record_mutation(INTENT, 'create', alias=alias, url=target_url, ref=ref)
+                token, response = self._send('POST', request_url, None, payload)
                 response.raise_for_status()
                 data = response.json()['data']
-                self.alias_token_mapping[data['alias']] = self.token_selected
+                self.alias_generator.mark_taken(data['alias'])
+                self.alias_token_mapping[data['alias']] = token
+                self.record_mutation(DONE, 'create', alias=data['alias'], token=token, url=data['url'],
+                             tiny_url=data.get('tiny_url'), ref=ref)
                 return data
             except HTTPError as e:
-                if response.json()['errors']:
-                    if response.json()['errors'][0] == 'Alias is not available.':
-                        length += 1
+                self.record_mutation(FAILED, 'create', alias=alias, ref=ref, status=response.status_code)
+                if response.json().get('errors'):
+                    if response.json()['errors'][0] == ALIAS_NOT_AVAILABLE and not forced_alias:
+                        self.alias_generator.record_collision(alias)
+                        collisions += 1
                         continue
                     raise TinyUrlCreationError(response.json()['errors'], response.status_code)
                 else:
@@ -72,97 +291,106 @@ class ApiClient:
         RequestError: If the request to update the TinyURL fails.
     """
     def update_tinyurl_redirect_service(self, alias: str, target_url: str, headers: dict = None, retry: int = 3,
-                                        timeout: int = 3):
-        headers = self.build_headers(token=self.alias_token_mapping[alias], headers=headers)
-        request_url = f'{BASE_URL}/change'
-        payload = {
-            'domain': 'tinyurl.com',
-            'url': target_url,
-            'alias': alias,
-        }
-        while True:
-            try:
-                response = requests.patch(url=request_url, headers=headers, data=json.dumps(payload), timeout=timeout)
-                response.raise_for_status()
-                data = response.json()['data']
-                return data
-            except HTTPError as e:
-                if retry:
-                    retry -= 1
-                    continue
-                if response.json() and 'errors' in response.json():
-                    raise TinyUrlUpdateError(response.json()['errors'], response.status_code)
-                else:
-                    raise TinyUrlUpdateError([str(e)], response.status_code)
-            except Timeout:
-                if retry:
-                    retry -= 1
-                raise NetworkError('Connection error. Request timed out!')
-            except RequestException as e:
-                raise RequestError(e)
-            except ValueError:
-                raise NetworkError("Can't find ['data'] in response! Check Tinyurl docs")
+                                        timeout: int = None):
+        return self._change(alias, target_url, headers, timeout, self.retry_policy.with_attempts(retry + 1))
 
     def update_tinyurl_redirect_user(self, alias: str, target_url: str, headers: dict = None):
         self.check_target_url(target_url)
-        headers = self.build_headers(token=self.alias_token_mapping[alias], headers=headers)
-        request_url = f'{BASE_URL}/change'
-        payload = {
-            'domain': 'tinyurl.com',
-            'url': target_url,
-            'alias': alias,
-        }
-
-        attempts = 0
-        delay = 1
-        while attempts < 3:
-            try:
-                response = requests.patch(url=request_url, headers=headers, data=json.dumps(payload), timeout=3)
-                response.raise_for_status()
-                data = response.json()['data']
-                return data
-            except HTTPError as e:
-                if response.json() and 'errors' in response.json():
-                    raise TinyUrlUpdateError(response.json()['errors'], response.status_code)
-                else:
-                    raise TinyUrlUpdateError([str(e)], response.status_code)
-            except Timeout:
-                attempts += 1
-                if attempts == 3:
-                    raise NetworkError('Connection error. Request timed out!')
-                time.sleep(delay)
-                delay *= 2
-            except RequestException as e:
-                raise RequestError(e)
-            except ValueError:
-                raise NetworkError("Can't find ['data'] in response! Check Tinyurl docs")
+        return self._change(alias, target_url, headers)
+
+    def _change(self, alias: str, target_url: str, headers: dict = None, timeout=None,
+                retry_policy: RetryPolicy = None):
+        request_url = f'{self.base_url}/change'
+        payload = change_payload(alias, target_url)
+        try:
+            self.record_mutation(INTENT, 'change', alias=alias, url=target_url)
+            _, response = self._send('PATCH', request_url, self.alias_token_mapping[alias], payload, headers,
+                                     timeout, retry_policy)
+            response.raise_for_status()
+            data = response.json()['data']
+            self.record_mutation(DONE, 'change', alias=alias, url=data['url'])
+            return data
+        except HTTPError as e:
+            self.record_mutation(FAILED, 'change', alias=alias, status=response.status_code)
+            if response.json() and 'errors' in response.json():
+                raise TinyUrlUpdateError(response.json()['errors'], response.status_code)
+            else:
+                raise TinyUrlUpdateError([str(e)], response.status_code)
+        except Timeout:
+            raise NetworkError('Connection error. Request timed out!')
+        except RequestException as e:
+            raise RequestError(e)
+        except ValueError:
+            raise NetworkError("Can't find ['data'] in response! Check Tinyurl docs")
 
     #  Used in tum cli
     def switch_auth_token(self, token_id):
         self.token_selected = self.auth_tokens[token_id - 1]
+        self.pinned_token = self.token_selected
 
     #   For api usage
     def cycle_next_token(self):
         current_index = self.auth_tokens.index(self.token_selected)
-        new_index = (current_index + 1) if current_index != len(self.auth_tokens) else 0
+        new_index = (current_index + 1) % len(self.auth_tokens)
         self.token_selected = self.auth_tokens[new_index]
         return self.token_selected
 
-    @staticmethod
-    def check_target_url(url: str):
+    def get_token_usage(self) -> Dict[str, dict]:
+        return self.token_scheduler.usage()
+
+    def get_concurrency(self) -> dict:
+        return self.concurrency_limiter.stats()
+
+    def check_target_url(self, url: str, use_cache: bool = True):
+        """
+        Preflight check of the target. Results are cached per host (or per url), failures for a shorter time.
+
+        :param use_cache: False forces a fresh request, result is still stored in cache
+        """
+        key = preflight_cache_key(url, self.preflight_by_host)
+        if use_cache:
+            cached = self.preflight_cache.get(key, MISSING)
+            if cached is None:
+                return
+            if cached is not MISSING:
+                raise_preflight_failure(cached)
         try:
-            response = requests.head(url, timeout=3)
+            self._preflight(url)
+            self.preflight_cache.set(key, None)
+        except CircuitOpenError:
+            raise
+        except (RequestError, NetworkError) as e:
+            self.preflight_cache.set(key, preflight_failure(e), ttl=self.preflight_negative_ttl)
+            raise
+
+    def invalidate_preflight(self, url: str = None):
+        if url:
+            self.preflight_cache.invalidate(preflight_cache_key(url, self.preflight_by_host))
+        else:
+            self.preflight_cache.clear()
+
+    def _preflight(self, url: str):
+        breaker = self.circuit_breakers.get(url)
+        trial = breaker.before_call()
+        try:
+            response = self.preflight_session.head(url, timeout=self.timeout)
+            breaker.record_status(response.status_code)
             if urlparse(response.url).netloc == urlparse(url).netloc:
                 return
             response.raise_for_status()
         except HTTPError as e:
             raise RequestError(f"Error: {e}")
-        except Timeout:
+        except Timeout as e:
+            self.circuit_breakers.record_exception(url, e)
             raise NetworkError('Connection error. Request timed out!')
-        except RequestException:
+        except RequestException as e:
+            if RetryPolicy.is_retryable_exception(e):
+                self.circuit_breakers.record_exception(url, e)
             raise RequestError("Unknown url", url=url)
         except LocationParseError:
             raise RequestError("Incorrect url format", url=url)
+        finally:
+            breaker.release_trial(trial)  # Invalid url or a failure blamed on another hop says nothing about this host
 
     def build_headers(self, token_index: Optional[int] = None, token: Optional[str] = None,
                       headers: Optional[dict] = None) -> dict:
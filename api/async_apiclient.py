@@ -0,0 +1,323 @@
+import asyncio
+import json
+from typing import Optional, List, Dict
+from urllib.parse import urlparse
+
+import aiohttp
+
+from api.apiclient import DEFAULT_TIMEOUT, ALIAS_NOT_AVAILABLE, RATE_LIMITED, UNAUTHORIZED, \
+    DEFAULT_PREFLIGHT_NEGATIVE_TTL, create_payload, change_payload, taken_aliases_path, alias_store_path, \
+    build_resilience, build_preflight_cache, resolve_base_url, preflight_failure, raise_preflight_failure
+from api.alias_store import AliasTokenStore
+from api.journal import MutationJournal, journal_path, DEFAULT_FSYNC_INTERVAL, INTENT, DONE, FAILED
+from api.retry import RetryPolicy
+from api.token_scheduler import TokenScheduler, DEFAULT_TOKEN_RATE, DEFAULT_TOKEN_BURST, DEFAULT_QUARANTINE_TIME
+from exceptions.tinyurl_exceptions import TinyUrlUpdateError, TinyUrlCreationError, NetworkError, RequestError, \
+    CircuitOpenError
+from tunneling.tunnelservicehandler import TunnelServiceHandler
+from utility.alias_generator import AliasGenerator
+from utility.ttl_cache import MISSING
+from utility.url_tools import get_final_domain, preflight_cache_key, classify_first_hop, PROBE_OK
+
+DEFAULT_MAX_CONCURRENCY = 1000
+
+
+def response_data(body) -> dict:
+    """
+    :raises NetworkError: body isn't json or has no data, only the response itself is blamed here
+    """
+    try:
+        return body['data']
+    except (TypeError, KeyError):
+        raise NetworkError("Can't find ['data'] in response! Check Tinyurl docs")
+
+
+class AsyncApiClient:
+    """
+    Asyncio counterpart of ApiClient. Same requests, same exceptions and the same mutation journal, but all calls
+    are coroutines sharing one event loop, so thousands of requests can be in flight from a single thread.
+
+    Usage:
+        async with AsyncApiClient(tokens, config=config) as client:
+            data = await client.create_tinyurl('https://example.com')
+    """
+
+    def __init__(self, auth_tokens: [], fallback_urls=None, config: dict = None, alias_generator=None):
+        config = config or {}
+        self.base_url: str = resolve_base_url(config)
+        self.auth_tokens: List[str] = auth_tokens
+        self.token_selected = self.auth_tokens[0]
+        self.pinned_token: Optional[str] = None
+        self.alias_token_mapping: AliasTokenStore = AliasTokenStore(alias_store_path(config))
+        self.tunneling_service: TunnelServiceHandler = TunnelServiceHandler(fallback_urls)
+        self.token_scheduler = TokenScheduler(self.auth_tokens,
+                                              rate=config.get('token_rate', DEFAULT_TOKEN_RATE),
+                                              burst=config.get('token_burst', DEFAULT_TOKEN_BURST),
+                                              quarantine_time=config.get('token_quarantine', DEFAULT_QUARANTINE_TIME))
+        self.alias_generator = alias_generator or AliasGenerator(filter_path=taken_aliases_path(config))
+        self.retry_policy, self.circuit_breakers = build_resilience(config)
+        self.preflight_cache = build_preflight_cache(config)
+        self.preflight_negative_ttl: float = config.get('preflight_negative_ttl', DEFAULT_PREFLIGHT_NEGATIVE_TTL)
+        self.preflight_by_host: bool = config.get('preflight_cache_by_host', True)
+        path = journal_path(config)
+        self.journal: Optional[MutationJournal] = MutationJournal(
+            path, config.get('journal_fsync_interval', DEFAULT_FSYNC_INTERVAL)) if path else None
+
+        self.max_concurrency: int = config.get('max_concurrency', DEFAULT_MAX_CONCURRENCY)
+        self.keep_alive: bool = config.get('keep_alive', True)
+        self.timeout = aiohttp.ClientTimeout(connect=config.get('connect_timeout', DEFAULT_TIMEOUT),
+                                             sock_read=config.get('read_timeout', DEFAULT_TIMEOUT))
+        self.token_headers: Dict[str, dict] = {token: self.build_headers(token) for token in self.auth_tokens}
+        self.sessions: Dict[str, aiohttp.ClientSession] = {}
+        self.preflight_session: Optional[aiohttp.ClientSession] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def open(self):
+        """
+        Sessions and the semaphore are bound to the running loop, so they can only be created inside it.
+        """
+        if self.semaphore:
+            return
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        for token in self.auth_tokens:
+            self.sessions[token] = self._build_session(self.token_headers[token])
+        self.preflight_session = self._build_session()
+
+    async def close(self):
+        for session in self.sessions.values():
+            await session.close()
+        if self.preflight_session:
+            await self.preflight_session.close()
+        self.sessions.clear()
+        self.preflight_session = None
+        self.semaphore = None
+        self.tunneling_service.close()
+        self.alias_generator.save()
+        self.alias_token_mapping.close()
+        if self.journal:
+            self.journal.close()
+
+    def _build_session(self, headers: Optional[dict] = None) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, force_close=not self.keep_alive)
+        return aiohttp.ClientSession(connector=connector, headers=headers, timeout=self.timeout)
+
+    def get_session(self, token: str) -> aiohttp.ClientSession:
+        if token not in self.sessions:
+            self.token_headers[token] = self.build_headers(token)
+            self.sessions[token] = self._build_session(self.token_headers[token])
+        return self.sessions[token]
+
+    def record_mutation(self, phase: str, op: str, **fields):
+        if self.journal:
+            self.journal.append(op, phase, **fields)
+
+    async def _send(self, method: str, request_url: str, token: Optional[str], payload: dict,
+                    retry_policy: RetryPolicy = None):
+        """
+        Async twin of ApiClient._send: circuit breaker, token scheduler and shared retry policy.
+
+        :return: (token used, status, json body or None)
+        """
+        retry_policy = retry_policy or self.retry_policy
+        breaker = self.circuit_breakers.get(request_url)
+        retry_policy.start()
+        attempt = 0
+        while True:
+            trial = breaker.before_call()
+            try:
+                if token:
+                    used_token, delay = token, self.token_scheduler.reserve_for(token)
+                else:
+                    used_token, delay = self.token_scheduler.reserve(preferred=self.pinned_token)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    async with self.semaphore:
+                        async with self.get_session(used_token).request(method, request_url,
+                                                                        data=json.dumps(payload)) as response:
+                            status = response.status
+                            retry_after = response.headers.get('Retry-After')
+                            try:
+                                body = await response.json(content_type=None)
+                            except ValueError:
+                                body = None
+                except (asyncio.TimeoutError, aiohttp.ClientConnectionError):
+                    breaker.record_failure()
+                    if not retry_policy.allow_retry(attempt):
+                        raise
+                    await asyncio.sleep(retry_policy.delay(attempt))
+                    attempt += 1
+                    continue
+
+                breaker.record_status(status)
+                rejected = True
+                if status == RATE_LIMITED:
+                    self.token_scheduler.report_rate_limited(used_token, retry_after)
+                elif status in UNAUTHORIZED:
+                    self.token_scheduler.report_unauthorized(used_token)
+                else:
+                    rejected = False
+                if rejected and not token and retry_policy.allow_retry(attempt):
+                    attempt += 1
+                    continue
+                if retry_policy.is_retryable_status(status) and retry_policy.allow_retry(attempt):
+                    if status != RATE_LIMITED:
+                        await asyncio.sleep(retry_policy.delay(attempt))
+                    attempt += 1
+                    continue
+                if status < 400:
+                    self.token_scheduler.report_success(used_token)
+                return used_token, status, body
+            finally:
+                breaker.release_trial(trial)  # Nothing recorded, e.g. invalid url or no usable token
+
+    async def create_tinyurl(self, target_url: str, expires_at: str = None, no_check: bool = False, ref: int = None):
+        """
+        :param ref: id of the tinyurl in the manager, stored in the journal so replay can rebuild it
+        """
+        await self.open()
+        request_url = f'{self.base_url}/create'
+        if not no_check:
+            await self.check_target_url(target_url)
+
+        collisions = 0
+        while True:
+            try:
+                alias = self.alias_generator.generate(collisions)
+                payload = create_payload(target_url, alias, expires_at)
+                self.record_mutation(INTENT, 'create', alias=alias, url=target_url, ref=ref)
+                token, status, body = await self._send('POST', request_url, None, payload)
+                if status >= 400:
+                    self.record_mutation(FAILED, 'create', alias=alias, ref=ref, status=status)
+                    errors = (body or {}).get('errors')
+                    if errors:
+                        if errors[0] == ALIAS_NOT_AVAILABLE:
+                            self.alias_generator.record_collision(alias)
+                            collisions += 1
+                            continue
+                        raise TinyUrlCreationError(errors, status)
+                    raise TinyUrlCreationError([f'{status} Error for url: {request_url}'], status)
+                data = response_data(body)
+                self.alias_generator.mark_taken(data['alias'])
+                self.alias_token_mapping[data['alias']] = token
+                self.record_mutation(DONE, 'create', alias=data['alias'], token=token, url=data['url'],
+                                     tiny_url=data.get('tiny_url'), ref=ref)
+                return data
+            except asyncio.TimeoutError:
+                raise NetworkError('Connection error. Request timed out!')
+            except aiohttp.ClientError as e:
+                raise RequestError(e)
+
+    async def update_tinyurl_redirect_service(self, alias: str, target_url: str, retry: int = 3):
+        return await self._change(alias, target_url, self.retry_policy.with_attempts(retry + 1))
+
+    async def update_tinyurl_redirect_user(self, alias: str, target_url: str):
+        await self.check_target_url(target_url)
+        return await self._change(alias, target_url)
+
+    async def _change(self, alias: str, target_url: str, retry_policy: RetryPolicy = None):
+        await self.open()
+        request_url = f'{self.base_url}/change'
+        payload = change_payload(alias, target_url)
+        token = self.alias_token_mapping[alias]  # Unknown alias raises KeyError, same as ApiClient
+        try:
+            self.record_mutation(INTENT, 'change', alias=alias, url=target_url)
+            _, status, body = await self._send('PATCH', request_url, token, payload, retry_policy)
+            if status >= 400:
+                self.record_mutation(FAILED, 'change', alias=alias, status=status)
+                errors = (body or {}).get('errors') or [f'{status} Error for url: {request_url}']
+                raise TinyUrlUpdateError(errors, status)
+            data = response_data(body)
+            self.record_mutation(DONE, 'change', alias=alias, url=data['url'])
+            return data
+        except asyncio.TimeoutError:
+            raise NetworkError('Connection error. Request timed out!')
+        except aiohttp.ClientError as e:
+            raise RequestError(e)
+
+    async def check_target_url(self, url: str, use_cache: bool = True):
+        key = preflight_cache_key(url, self.preflight_by_host)
+        if use_cache:
+            cached = self.preflight_cache.get(key, MISSING)
+            if cached is None:
+                return
+            if cached is not MISSING:
+                raise_preflight_failure(cached)
+        try:
+            await self._preflight(url)
+            self.preflight_cache.set(key, None)
+        except CircuitOpenError:
+            raise
+        except (RequestError, NetworkError) as e:
+            self.preflight_cache.set(key, preflight_failure(e), ttl=self.preflight_negative_ttl)
+            raise
+
+    def invalidate_preflight(self, url: str = None):
+        if url:
+            self.preflight_cache.invalidate(preflight_cache_key(url, self.preflight_by_host))
+        else:
+            self.preflight_cache.clear()
+
+    async def _preflight(self, url: str):
+        await self.open()
+        breaker = self.circuit_breakers.get(url)
+        trial = breaker.before_call()
+        try:
+            async with self.semaphore:
+                async with self.preflight_session.head(url) as response:
+                    breaker.record_status(response.status)
+                    if urlparse(str(response.url)).netloc == urlparse(url).netloc:
+                        return
+                    response.raise_for_status()
+        except aiohttp.ClientResponseError as e:
+            raise RequestError(f"Error: {e}")
+        except asyncio.TimeoutError:
+            breaker.record_failure()
+            raise NetworkError('Connection error. Request timed out!')
+        except aiohttp.ClientConnectionError:
+            breaker.record_failure()
+            raise RequestError("Unknown url", url=url)
+        except (aiohttp.ClientError, ValueError):
+            raise RequestError("Unknown url", url=url)
+        finally:
+            breaker.release_trial(trial)  # Invalid url says nothing about the host
+
+    async def check_redirect_url(self, url: str, target_domain: str, deep: bool = False) -> Optional[str]:
+        """
+        Async version of utility.url_network_tools.check_redirect_url
+        """
+        await self.open()
+        try:
+            async with self.semaphore:
+                async with self.preflight_session.head(url, allow_redirects=deep) as response:
+                    if deep:
+                        valid = get_final_domain(str(response.url)) == target_domain
+                    else:
+                        verdict, _ = classify_first_hop(url, response.status, response.headers.get('Location'),
+                                                        target_domain)
+                        valid = verdict == PROBE_OK
+                    if valid:
+                        return url
+        except (asyncio.TimeoutError, aiohttp.ClientError, ValueError):
+            return
+
+    def switch_auth_token(self, token_id):
+        self.token_selected = self.auth_tokens[token_id - 1]
+        self.pinned_token = self.token_selected
+
+    def get_token_usage(self) -> Dict[str, dict]:
+        return self.token_scheduler.usage()
+
+    @staticmethod
+    def build_headers(token: str) -> dict:
+        return {'Authorization': f'Bearer {token}',
+                'Content-Type': 'application/json',
+                'User-Agent': 'Google Chrome'
+                }
@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import time
+from threading import Lock, Thread, Event
+from typing import Dict, List, Optional
+
+logger = logging.getLogger('')
+
+DEFAULT_FSYNC_INTERVAL = 0.2
+
+INTENT = 'intent'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JournalState:
+    """
+    Result of a replay. Only the latest record of every alias matters, so replaying twice gives the same state.
+    """
+
+    def __init__(self):
+        self.alias_tokens: Dict[str, str] = {}
+        self.created: Dict[int, dict] = {}  # ref (tinyurl id): create response data
+        self.targets: Dict[str, str] = {}  # alias: latest confirmed target url
+        self.spares: Dict[str, dict] = {}  # alias: create response data, created without ref and not claimed yet
+        self.pending: Dict[tuple, dict] = {}  # (op, alias): intent without done/failed, claims included
+        self.records = 0
+
+
+class MutationJournal:
+    """
+    Append-only JSONL journal of api mutations. Every create/change is written as an intent before the request
+    and as done/failed after it, so after a crash we know what landed.
+
+    Records are written immediately but fsync'd in batches by a background thread every fsync_interval seconds.
+    """
+
+    def __init__(self, path: str, fsync_interval: float = DEFAULT_FSYNC_INTERVAL):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.fsync_interval = fsync_interval
+        self.lock = Lock()
+        self.file = open(path, 'a', encoding='utf-8')
+        self.dirty = False
+        self.closed = Event()
+        self.sync_thread = Thread(target=self._sync_loop, daemon=True)
+        self.sync_thread.start()
+
+    def append(self, op: str, phase: str, **fields):
+        record = {'ts': round(time.time(), 3), 'op': op, 'phase': phase, **fields}
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self.lock:
+            if self.file.closed:  # Background threads (spare refill) can outlive close on shutdown
+                logger.warning(f'Journal {self.path} is closed, {phase} {op} of {fields.get("alias")} not recorded')
+                return
+            self.file.write(line)
+            self.dirty = True
+
+    def sync(self):
+        with self.lock:
+            if not self.dirty or self.file.closed:
+                return
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.dirty = False
+
+    def _sync_loop(self):
+        while not self.closed.wait(self.fsync_interval):
+            self.sync()
+
+    def close(self):
+        self.closed.set()
+        self.sync()
+        with self.lock:
+            self.file.close()
+
+    def replay(self) -> JournalState:
+        self.sync()
+        return self._replay()
+
+    def _replay(self) -> JournalState:
+        state = JournalState()
+        for record in self._read_records():
+            state.records += 1
+            op, phase, alias = record.get('op'), record.get('phase'), record.get('alias')
+            if op == 'delete':
+                state.created.pop(record.get('ref'), None)
+                continue
+            if phase == INTENT:
+                state.pending[(op, alias)] = record
+                if op == 'claim':
+                    state.spares.pop(alias, None)  # May already point to its new target, never hand it out again
+                continue
+            intent = state.pending.pop((op, alias), None)
+            if phase != DONE:
+                if op == 'claim' and intent:  # Change was refused, pool put the spare back
+                    state.spares[alias] = {'alias': alias, 'url': intent['spare_url'],
+                                           'tiny_url': intent.get('tiny_url')}
+                continue
+            if op == 'create':
+                if record.get('token'):
+                    state.alias_tokens[alias] = record['token']
+                state.targets[alias] = record['url']
+                data = {'alias': alias, 'url': record['url'], 'tiny_url': record.get('tiny_url')}
+                if record.get('ref') is not None:
+                    state.created[record['ref']] = data
+                else:
+                    state.spares[alias] = data
+            elif op == 'claim':
+                state.spares.pop(alias, None)
+                state.created[record['ref']] = {'alias': alias, 'url': record['url'],
+                                                'tiny_url': record.get('tiny_url')}
+            elif op == 'change':
+                state.targets[alias] = record['url']
+        return state
+
+    def _read_records(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # Torn last line after a crash
+
+    def compact(self, records: List[dict]):
+        """
+        Atomically replaces the journal with the given records (current state), so it doesn't grow forever.
+        Intents that never got done/failed are carried over after them: the server may have applied them, and they
+        are the only trace of an alias that could be ours.
+        """
+        temp_path = f'{self.path}.tmp'
+        with self.lock:
+            if self.file.closed:
+                logger.warning(f'Journal {self.path} is closed, not compacted')
+                return
+            self.file.flush()
+            pending = list(self._replay().pending.values())
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                for record in records + pending:
+                    file.write(json.dumps(record, separators=(',', ':')) + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+            self.file.close()
+            os.replace(temp_path, self.path)
+            self.file = open(self.path, 'a', encoding='utf-8')
+            self.dirty = False
+
+
+def journal_path(config: dict) -> Optional[str]:
+    state_path = config.get('state_path')
+    if not state_path or not config.get('use_journal', True):
+        return None
+    return os.path.join(state_path, 'journal.jsonl')
@@ -0,0 +1,208 @@
+import random
+import time
+from threading import Lock
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from requests.exceptions import ConnectionError, Timeout
+
+from exceptions.tinyurl_exceptions import CircuitOpenError
+
+DEFAULT_ATTEMPTS = 3
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30
+DEFAULT_BUDGET_RATIO = 0.2
+DEFAULT_BUDGET_MIN = 10
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30
+
+RETRYABLE_STATUS = frozenset({408, 425, 429, 500, 502, 503, 504})
+RETRYABLE_EXCEPTIONS = (Timeout, ConnectionError)
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of regular traffic, so a brownout can't multiply the load by the number of
+    attempts. Every first attempt deposits ratio, every retry withdraws one, min_retries are always available.
+    """
+
+    def __init__(self, ratio: float = DEFAULT_BUDGET_RATIO, min_retries: int = DEFAULT_BUDGET_MIN):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.max_balance = float(min_retries * 10)
+        self.balance = float(min_retries)
+        self.lock = Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.balance = min(self.balance + self.ratio, self.max_balance)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            if self.balance < 1:
+                return False
+            self.balance -= 1
+            return True
+
+
+class RetryPolicy:
+    """
+    Shared retry rules: jittered exponential backoff, retry budget and classification of retryable errors.
+    """
+
+    def __init__(self, attempts: int = DEFAULT_ATTEMPTS, base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY, budget: Optional[RetryBudget] = None):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+
+    def with_attempts(self, attempts: int) -> 'RetryPolicy':
+        """
+        Same backoff and shared budget, different number of attempts.
+        """
+        return RetryPolicy(attempts, self.base_delay, self.max_delay, self.budget)
+
+    @staticmethod
+    def is_retryable_status(status_code: int) -> bool:
+        return status_code in RETRYABLE_STATUS
+
+    @staticmethod
+    def is_retryable_exception(exc: Exception) -> bool:
+        return isinstance(exc, RETRYABLE_EXCEPTIONS) and not isinstance(exc, CircuitOpenError)
+
+    def start(self):
+        self.budget.deposit()
+
+    def allow_retry(self, attempt: int) -> bool:
+        """
+        :param attempt: zero based index of the attempt that just failed
+        """
+        return attempt + 1 < self.attempts and self.budget.withdraw()
+
+    def delay(self, attempt: int) -> float:
+        """
+        Full jitter backoff: uniform(0, min(max_delay, base_delay * 2^attempt))
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def sleep(self, attempt: int):
+        time.sleep(self.delay(attempt))
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, host: str, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout: float = DEFAULT_RESET_TIMEOUT):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+        self.trials = 0  # Number of the last half-open trial, so a late release_trial can't free a newer one
+        self.lock = Lock()
+
+    def allow(self) -> bool:
+        return self.claim() is not None
+
+    def claim(self) -> Optional[int]:
+        """
+        :return: None if the call isn't allowed, else 0, or the number of the half-open trial it took. The trial ends
+            with record_success/record_failure, paths that don't record anything have to call release_trial.
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return 0
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.trial_running = False
+            if self.state == self.HALF_OPEN and not self.trial_running:
+                self.trial_running = True  # Single trial call decides whether host is back
+                self.trials += 1
+                return self.trials
+            return None
+
+    def is_open(self) -> bool:
+        """
+        Peek without taking the half-open trial slot.
+        """
+        with self.lock:
+            return self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def before_call(self) -> int:
+        """
+        :return: trial number for release_trial, see claim
+        """
+        trial = self.claim()
+        if trial is None:
+            raise CircuitOpenError(self.host)
+        return trial
+
+    def release_trial(self, trial: int):
+        """
+        Gives the half-open trial slot back when the call ended without telling anything about the host (invalid url,
+        no token, failure blamed on a later redirect hop...). No-op if the trial was already recorded, so it can go in
+        a finally. Without it the breaker would stay half-open and refuse every call for good.
+        """
+        if not trial:
+            return
+        with self.lock:
+            if self.trial_running and self.trials == trial:
+                self.trial_running = False
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def record_status(self, status_code: int):
+        if status_code >= 500:
+            self.record_failure()
+        else:
+            self.record_success()
+
+
+class CircuitBreakerRegistry:
+    """
+    One circuit breaker per host, created on first use.
+    """
+
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout: float = DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.lock = Lock()
+
+    def get(self, url: str) -> CircuitBreaker:
+        host = urlparse(url).netloc or url
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(host, self.failure_threshold, self.reset_timeout)
+            return self.breakers[host]
+
+    def record_exception(self, url: str, exc: Exception):
+        """
+        Blames the host that actually failed, which for redirect chains can be a later hop than url.
+        """
+        failed_request = getattr(exc, 'request', None)
+        failed_url = getattr(failed_request, 'url', None) or url
+        self.get(failed_url).record_failure()
+
+    def states(self) -> Dict[str, str]:
+        with self.lock:
+            return {host: breaker.state for host, breaker in self.breakers.items()}
@@ -0,0 +1,176 @@
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from typing import List, Dict, Optional, Tuple
+
+from exceptions.tinyurl_exceptions import NoTokenAvailable
+
+DEFAULT_TOKEN_RATE = 2.0
+DEFAULT_TOKEN_BURST = 10
+DEFAULT_QUARANTINE_TIME = 300
+DEFAULT_RETRY_AFTER = 60
+
+
+class TokenBucket:
+    """
+    Classic token bucket. Reservations may put the bucket into debt so callers get back how long to wait
+    instead of polling.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self, now: float) -> float:
+        delay = self.wait_time(now)
+        self.tokens -= 1
+        return delay
+
+
+class TokenState:
+    def __init__(self, rate: float, burst: int):
+        self.bucket = TokenBucket(rate, burst)
+        self.blocked_until = 0.0
+        self.quarantined_until = 0.0
+        self.requests = 0
+        self.successes = 0
+        self.rate_limited = 0
+        self.unauthorized = 0
+
+    def wait_time(self, now: float) -> float:
+        return max(self.blocked_until - now, self.bucket.wait_time(now))
+
+    def is_quarantined(self, now: float) -> bool:
+        return self.quarantined_until > now
+
+
+class TokenScheduler:
+    """
+    Spreads API calls over all auth tokens. Every token has its own token bucket, 429 responses block a token
+    until Retry-After passes and 401/403 responses quarantine it for a while.
+
+    reserve() methods never sleep, they return the delay to honor, so the same scheduler serves the threaded
+    ApiClient (acquire) and the asyncio client (reserve + asyncio.sleep).
+    """
+
+    def __init__(self, auth_tokens: List[str], rate: float = DEFAULT_TOKEN_RATE, burst: int = DEFAULT_TOKEN_BURST,
+                 quarantine_time: float = DEFAULT_QUARANTINE_TIME):
+        self.rate = rate
+        self.burst = burst
+        self.quarantine_time = quarantine_time
+        self.states: Dict[str, TokenState] = {token: TokenState(rate, burst) for token in auth_tokens}
+        self.lock = Lock()
+
+    def _state(self, token: str) -> TokenState:
+        if token not in self.states:
+            self.states[token] = TokenState(self.rate, self.burst)
+        return self.states[token]
+
+    def reserve(self, preferred: Optional[str] = None) -> Tuple[str, float]:
+        """
+        Picks the token that can send soonest. The preferred one wins only if it can send right away, a pinned token
+        that is rate limited must not hold up calls other tokens could make now.
+
+        :return: (token, seconds to wait before sending)
+        """
+        with self.lock:
+            now = time.monotonic()
+            available = [token for token, state in self.states.items() if not state.is_quarantined(now)]
+            if not available:
+                raise NoTokenAvailable(len(self.states))
+            if preferred in available and self.states[preferred].wait_time(now) <= 0:
+                token = preferred
+            else:
+                token = min(available, key=lambda t: (self.states[t].wait_time(now), self.states[t].requests))
+            return token, self._reserve_token(token, now)
+
+    def reserve_for(self, token: str) -> float:
+        """
+        Reservation for calls that must use a specific token (e.g. /change of an alias created with it).
+        """
+        with self.lock:
+            now = time.monotonic()
+            state = self._state(token)
+            if state.is_quarantined(now):
+                raise NoTokenAvailable(1)
+            return self._reserve_token(token, now)
+
+    def _reserve_token(self, token: str, now: float) -> float:
+        state = self.states[token]
+        state.requests += 1
+        return max(state.blocked_until - now, state.bucket.reserve(now))
+
+    def acquire(self, preferred: Optional[str] = None) -> str:
+        token, delay = self.reserve(preferred)
+        if delay > 0:
+            time.sleep(delay)
+        return token
+
+    def acquire_for(self, token: str):
+        delay = self.reserve_for(token)
+        if delay > 0:
+            time.sleep(delay)
+
+    def report_success(self, token: str):
+        with self.lock:
+            self._state(token).successes += 1
+
+    def report_rate_limited(self, token: str, retry_after: Optional[str] = None) -> float:
+        """
+        :return: seconds the token stays blocked
+        """
+        delay = parse_retry_after(retry_after)
+        with self.lock:
+            state = self._state(token)
+            state.rate_limited += 1
+            state.blocked_until = max(state.blocked_until, time.monotonic() + delay)
+        return delay
+
+    def report_unauthorized(self, token: str):
+        with self.lock:
+            state = self._state(token)
+            state.unauthorized += 1
+            state.quarantined_until = time.monotonic() + self.quarantine_time
+
+    def release_quarantine(self, token: str):
+        with self.lock:
+            self._state(token).quarantined_until = 0.0
+
+    def usage(self) -> Dict[str, dict]:
+        with self.lock:
+            now = time.monotonic()
+            return {token: {'requests': state.requests,
+                            'successes': state.successes,
+                            'rate_limited': state.rate_limited,
+                            'unauthorized': state.unauthorized,
+                            'quarantined': state.is_quarantined(now),
+                            'available_in': round(state.wait_time(now), 3)}
+                    for token, state in self.states.items()}
+
+
+def parse_retry_after(value: Optional[str], default: float = DEFAULT_RETRY_AFTER) -> float:
+    """
+    Retry-After is either delta seconds or an HTTP date.
+    """
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,48 @@
+import argparse
+import json
+import sys
+
+from utility.ansi_codes import AnsiCodes
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.compare',
+                                     description='Compares two benchmark result files, exit code 1 on regression')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.10, help='tolerated relative slowdown, default 10%%')
+    return parser.parse_args()
+
+
+def load_results(path: str) -> dict:
+    with open(path) as file:
+        report = json.load(file)
+    return {(result['scenario'], result['size'], result['workers']): result for result in report['results']}
+
+
+def relative_change(old: float, new: float) -> float:
+    return (new - old) / old if old else 0.0
+
+
+def main():
+    args = parse_args()
+    baseline = load_results(args.baseline)
+    candidate = load_results(args.candidate)
+    regressions = 0
+    for key in sorted(baseline.keys() & candidate.keys()):
+        old, new = baseline[key], candidate[key]
+        throughput = relative_change(old['throughput_ops'], new['throughput_ops'])
+        p95 = relative_change(old['p95_ms'], new['p95_ms'])
+        rss = relative_change(old['peak_rss_mb'], new['peak_rss_mb'])
+        regressed = throughput < -args.threshold or p95 > args.threshold or rss > args.threshold
+        regressions += regressed
+        color = AnsiCodes.RED if regressed else AnsiCodes.GREEN
+        print(f'{color}{key[0]:<11} size={key[1]:<7} workers={key[2]:<4} throughput {throughput:+.1%}  '
+              f'p95 {p95:+.1%}  rss {rss:+.1%}{AnsiCodes.RESET}')
+    for key in sorted(baseline.keys() ^ candidate.keys()):
+        print(f'{AnsiCodes.YELLOW}{key} only present in one of the files{AnsiCodes.RESET}')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import requests
+
+from config.config_loader import VERSION
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run',
+                                     description='Benchmarks tum against a local fakeapi server')
+    parser.add_argument('--scenarios', nargs='+', default=['create', 'ping_sweep', 'ping_sweep_async', 'fix_errors'])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000])
+    parser.add_argument('--workers', nargs='+', type=int, default=[8, 32])
+    parser.add_argument('--latency', default='fixed:0.005', help='fakeapi api latency spec')
+    parser.add_argument('--redirect-latency', default='fixed:0.002', help='fakeapi redirect latency spec')
+    parser.add_argument('--output', help='result file, default benchmarks/results/<version>-<timestamp>.json')
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_server(latency: str, redirect_latency: str):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, '-m', 'fakeapi', '--port', str(port), '--latency', latency,
+                                '--redirect-latency', redirect_latency],
+                               cwd=PROJECT_DIR, stdout=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            requests.get(f'{base_url}/_admin/stats', timeout=1)
+            return process, base_url, f'http://localhost:{port}/landing'
+        except requests.exceptions.RequestException:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('Fake api server did not start!')
+
+
+def run_case(scenario: str, base_url: str, landing_url: str, size: int, workers: int, results):
+    #  Runs in a fresh spawned process so peak RSS belongs to this case only
+    from benchmarks.scenarios import SCENARIOS, quiet_logging
+    quiet_logging()
+    results.put(SCENARIOS[scenario](base_url, landing_url, size, workers))
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return 'unknown'
+
+
+def main():
+    args = parse_args()
+    context = multiprocessing.get_context('spawn')
+    report = {'version': VERSION, 'revision': git_revision(), 'timestamp': datetime.now().isoformat(),
+              'python': platform.python_version(), 'platform': platform.platform(),
+              'fakeapi': {'latency': args.latency, 'redirect_latency': args.redirect_latency}, 'results': []}
+
+    for scenario in args.scenarios:
+        for size in args.sizes:
+            for workers in args.workers:
+                server, base_url, landing_url = start_fake_server(args.latency, args.redirect_latency)
+                try:
+                    results = context.Queue()
+                    process = context.Process(target=run_case,
+                                              args=(scenario, base_url, landing_url, size, workers, results))
+                    process.start()
+                    result = results.get()
+                    process.join()
+                finally:
+                    server.kill()
+                    server.wait()
+                result.update({'scenario': scenario, 'size': size, 'workers': workers})
+                report['results'].append(result)
+                print(f"{scenario:<11} size={size:<7} workers={workers:<4} "
+                      f"{result['throughput_ops']:>10.1f} ops/s  p50={result['p50_ms']:.1f}ms "
+                      f"p95={result['p95_ms']:.1f}ms p99={result['p99_ms']:.1f}ms "
+                      f"rss={result['peak_rss_mb']}MB errors={result['errors']}", flush=True)
+                if 'legacy_bytes_per_tinyurl' in result:
+                    print(f"{'':<11} bytes/tinyurl registry {result['legacy_registry_bytes_per_tinyurl']} -> "
+                          f"{result['registry_bytes_per_tinyurl']}, heartbeat "
+                          f"{result['legacy_heartbeat_bytes_per_tinyurl']} -> {result['heartbeat_bytes_per_tinyurl']}, "
+                          f"total {result['legacy_bytes_per_tinyurl']} -> {result['bytes_per_tinyurl']}", flush=True)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{VERSION}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'Results saved to {output}')
+
+
+if __name__ == '__main__':
+    main()
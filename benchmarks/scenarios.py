@@ -0,0 +1,374 @@
+import heapq
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import string
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+from threading import Lock, Thread
+from typing import Callable, Dict, Iterator, List
+from urllib.parse import urlparse
+
+import requests
+
+from services.heartbeat import HeartbeatService
+from tinyurl.tinyurl import TinyUrl
+from tinyurl.tum import TinyUrlManager
+from utility.events import ClearableEvent
+
+TOKEN = 'benchmark-token'
+SEED_CHUNK = 20_000
+LEASE_NODES = 3
+LEASE_TTL = 2
+LEASE_SHARDS = 16
+LEASE_PING_INTERVAL = 1
+LEASE_RUN_TIME = 16  # Seconds nodes run, the first one is killed halfway
+MEMORY_DOMAINS = 100  # Distinct target domains of the memory scenario fleet
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.samples: List[float] = []
+        self.errors = 0
+        self.lock = Lock()
+
+    def wrap(self, func: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                with self.lock:
+                    self.errors += 1
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                with self.lock:
+                    self.samples.append(elapsed)
+        return timed
+
+    def percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def bench_config(base_url: str, workers: int) -> dict:
+    return {'auth_tokens': [TOKEN], 'fallback_urls': [], 'api_base_url': base_url, 'ping_interval': 60,
+            'token_rate': 1_000_000, 'token_burst': 1_000_000, 'retry_base_delay': 0.01,
+            'pool_maxsize': max(16, workers), 'preflight_ttl': 600, 'probe_engine': 'threads',
+            'probe_concurrency': workers, 'probe_per_host': workers, 'max_threads': workers}
+
+
+def seed_fleet(base_url: str, landing_url: str, size: int, preview_share: float = 0.0) -> Dict[str, str]:
+    """
+    Puts size aliases straight into the fake server.
+
+    :return: alias: target url
+    """
+    fleet = {}
+    while len(fleet) < size:
+        fleet[''.join(random.choices(string.ascii_letters + string.digits, k=8))] = f'{landing_url}/{len(fleet)}'
+    aliases = list(fleet)
+    preview = set(random.sample(aliases, int(size * preview_share)))
+    for start in range(0, size, SEED_CHUNK):
+        chunk = aliases[start:start + SEED_CHUNK]
+        requests.post(f'{base_url}/_admin/seed', timeout=60,
+                      json={'token': TOKEN, 'aliases': {alias: fleet[alias] for alias in chunk},
+                            'preview': [alias for alias in chunk if alias in preview]})
+    return fleet
+
+
+def _heartbeat(base_url: str, landing_url: str, size: int, workers: int, preview_share: float,
+               probe_engine: str = 'threads'):
+    config = dict(bench_config(base_url, workers), probe_engine=probe_engine)
+    fleet = seed_fleet(base_url, landing_url, size, preview_share)
+    return _fleet_heartbeat(base_url, landing_url, fleet, workers, config)
+
+
+def _fleet_heartbeat(base_url: str, landing_url: str, fleet: Dict[str, str], workers: int, config: dict):
+    tum = TinyUrlManager(app_config=config)
+    tum.api_client.alias_token_mapping.update_many({alias: TOKEN for alias in fleet})
+    landing_domain = landing_url.split('/')[2]
+    load_data = {i + 1: {f'{base_url}/{alias}': landing_domain} for i, alias in enumerate(fleet)}
+    heartbeat = HeartbeatService(Queue(), ClearableEvent(), ClearableEvent(), tum.api_client, load_data=load_data,
+                                 config=config)
+    heartbeat.executor = ThreadPoolExecutor(max_workers=workers)
+    Thread(target=_drain_feedback, args=(heartbeat,), daemon=True).start()
+    return heartbeat
+
+
+def _drain_feedback(heartbeat: HeartbeatService):
+    """
+    Stands in for the cli thread that consumes heartbeat feedback, otherwise deletions block forever.
+    """
+    while True:
+        heartbeat.feedback_event.wait()
+        heartbeat.feedback_event.clear()
+        try:
+            heartbeat.shared_queue.get(timeout=1)
+            heartbeat.shared_queue.task_done()
+        except Empty:
+            pass
+
+
+def run_create(base_url: str, landing_url: str, size: int, workers: int) -> dict:
+    tum = TinyUrlManager(app_config=bench_config(base_url, workers))
+    recorder = LatencyRecorder()
+    tum.api_client.create_tinyurl = recorder.wrap(tum.api_client.create_tinyurl)
+    urls = [f'{landing_url}/{i}' for i in range(size)]
+    start = time.perf_counter()
+    result = tum.create_from_list(urls, wait_time=24 * 3600, max_workers=workers)
+    duration = time.perf_counter() - start
+    return summarize(recorder, duration, size, errors=len(result['errors']) + len(result['invalid_redirect']))
+
+
+def run_ping_sweep(base_url: str, landing_url: str, size: int, workers: int) -> dict:
+    heartbeat = _heartbeat(base_url, landing_url, size, workers, preview_share=0.0)
+    recorder = LatencyRecorder()
+    heartbeat.ping_check = recorder.wrap(heartbeat.ping_check)
+    start = time.perf_counter()
+    heartbeat._ping_sweep_thread_pool()
+    heartbeat.executor.shutdown(wait=True)  # Sweep stops waiting after 60 s, the benchmark waits for every probe
+    duration = time.perf_counter() - start
+    return summarize(recorder, duration, size, errors=len(heartbeat.errors) + len(heartbeat.preview_errors))
+
+
+def run_ping_sweep_async(base_url: str, landing_url: str, size: int, workers: int) -> dict:
+    """
+    Whole fleet through AsyncProbeEngine, workers is the concurrency limit. No per probe latencies here.
+    """
+    heartbeat = _heartbeat(base_url, landing_url, size, workers, preview_share=0.0, probe_engine='async')
+    recorder = LatencyRecorder()
+    start = time.perf_counter()
+    heartbeat._ping_sweep_async()
+    duration = time.perf_counter() - start
+    heartbeat.probe_engine.close()
+    return summarize(recorder, duration, size, errors=len(heartbeat.errors) + len(heartbeat.preview_errors))
+
+
+def run_fix_errors(base_url: str, landing_url: str, size: int, workers: int, preview_share: float = 0.1) -> dict:
+    heartbeat = _heartbeat(base_url, landing_url, size, workers, preview_share)
+    heartbeat._ping_sweep_thread_pool()
+    heartbeat.executor.shutdown(wait=True)
+    heartbeat.executor = ThreadPoolExecutor(max_workers=workers)
+    broken = len(heartbeat.errors) + len(heartbeat.preview_errors)
+    recorder = LatencyRecorder()
+    heartbeat.fix_tinyurl_redirect = recorder.wrap(heartbeat.fix_tinyurl_redirect)
+    start = time.perf_counter()
+    heartbeat._fix_errors_thread_pool()
+    heartbeat.executor.shutdown(wait=True)
+    duration = time.perf_counter() - start
+    return summarize(recorder, duration, broken, errors=len(heartbeat.errors) + len(heartbeat.preview_errors))
+
+
+def _lease_node(base_url: str, landing_url: str, fleet: Dict[str, str], workers: int, store_path: str,
+                node_id: str, probes):
+    """
+    One tum node of run_lease_failover, reports every sweep as [(node_id, tinyurl, time)].
+    """
+    quiet_logging()
+    config = dict(bench_config(base_url, workers), probe_engine='async', ping_interval=LEASE_PING_INTERVAL,
+                  ping_max_interval=LEASE_PING_INTERVAL, lease_store=store_path, lease_ttl=LEASE_TTL,
+                  lease_shards=LEASE_SHARDS, node_id=node_id)
+    heartbeat = _fleet_heartbeat(base_url, landing_url, fleet, workers, config)
+    sweep = heartbeat._ping_sweep
+
+    def reporting_sweep(tinyurl_ids: list = None):
+        probes.put([(node_id, heartbeat.id_url_mapping[tinyurl_id], time.time()) for tinyurl_id in tinyurl_ids
+                    if tinyurl_id in heartbeat.id_url_mapping])
+        sweep(tinyurl_ids)
+
+    heartbeat._ping_sweep = reporting_sweep
+    heartbeat.coordinator.start()
+    heartbeat.run_heartbeat_service()
+
+
+def run_lease_failover(base_url: str, landing_url: str, size: int, workers: int) -> dict:
+    """
+    LEASE_NODES node processes watch the same fleet through one lease store, the first one is killed halfway.
+    Errors are tinyurls probed by two nodes in the same cycle plus tinyurls nobody probed after the takeover.
+    """
+    fleet = seed_fleet(base_url, landing_url, size)
+    store_path = os.path.join(tempfile.mkdtemp(prefix='tum-leases-'), 'leases.db')
+    context = multiprocessing.get_context('spawn')
+    probes = context.Queue()
+    nodes = [context.Process(target=_lease_node, daemon=True,
+                             args=(base_url, landing_url, fleet, workers, store_path, f'node-{index}', probes))
+             for index in range(LEASE_NODES)]
+    by_tinyurl = defaultdict(list)
+    total = 0
+
+    def collect(seconds: float):
+        #  Reads while nodes run, a full pipe would stall them and killed nodes lose what they buffered
+        nonlocal total
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            try:
+                batch = probes.get(timeout=0.1)
+            except Empty:
+                continue
+            total += len(batch)
+            for node_id, tinyurl, probed_at in batch:
+                by_tinyurl[tinyurl].append((probed_at, node_id))
+
+    start = time.perf_counter()
+    for node in nodes:
+        node.start()
+    collect(LEASE_RUN_TIME / 2)
+    nodes[0].kill()  # No lease release, others take over once its leases expire
+    killed_at = time.time()
+    collect(LEASE_RUN_TIME / 2)
+    for node in nodes[1:]:
+        node.terminate()
+    duration = time.perf_counter() - start
+
+    double_probes = 0
+    for probed in by_tinyurl.values():
+        probed.sort()
+        double_probes += sum(1 for (first, first_node), (second, second_node) in zip(probed, probed[1:])
+                             if first_node != second_node and second - first < LEASE_PING_INTERVAL / 2)
+    taken_over = killed_at + 2 * LEASE_TTL + 2 * LEASE_PING_INTERVAL
+    orphaned = sum(1 for alias in fleet if not any(probed_at > taken_over
+                                                   for probed_at, _ in by_tinyurl[f'{base_url}/{alias}']))
+    result = summarize(LatencyRecorder(), duration, total, errors=double_probes + orphaned)
+    result.update(double_probes=double_probes, orphaned=orphaned)
+    return result
+
+
+class LegacyTinyUrl:
+    """
+    TinyUrl as it was before __slots__ (per instance __dict__), kept only for the memory scenario's comparison.
+    """
+
+    def __init__(self, new_id):
+        self.tinyurl = None
+        self.alias = None
+        self.domain = None
+        self.final_url = None
+        self.id = new_id
+
+
+def _memory_responses(base_url: str, size: int) -> Iterator[dict]:
+    """
+    Made up create responses, strings are made while tracing so both layouts pay for their own.
+    """
+    for i in range(size):
+        alias = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
+        yield {'url': f'https://www{i % MEMORY_DOMAINS}.example.com/page/{i}', 'alias': alias,
+               'tiny_url': f'{base_url}/{alias}'}
+
+
+def _legacy_registry(base_url: str, size: int) -> tuple:
+    """
+    Registry before the compact layout: dict of __dict__ TinyUrls, alias, tinyurl and domain indexes and domains that
+    aren't interned.
+
+    :return: (id: TinyUrl, indexes)
+    """
+    tinyurls, by_alias, by_tinyurl, by_domain, indexed = {}, {}, {}, {}, {}
+    for tinyurl_id, data in enumerate(_memory_responses(base_url, size), start=1):
+        tinyurl = LegacyTinyUrl(tinyurl_id)
+        tinyurl.final_url = data['url']
+        tinyurl.domain = '.'.join(urlparse(tinyurl.final_url).netloc.split('.')[-2:])
+        tinyurl.tinyurl = data['tiny_url']
+        tinyurl.alias = data['alias']
+        tinyurls[tinyurl_id] = tinyurl
+        indexed[tinyurl_id] = (tinyurl.alias, tinyurl.tinyurl, tinyurl.domain)
+        by_alias[tinyurl.alias] = tinyurl_id
+        by_tinyurl[tinyurl.tinyurl] = tinyurl_id
+        by_domain.setdefault(tinyurl.domain, set()).add(tinyurl_id)
+    return tinyurls, (by_alias, by_tinyurl, by_domain, indexed)
+
+
+def _legacy_heartbeat(tinyurls: Dict[int, LegacyTinyUrl], min_interval: float) -> tuple:
+    """
+    Heartbeat before the compact layout, everything keyed by the tinyurl string: target and id maps, scheduler due
+    times, intervals and heap.
+    """
+    targets, ids, due, intervals, heap = {}, {}, {}, {}, []
+    now = time.monotonic()
+    for tinyurl_id, tinyurl in tinyurls.items():
+        targets[tinyurl.tinyurl] = tinyurl.domain
+        ids[tinyurl.tinyurl] = tinyurl_id
+        intervals[tinyurl.tinyurl] = min_interval
+        due[tinyurl.tinyurl] = now + random.uniform(0, min_interval)
+        heapq.heappush(heap, (due[tinyurl.tinyurl], tinyurl.tinyurl))
+    return targets, ids, due, intervals, heap
+
+
+def run_memory(base_url: str, landing_url: str, size: int, workers: int) -> dict:
+    """
+    Bytes per tinyurl kept by the cli (registry of TinyUrl objects) and by heartbeat, measured with tracemalloc for
+    the current layout and for the legacy one (legacy_* keys). Nothing is sent to the api, tinyurls are loaded from
+    made up responses. workers doesn't matter here.
+    """
+    config = bench_config(base_url, workers)
+    tum = TinyUrlManager(app_config=config)
+    tracemalloc.start()
+    start = time.perf_counter()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for data in _memory_responses(base_url, size):
+        tinyurl = TinyUrl(tum.get_next_available_id())
+        tinyurl.load_created(data, log=False)
+        tum.id_tinyurl_mapping[tinyurl.id] = tinyurl
+    registry_bytes = tracemalloc.get_traced_memory()[0] - baseline
+
+    baseline = tracemalloc.get_traced_memory()[0]
+    heartbeat = HeartbeatService(Queue(), ClearableEvent(), ClearableEvent(), tum.api_client,
+                                 load_data=tum.build_load_data(), config=config)
+    heartbeat_bytes = tracemalloc.get_traced_memory()[0] - baseline  # load_data is gone, only what heartbeat keeps
+    duration = time.perf_counter() - start
+
+    baseline = tracemalloc.get_traced_memory()[0]
+    legacy_tinyurls, legacy_indexes = _legacy_registry(base_url, size)
+    legacy_registry_bytes = tracemalloc.get_traced_memory()[0] - baseline
+    baseline = tracemalloc.get_traced_memory()[0]
+    legacy_heartbeat = _legacy_heartbeat(legacy_tinyurls, heartbeat.scheduler.min_interval)
+    legacy_heartbeat_bytes = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    heartbeat.executor.shutdown(wait=False)
+    del legacy_heartbeat, legacy_tinyurls, legacy_indexes
+
+    result = summarize(LatencyRecorder(), duration, size, errors=0)
+    result.update(registry_bytes_per_tinyurl=round(registry_bytes / size, 1),
+                  heartbeat_bytes_per_tinyurl=round(heartbeat_bytes / size, 1),
+                  bytes_per_tinyurl=round((registry_bytes + heartbeat_bytes) / size, 1),
+                  legacy_registry_bytes_per_tinyurl=round(legacy_registry_bytes / size, 1),
+                  legacy_heartbeat_bytes_per_tinyurl=round(legacy_heartbeat_bytes / size, 1),
+                  legacy_bytes_per_tinyurl=round((legacy_registry_bytes + legacy_heartbeat_bytes) / size, 1))
+    return result
+
+
+SCENARIOS = {
+    'create': run_create,
+    'ping_sweep': run_ping_sweep,
+    'ping_sweep_async': run_ping_sweep_async,
+    'fix_errors': run_fix_errors,
+    'lease_failover': run_lease_failover,
+    'memory': run_memory,
+}
+
+
+def summarize(recorder: LatencyRecorder, duration: float, operations: int, errors: int) -> dict:
+    return {
+        'operations': operations,
+        'errors': errors + recorder.errors,
+        'duration_s': round(duration, 3),
+        'throughput_ops': round(operations / duration, 2) if duration else 0.0,
+        'p50_ms': round(recorder.percentile(0.50) * 1000, 2),
+        'p95_ms': round(recorder.percentile(0.95) * 1000, 2),
+        'p99_ms': round(recorder.percentile(0.99) * 1000, 2),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def quiet_logging():
+    logging.disable(logging.CRITICAL)
@@ -1,4 +1,5 @@
 import configparser
+import os
 from pathlib import Path
 
 from utility.file_manipulation import read_data_from_file
@@ -14,6 +15,7 @@ def load_config():
 
     #  PATH
     logs_path = config_file.get('Path', 'logs_path').strip()
+    state_path = config_file.get('Path', 'state_path', fallback='').strip()
     tokens_path = config_file.get('Path', 'auth_tokens_path').strip()
     fallback_urls_path = config_file.get('Path', 'fallback_urls_path').strip()
     tokens_seperator = config_file['Path']['auth_tokens_seperator'].strip().replace('__NEWLINE__', '\n')
@@ -21,23 +23,101 @@ def load_config():
 
     #  OPTIONS
     ping_interval = config_file['Options'].getint('ping_interval') or 60
-    max_threads = config_file['Options'].getint('max_threads') or 4
+    ping_max_interval = config_file.getint('Options', 'ping_max_interval', fallback=1800)
+    ping_backoff = config_file.getfloat('Options', 'ping_backoff', fallback=2.0)
+    max_threads = config_file['Options'].getint('max_threads') or 32
+    latency_threshold = config_file.getfloat('Options', 'latency_threshold', fallback=2.0)
+    probe_engine = config_file.get('Options', 'probe_engine', fallback='async').strip()
+    probe_concurrency = config_file.getint('Options', 'probe_concurrency', fallback=500)
+    probe_per_host = config_file.getint('Options', 'probe_per_host', fallback=200)
+    deep_check_interval = config_file.getint('Options', 'deep_check_interval', fallback=0)
+    fallback_probe_interval = config_file.getint('Options', 'fallback_probe_interval', fallback=60)
+    spare_pool_size = config_file.getint('Options', 'spare_pool_size', fallback=0)
+    heartbeat_shards = config_file.get('Options', 'heartbeat_shards', fallback='0').strip() or '0'
+    heartbeat_shards = (os.cpu_count() or 1) if heartbeat_shards == 'auto' else int(heartbeat_shards)
+    lease_store = config_file.get('Options', 'lease_store', fallback='').strip()
+    lease_ttl = config_file.getfloat('Options', 'lease_ttl', fallback=30)
+    lease_shards = config_file.getint('Options', 'lease_shards', fallback=64)
+    node_id = config_file.get('Options', 'node_id', fallback='').strip()
     terminal_emulator = (config_file['Options'].get('terminal_emulator') or 'gnome')
     use_log = config_file['Options'].get('logger').strip() or 'no'
     use_logger = False if use_log == 'no' else True
+    use_journal = config_file.getboolean('Options', 'journal', fallback=True)
+    journal_fsync_interval = config_file.getfloat('Options', 'journal_fsync_interval', fallback=0.2)
+
+    #  NETWORK
+    api_base_url = config_file.get('Network', 'api_base_url', fallback='').strip()
+    pool_connections = config_file.getint('Network', 'pool_connections', fallback=4)
+    pool_maxsize = config_file.getint('Network', 'pool_maxsize', fallback=16)
+    keep_alive = config_file.getboolean('Network', 'keep_alive', fallback=True)
+    connect_timeout = config_file.getfloat('Network', 'connect_timeout', fallback=3)
+    read_timeout = config_file.getfloat('Network', 'read_timeout', fallback=3)
+    max_concurrency = config_file.getint('Network', 'max_concurrency', fallback=1000)
+    token_rate = config_file.getfloat('Network', 'token_rate', fallback=2)
+    token_burst = config_file.getint('Network', 'token_burst', fallback=10)
+    token_quarantine = config_file.getfloat('Network', 'token_quarantine', fallback=300)
+    retry_attempts = config_file.getint('Network', 'retry_attempts', fallback=3)
+    retry_base_delay = config_file.getfloat('Network', 'retry_base_delay', fallback=0.5)
+    retry_max_delay = config_file.getfloat('Network', 'retry_max_delay', fallback=30)
+    retry_budget = config_file.getfloat('Network', 'retry_budget', fallback=0.2)
+    breaker_threshold = config_file.getint('Network', 'breaker_threshold', fallback=5)
+    breaker_reset = config_file.getfloat('Network', 'breaker_reset', fallback=30)
+    preflight_cache_size = config_file.getint('Network', 'preflight_cache_size', fallback=4096)
+    preflight_ttl = config_file.getfloat('Network', 'preflight_ttl', fallback=600)
+    preflight_negative_ttl = config_file.getfloat('Network', 'preflight_negative_ttl', fallback=30)
+    preflight_cache_by_host = config_file.getboolean('Network', 'preflight_cache_by_host', fallback=True)
 
     auth_tokens = read_data_from_file(tokens_path, tokens_seperator, allow_empty=False)
     fallback_urls = read_data_from_file(fallback_urls_path, fallback_urls_seperator)
 
     if not logs_path or logs_path == '~':
         logs_path = home_dir
+    if not state_path:
+        state_path = home_dir + '/.tum'
 
     return {
         'logs_path': logs_path,
+        'state_path': state_path,
         'ping_interval': ping_interval,
+        'ping_max_interval': ping_max_interval,
+        'ping_backoff': ping_backoff,
         'max_threads': max_threads,
+        'latency_threshold': latency_threshold,
+        'probe_engine': probe_engine,
+        'probe_concurrency': probe_concurrency,
+        'probe_per_host': probe_per_host,
+        'deep_check_interval': deep_check_interval,
+        'fallback_probe_interval': fallback_probe_interval,
+        'spare_pool_size': spare_pool_size,
+        'heartbeat_shards': heartbeat_shards,
+        'lease_store': lease_store,
+        'lease_ttl': lease_ttl,
+        'lease_shards': lease_shards,
+        'node_id': node_id,
         'terminal_emulator': terminal_emulator,
         'use_logger': use_logger,
+        'use_journal': use_journal,
+        'journal_fsync_interval': journal_fsync_interval,
         'auth_tokens': auth_tokens,
-        'fallback_urls': fallback_urls
+        'fallback_urls': fallback_urls,
+        'api_base_url': api_base_url,
+        'pool_connections': pool_connections,
+        'pool_maxsize': pool_maxsize,
+        'keep_alive': keep_alive,
+        'connect_timeout': connect_timeout,
+        'read_timeout': read_timeout,
+        'max_concurrency': max_concurrency,
+        'token_rate': token_rate,
+        'token_burst': token_burst,
+        'token_quarantine': token_quarantine,
+        'retry_attempts': retry_attempts,
+        'retry_base_delay': retry_base_delay,
+        'retry_max_delay': retry_max_delay,
+        'retry_budget': retry_budget,
+        'breaker_threshold': breaker_threshold,
+        'breaker_reset': breaker_reset,
+        'preflight_cache_size': preflight_cache_size,
+        'preflight_ttl': preflight_ttl,
+        'preflight_negative_ttl': preflight_negative_ttl,
+        'preflight_cache_by_host': preflight_cache_by_host
     }
@@ -76,3 +76,17 @@ class NetworkException(Exception):
     def __str__(self):
         return self.message
 
+
+class NoTokenAvailable(Exception):
+    def __init__(self, tokens_count):
+        self.message = f'{AnsiCodes.RED}No usable auth token! {tokens_count} token(s) quarantined after 401/403.'
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message
+
+
+class CircuitOpenError(NetworkError):
+    def __init__(self, host):
+        self.host = host
+        super().__init__(f'Circuit open for {host}, host is failing. Request not sent!')
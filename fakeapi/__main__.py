@@ -0,0 +1,32 @@
+import argparse
+
+from fakeapi.server import FakeTinyUrlServer, FakeApiConfig
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m fakeapi', description='Local fake TinyURL api for load testing')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', default='fixed:0', help='api latency, e.g. lognormal:-2.5,0.6')
+    parser.add_argument('--redirect-latency', default='fixed:0', help='redirect latency, e.g. uniform:0.01,0.05')
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--rate-5xx', type=float, default=0.0)
+    parser.add_argument('--collision-rate', type=float, default=0.0)
+    parser.add_argument('--preview-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    config = FakeApiConfig(latency=args.latency, redirect_latency=args.redirect_latency, rate_429=args.rate_429,
+                           rate_5xx=args.rate_5xx, collision_rate=args.collision_rate,
+                           preview_rate=args.preview_rate, retry_after=args.retry_after)
+    server = FakeTinyUrlServer(args.host, args.port, config)
+    print(f'Fake TinyURL api listening on {server.base_url}')
+    print(f'Set api_base_url = {server.base_url} in config.ini (or TUM_API_BASE_URL) '
+          f'and use {server.landing_url}/... as targets')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,268 @@
+import json
+import random
+import re
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+ALIAS_NOT_AVAILABLE = 'Alias is not available.'
+ALIAS_PATTERN = re.compile(r'^/([A-Za-z0-9_-]{5,30})/?$')
+
+
+def normalize_target(url: Optional[str]) -> Optional[str]:
+    """
+    Like TinyURL, accepts targets without scheme. Fake targets are local, so plain http is assumed.
+    """
+    if url and not urlparse(url).scheme.startswith('http'):
+        return f'http://{url}'
+    return url
+
+
+class LatencyModel:
+    """
+    Latency distribution given as '<kind>:<params>':
+        fixed:0.05             - always 50 ms
+        uniform:0.01,0.2       - uniform between 10 and 200 ms
+        normal:0.1,0.03        - mean, standard deviation
+        lognormal:-2.5,0.6     - mu, sigma of the underlying normal (long tail, like real networks)
+    """
+
+    def __init__(self, spec: str = 'fixed:0'):
+        kind, _, params = spec.partition(':')
+        self.kind = kind
+        self.params = [float(param) for param in params.split(',') if param]
+        if kind not in ('fixed', 'uniform', 'normal', 'lognormal'):
+            raise ValueError(f'Unknown latency distribution: {spec}')
+
+    def sample(self) -> float:
+        if self.kind == 'fixed':
+            return self.params[0] if self.params else 0.0
+        if self.kind == 'uniform':
+            return random.uniform(*self.params)
+        if self.kind == 'normal':
+            return max(0.0, random.gauss(*self.params))
+        return random.lognormvariate(*self.params)
+
+
+class FakeApiConfig:
+    def __init__(self, latency: str = 'fixed:0', redirect_latency: str = 'fixed:0', rate_429: float = 0.0,
+                 rate_5xx: float = 0.0, collision_rate: float = 0.0, preview_rate: float = 0.0,
+                 retry_after: int = 1):
+        """
+        :param latency: LatencyModel spec for /create and /change
+        :param redirect_latency: LatencyModel spec for tinyurl redirects, preview and landing pages
+        :param rate_429: share of api calls answered with 429 and Retry-After
+        :param rate_5xx: share of api calls answered with 500/502/503
+        :param collision_rate: share of /create calls answered with 'Alias is not available.'
+        :param preview_rate: share of new aliases that get stuck on the preview page
+        """
+        self.latency = LatencyModel(latency)
+        self.redirect_latency = LatencyModel(redirect_latency)
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.collision_rate = collision_rate
+        self.preview_rate = preview_rate
+        self.retry_after = retry_after
+
+
+class FakeTinyUrlState:
+    def __init__(self):
+        self.lock = Lock()
+        self.aliases: Dict[str, dict] = {}  # alias: {'url', 'token', 'preview'}
+        self.stats = Counter()
+
+
+class FakeTinyUrlHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # Headers and body are separate writes, avoid delayed-ACK stalls
+    server: 'FakeTinyUrlServer'
+
+    def log_message(self, format, *args):
+        pass
+
+    #  API
+    def do_POST(self):
+        if self.path == '/create':
+            self._api_call(self._create)
+        elif self.path == '/_admin/preview':
+            self._admin_preview()
+        elif self.path == '/_admin/seed':
+            self._admin_seed()
+        else:
+            self._send_json(404, {'errors': ['Not found']})
+
+    def do_PATCH(self):
+        if self.path == '/change':
+            self._api_call(self._change)
+        else:
+            self._send_json(404, {'errors': ['Not found']})
+
+    def _api_call(self, handler):
+        config = self.server.config
+        body = self._read_json()
+        time.sleep(config.latency.sample())
+        token = self.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not token:
+            return self._send_json(401, {'errors': ['Unauthenticated.']})
+        roll = random.random()
+        if roll < config.rate_429:
+            return self._send_json(429, {'errors': ['Too Many Attempts.']}, {'Retry-After': str(config.retry_after)})
+        if roll < config.rate_429 + config.rate_5xx:
+            return self._send_json(random.choice((500, 502, 503)), {'errors': ['Server Error']})
+        handler(body or {}, token)
+
+    def _create(self, body: dict, token: str):
+        config = self.server.config
+        state = self.server.state
+        alias = body.get('alias')
+        url = normalize_target(body.get('url'))
+        if not url:
+            return self._send_json(422, {'errors': ['The url field is required.']})
+        with state.lock:
+            if alias in state.aliases or random.random() < config.collision_rate:
+                state.stats['collisions'] += 1
+                return self._send_json(422, {'errors': [ALIAS_NOT_AVAILABLE]})
+            state.aliases[alias] = {'url': url, 'token': token, 'preview': random.random() < config.preview_rate}
+            state.stats['created'] += 1
+        self._send_json(200, {'data': self._alias_data(alias, url)})
+
+    def _change(self, body: dict, token: str):
+        state = self.server.state
+        alias = body.get('alias')
+        with state.lock:
+            record = state.aliases.get(alias)
+            if not record:
+                return self._send_json(404, {'errors': ['Alias not found.']})
+            if record['token'] != token:
+                return self._send_json(403, {'errors': ['This action is unauthorized.']})
+            record['url'] = normalize_target(body.get('url'))
+            record['preview'] = False  # Re-submitting a redirect clears the preview page
+            state.stats['changed'] += 1
+        self._send_json(200, {'data': self._alias_data(alias, record['url'])})
+
+    def _alias_data(self, alias: str, url: str) -> dict:
+        return {'domain': 'tinyurl.com', 'alias': alias, 'url': url,
+                'tiny_url': f'{self.server.base_url}/{alias}'}
+
+    def _admin_preview(self):
+        """
+        Forces (or clears) the preview page of an alias: {"alias": "...", "enabled": true}
+        """
+        body = self._read_json() or {}
+        with self.server.state.lock:
+            record = self.server.state.aliases.get(body.get('alias'))
+            if record:
+                record['preview'] = bool(body.get('enabled', True))
+        self._send_json(200 if record else 404, {'data': body})
+
+    def _admin_seed(self):
+        """
+        Bulk insert without going through /create: {"token": "...", "aliases": {alias: url}, "preview": [aliases]}
+        """
+        body = self._read_json() or {}
+        preview = set(body.get('preview', []))
+        with self.server.state.lock:
+            for alias, url in body.get('aliases', {}).items():
+                self.server.state.aliases[alias] = {'url': url, 'token': body.get('token'), 'preview': alias in preview}
+        self._send_json(200, {'data': {'seeded': len(body.get('aliases', {}))}})
+
+    #  Redirects
+    def do_HEAD(self):
+        self._redirect_call(send_body=False)
+
+    def do_GET(self):
+        if self.path == '/_admin/stats':
+            with self.server.state.lock:
+                stats = dict(self.server.state.stats, aliases=len(self.server.state.aliases))
+            return self._send_json(200, {'data': stats})
+        self._redirect_call(send_body=True)
+
+    def _redirect_call(self, send_body: bool):
+        state = self.server.state
+        time.sleep(self.server.config.redirect_latency.sample())
+        path = urlparse(self.path).path
+        if path.startswith('/landing') or path.startswith('/preview/'):
+            state.stats['pages'] += 1
+            return self._send_page(200, 'Preview' if path.startswith('/preview/') else 'Landing', send_body)
+        match = ALIAS_PATTERN.match(path)
+        with state.lock:
+            record = state.aliases.get(match.group(1)) if match else None
+        if not record:
+            return self._send_page(404, 'Not found', send_body)
+        state.stats['redirects'] += 1
+        if record['preview']:
+            location = f'{self.server.base_url}/preview/{match.group(1)}'
+        else:
+            location = record['url']
+        self.send_response(301)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    #  Helpers
+    def _read_json(self) -> Optional[dict]:
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return None
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return None
+
+    def _send_json(self, status: int, body: dict, headers: Optional[dict] = None):
+        self.server.state.stats[f'status_{status}'] += 1
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_page(self, status: int, title: str, send_body: bool):
+        payload = f'<html><title>{title}</title></html>'.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(payload)
+
+
+class FakeTinyUrlServer(ThreadingHTTPServer):
+    """
+    Local stand-in for api.tinyurl.com and tinyurl.com.
+
+    The same server answers the api (/create, /change) and redirects (/<alias>), so only api_base_url has to point at
+    base_url: tiny_url in the responses already carries base_url. Targets under landing_url (a different host name for
+    the same server) are served locally, which keeps the whole redirect chain offline.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, config: Optional[FakeApiConfig] = None):
+        super().__init__((host, port), FakeTinyUrlHandler)
+        self.config = config or FakeApiConfig()
+        self.state = FakeTinyUrlState()
+        self.thread: Optional[Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.server_address[0]}:{self.server_port}'
+
+    @property
+    def landing_url(self) -> str:
+        return f'http://localhost:{self.server_port}/landing'
+
+    def start(self) -> 'FakeTinyUrlServer':
+        self.thread = Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,121 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Hashable, Iterable, List, Optional, Set
+
+from requests.exceptions import RequestException
+
+from api.apiclient import ApiClient
+from exceptions.tinyurl_exceptions import NetworkError, RequestError
+
+DEFAULT_DOMAIN_FAILURES = 3
+
+
+class DomainHealth:
+    """
+    Health of target domains shared by many tinyurls. Every domain is checked once per check_interval with
+    a single request to a known url of it (learned from probes), the verdict applies to all of its tinyurls.
+    Only network errors and 5xx count as down, a 4xx page still means the host is up.
+
+    One failed check only makes a domain suspect, it is down after failure_threshold failed checks in a row (or once
+    the host's circuit breaker is open). Suspect domains are checked again on every refresh.
+    """
+
+    def __init__(self, api_client: ApiClient, check_interval: float, failure_threshold: int = DEFAULT_DOMAIN_FAILURES):
+        self.api_client = api_client
+        self.check_interval = check_interval
+        self.failure_threshold = failure_threshold
+        self.sample_urls: Dict[str, str] = {}  # domain: url on it that a tinyurl redirected to
+        self.last_check: Dict[str, float] = {}
+        self.failures: Dict[str, int] = {}  # domain: failed checks in a row
+        self.down: Set[str] = set()
+
+    def remember(self, domain: str, url: str):
+        if domain not in self.sample_urls and url:
+            self.sample_urls[domain] = url
+
+    def forget(self, domain: str):
+        self.sample_urls.pop(domain, None)
+        self.last_check.pop(domain, None)
+        self.failures.pop(domain, None)
+        self.down.discard(domain)
+
+    def is_healthy(self, domain: str) -> bool:
+        """
+        :return: True if the last check of domain passed
+        """
+        return domain in self.last_check and not self.failures.get(domain)
+
+    @staticmethod
+    def group(target_mapping: Dict[Hashable, str], domains: Iterable[str]) -> Dict[str, List[Hashable]]:
+        """
+        :param target_mapping: tinyurl (or its id): target domain
+        :return: domain: keys of tinyurls pointing at it, only for given domains
+        """
+        domains = set(domains)
+        grouped = {domain: [] for domain in domains}
+        for key, domain in target_mapping.items():
+            if domain in domains:
+                grouped[domain].append(key)
+        return grouped
+
+    def is_up(self, domain: str) -> bool:
+        url = self.sample_urls[domain]
+        breaker = self.api_client.circuit_breakers.get(url)
+        if breaker.is_open():
+            return False
+        try:
+            response = self.api_client.preflight_session.head(url, timeout=self.api_client.timeout)
+            breaker.record_status(response.status_code)
+            return response.status_code < 500
+        except RequestException as e:
+            if self.api_client.retry_policy.is_retryable_exception(e):
+                self.api_client.circuit_breakers.record_exception(url, e)
+                return False
+            return True  # Our request was bad (e.g. invalid url), not the host
+
+    def refresh(self, domains: Iterable[str], executor: ThreadPoolExecutor) -> Set[str]:
+        """
+        Checks domains that weren't checked within check_interval, one request per domain.
+
+        :return: domains currently down (among all known ones)
+        """
+        now = time.monotonic()
+        stale = [domain for domain in set(domains) if domain in self.sample_urls
+                 and (self._suspect(domain) or now - self.last_check.get(domain, 0) >= self.check_interval)]
+        limiter = self.api_client.concurrency_limiter
+        futures = {executor.submit(limiter.run, self.is_up, domain): domain for domain in stale}
+        wait(futures)
+        for future, domain in futures.items():
+            self.last_check[domain] = now
+            if future.exception() or future.result():
+                self.failures.pop(domain, None)
+                self.down.discard(domain)
+                continue
+            self.failures[domain] = self.failures.get(domain, 0) + 1
+            if self.failures[domain] >= self.failure_threshold or self._breaker_open(domain):
+                self.down.add(domain)
+        return set(self.down)
+
+    def _suspect(self, domain: str) -> bool:
+        return bool(self.failures.get(domain)) and domain not in self.down
+
+    def _breaker_open(self, domain: str) -> bool:
+        return self.api_client.circuit_breakers.get(self.sample_urls[domain]).is_open()
+
+    def pick_fallback(self) -> Optional[str]:
+        """
+        Best scoring fallback that passes a fresh preflight. Preflight results feed the fallback pool's health.
+        """
+        tunneling_service = self.api_client.tunneling_service
+        choice = tunneling_service.choose()
+        if not choice:
+            return None
+        for url in [choice] + tunneling_service.ranked(exclude=[choice]):
+            start = time.monotonic()
+            try:
+                self.api_client.check_target_url(url, use_cache=False)
+                tunneling_service.record_success(url, time.monotonic() - start)
+                return url
+            except (RequestError, NetworkError):
+                tunneling_service.record_failure(url)
+        return None
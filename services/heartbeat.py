@@ -1,7 +1,7 @@
 import concurrent.futures
 import os
-import random
 import signal
+import sys
 import time
 import logging
 from concurrent.futures import wait, ALL_COMPLETED
@@ -10,14 +10,22 @@ from subprocess import Popen
 from threading import Event, Thread
 from urllib.parse import urlparse
 
-import requests
 from requests.exceptions import RequestException, HTTPError, Timeout
 
 from api.apiclient import ApiClient
+from services.domain_health import DomainHealth, DEFAULT_DOMAIN_FAILURES
+from services.leases import LeaseCoordinator, DEFAULT_LEASE_SHARDS, DEFAULT_LEASE_TTL
+from services.probe_engine import AsyncProbeEngine, DEFAULT_PROBE_CONCURRENCY, DEFAULT_PROBE_PER_HOST
+from services.probe_scheduler import ProbeScheduler, DEFAULT_MAX_INTERVAL, DEFAULT_BACKOFF
+from services.spare_pool import SparePool
 from utility import package_installer
-from utility.url_tools import get_final_domain
+from utility.url_tools import get_final_domain, classify_redirect, classify_first_hop, PROBE_OK, PROBE_PREVIEW, \
+    PROBE_WRONG_DOMAIN, PROBE_ERROR
 from utility.ansi_codes import AnsiCodes
-from exceptions.tinyurl_exceptions import TinyUrlUpdateError, NetworkError, RequestError
+from utility.events import ClearableEvent
+from utility.id_map import IdMap
+from exceptions.tinyurl_exceptions import TinyUrlUpdateError, NetworkError, RequestError, NoTokenAvailable, \
+    CircuitOpenError
 
 SUCCESS = 25
 logger = logging.getLogger('')
@@ -26,28 +34,56 @@ app_config = None
 
 class HeartbeatService:
 
-    def __init__(self, shared_queue: Queue, control_event: Event, feedback_event: Event,
-                 api_client: ApiClient = None, load_data: dict = None, config: dict = None):
+    def __init__(self, shared_queue: Queue, control_event: ClearableEvent, feedback_event: ClearableEvent,
+                 api_client: ApiClient = None, load_data: dict = None, config: dict = None,
+                 spare_pool: SparePool = None):
         global app_config
         app_config = config
         self.control_event = control_event
         self.feedback_event = feedback_event
         self.shared_queue = shared_queue
         self.delay = app_config['ping_interval']
-        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=app_config['ping_interval'])
+        self.limiter = api_client.concurrency_limiter  # Shared with bulk create, adapts to latency and errors
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.limiter.max_limit)
+        self.last_concurrency_target = None
         self.queue_data = {}
         self.last_sweep = time.time()
         self.api_client = api_client
-        self.tinyurl_target_mapping = {}
-        self.tinyurl_id_mapping = {}
+        self.spare_pool = spare_pool  # Tinyurls that can't be fixed are replaced from it instead of deleted
+        # Everything per tinyurl is keyed by its id, the tinyurl string itself is kept only once
+        self.id_url_mapping = IdMap()
+        self.id_target_mapping = IdMap()  # id: target domain (interned)
+        self.scheduler = ProbeScheduler(min_interval=app_config.get('ping_min_interval') or self.delay,
+                                        max_interval=app_config.get('ping_max_interval', DEFAULT_MAX_INTERVAL),
+                                        backoff=app_config.get('ping_backoff', DEFAULT_BACKOFF))
         if load_data:
-            self.tinyurl_target_mapping.update({key: value for _, nested_dict in load_data.items()
-                                                for key, value in nested_dict.items()})
-            self.tinyurl_id_mapping.update({url: inner_key for inner_key, nested_dict in load_data.items()
-                                            for url in nested_dict})
+            self.load_list(load_data)
+        self.deep_check_interval = app_config.get('deep_check_interval', 0)  # 0: first hop only
+        self.domain_health = DomainHealth(api_client, check_interval=app_config.get('domain_check_interval')
+                                          or self.delay,
+                                          failure_threshold=app_config.get('domain_failure_threshold',
+                                                                           DEFAULT_DOMAIN_FAILURES))
+        self.displaced = IdMap()  # id: (domain, url) it redirected to before its domain went down
+        self.last_deep_check = IdMap()
+        self.probe_engine = None
+        if app_config.get('probe_engine', 'async') == 'async':
+            self.probe_engine = AsyncProbeEngine(api_client.circuit_breakers,
+                                                 concurrency=app_config.get('probe_concurrency',
+                                                                            DEFAULT_PROBE_CONCURRENCY),
+                                                 per_host=app_config.get('probe_per_host', DEFAULT_PROBE_PER_HOST),
+                                                 timeout=app_config.get('read_timeout', 3))
+        self.coordinator = None  # With a lease store, nodes split tinyurls and each probes only its own shards
+        if app_config.get('lease_store'):
+            self.coordinator = LeaseCoordinator(app_config['lease_store'], node_id=app_config.get('node_id'),
+                                                shards=app_config.get('lease_shards', DEFAULT_LEASE_SHARDS),
+                                                ttl=app_config.get('lease_ttl', DEFAULT_LEASE_TTL),
+                                                handover_grace=self.scheduler.min_interval)
         self.errors = {}
         self.preview_errors = {}
         self.terminate = False
+        self.wakeup = Event()  # Set on anything that can change what is due: new tinyurl, ping, delay, exit
+        self.started = Event()
+        self.stopped = Event()
 
     def _consumer_thread(self):
         self.terminate = False
@@ -63,128 +99,364 @@ class HeartbeatService:
 
     def run_heartbeat_service(self):
         """
-        Initial loop is a sleeper that only checks for control event
+        Probes only tinyurls that are due according to scheduler. In between it waits until the next one
+        is due or until wakeup is set, whichever comes first, nothing is polled.
         :return:
         """
-        while True:
-            while not self.tinyurl_target_mapping:
-                time.sleep(1)
-
-            while time.time() - self.last_sweep < float(self.delay):
-                time.sleep(1)
+        while not self.terminate:
+            self.wakeup.clear()  # Before pop_due, so a message arriving meanwhile is not lost
+            due = self.scheduler.pop_due()
+            if not due:
+                self.wakeup.wait(self.scheduler.next_due())
+                continue
 
-            self._ping_sweep_thread_pool()  # Here errors are assigned if any
+            due = self._owned(due)
+            due = self._check_domains(due)
+            self._ping_sweep(due)  # Here errors are assigned if any
             self._fix_errors_thread_pool()
 
             if self.queue_data:
                 self._enqueue_data()
 
-    def ping_check(self, tinyurl, verbose=False):
+    def ping_check(self, tinyurl_id, verbose=False, deep=False):
+        """
+        Only asks tinyurl where it redirects (status and Location), deep check follows the whole chain.
+        """
+        tinyurl = self.id_url_mapping[tinyurl_id]
+        breaker = self.api_client.circuit_breakers.get(tinyurl)
+        trial = breaker.claim()
+        if trial is None:
+            return  # Tinyurl host is down, verdict would be meaningless
         try:
             if verbose:
                 logger.info(f'Ping checking {tinyurl} if it redirects to'
-                            f' {self.tinyurl_target_mapping[tinyurl]}')
-            response = requests.head(tinyurl, timeout=3, allow_redirects=True)
-
-            response_domain = get_final_domain(response.url)
-            intended_domain = self.tinyurl_target_mapping[tinyurl]
-
-            if 'tinyurl' in response_domain.split('.'):
-                self.preview_errors[tinyurl] = 'https://' + intended_domain \
-                    if not urlparse(intended_domain).scheme else intended_domain
-            elif response_domain != intended_domain:
-                self.errors[tinyurl] = 'https://' + intended_domain if not urlparse(intended_domain).scheme else intended_domain
+                            f' {self.id_target_mapping[tinyurl_id]}')
+            response = self.api_client.preflight_session.head(tinyurl, timeout=3, allow_redirects=deep)
+            intended_domain = self.id_target_mapping[tinyurl_id]
+            if deep:
+                breaker.record_success()
+                verdict, detail = classify_redirect(tinyurl, response.url, intended_domain), response.url
             else:
-                return True
+                breaker.record_status(response.status_code)
+                verdict, detail = classify_first_hop(tinyurl, response.status_code,
+                                                     response.headers.get('Location'), intended_domain)
+            return self._apply_verdict(tinyurl_id, verdict, detail)
 
         except HTTPError as e:
-            self.errors[tinyurl] = f"HTTP Error: {e}"
-        except Timeout:
-            self.errors[tinyurl] = "Request timed out!"
+            breaker.record_success()
+            self.errors[tinyurl_id] = f"HTTP Error: {e}"
+        except Timeout as e:
+            self.api_client.circuit_breakers.record_exception(tinyurl, e)
+            self.limiter.record_overload()
+            self.errors[tinyurl_id] = "Request timed out!"
         except RequestException as e:
-            self.errors[tinyurl] = f"Request Exception: {e}"
+            if self.api_client.retry_policy.is_retryable_exception(e):
+                self.api_client.circuit_breakers.record_exception(tinyurl, e)
+            else:
+                breaker.record_success()
+            self.errors[tinyurl_id] = f"Request Exception: {e}"
         except ValueError as e:
             raise e
+        finally:
+            breaker.release_trial(trial)  # Failure blamed on a later hop leaves this host's trial unrecorded
+
+    def _apply_verdict(self, tinyurl_id, verdict, detail=None):
+        """
+        Puts tinyurl into errors/preview_errors according to the probe verdict.
+
+        :return: True if tinyurl redirects where it should
+        """
+        intended_domain = self.id_target_mapping.get(tinyurl_id)
+        if intended_domain is None:
+            return  # Deleted meanwhile
+        target = 'https://' + intended_domain if not urlparse(intended_domain).scheme else intended_domain
+        if verdict == PROBE_OK:
+            self.domain_health.remember(intended_domain, detail)
+            return True
+        if verdict == PROBE_PREVIEW:
+            self.preview_errors[tinyurl_id] = target
+        elif verdict == PROBE_WRONG_DOMAIN:
+            self.errors[tinyurl_id] = target
+        elif verdict == PROBE_ERROR:
+            self.errors[tinyurl_id] = detail
+
+    def _owned(self, tinyurl_ids: list) -> list:
+        """
+        Leaves out tinyurls of shards another node holds, they are looked at again later in case that lease expires.
+        Repairs published by other nodes are applied first.
+        """
+        if not self.coordinator:
+            return tinyurl_ids
+        repairs = self.coordinator.pull_targets()
+        if repairs:
+            # Other nodes know tinyurls by url only, no reverse index is kept for these rare lookups
+            url_id_mapping = {tinyurl: tinyurl_id for tinyurl_id, tinyurl in self.id_url_mapping.items()}
+            for tinyurl, full_url, domain in repairs:
+                tinyurl_id = url_id_mapping.get(tinyurl)
+                if tinyurl_id is not None and self.id_target_mapping[tinyurl_id] != domain:
+                    self.id_target_mapping[tinyurl_id] = sys.intern(domain)
+                    if self.displaced.get(tinyurl_id, ('',))[0] == domain:
+                        self.displaced.pop(tinyurl_id)  # Moved back by the other node
+                    self.queue_data[tinyurl.split('/')[-1]] = {'full_url': full_url, 'domain': domain}
+        owned = []
+        for tinyurl_id in tinyurl_ids:
+            if tinyurl_id in self.id_url_mapping and self.coordinator.owns(self.id_url_mapping[tinyurl_id]):
+                owned.append(tinyurl_id)
+            else:
+                self.scheduler.add(tinyurl_id)
+        return owned
+
+    def _may_repair(self, tinyurl_id) -> bool:
+        """
+        Lease can be lost during a sweep, only the current owner sends /change.
+        """
+        return not self.coordinator or self.coordinator.owns(self.id_url_mapping[tinyurl_id])
+
+    def _check_domains(self, tinyurl_ids: list) -> list:
+        """
+        One check per distinct target domain of tinyurls. Every tinyurl of a domain that is down is moved
+        to a fallback as a batch, tinyurls moved earlier go back once their domain is healthy again.
+
+        :return: ids of tinyurls that still need their own probe, all but the moved ones
+        """
+        domains = {self.id_target_mapping[tinyurl_id] for tinyurl_id in tinyurl_ids
+                   if tinyurl_id in self.id_target_mapping}
+        displaced_domains = {domain for domain, _ in self.displaced.values()}
+        down = self.domain_health.refresh(domains | displaced_domains, self.executor)
+        self._restore_displaced(displaced_domains - down)
+        down &= domains
+        if not down:
+            return tinyurl_ids
+        moved = self._fix_domains(down)
+        return [tinyurl_id for tinyurl_id in tinyurl_ids if tinyurl_id not in moved]
+
+    def _fix_domains(self, domains: set) -> set:
+        """
+        Without a working fallback tinyurls stay on their domain and go through their own probe and fix.
+
+        :return: ids of moved tinyurls
+        """
+        grouped = {domain: [tinyurl_id for tinyurl_id in ids if self._may_repair(tinyurl_id)]
+                   for domain, ids in DomainHealth.group(self.id_target_mapping, domains).items()}
+        grouped = {domain: urls for domain, urls in grouped.items() if urls}
+        if not grouped:
+            return set()
+        fallback = self.domain_health.pick_fallback()
+        moved = set()
+        for domain, tinyurls in grouped.items():
+            if not fallback:
+                logger.warning(f'Domain {domain} is down, no working fallback for its {len(tinyurls)} tinyurls!')
+                continue
+            logger.warning(f'Domain {domain} is down, moving {len(tinyurls)} tinyurls to {fallback}...')
+            futures = {self.executor.submit(self.limiter.run, self._move_to_fallback, tinyurl_id, fallback):
+                       tinyurl_id for tinyurl_id in tinyurls}
+            wait(futures, return_when=ALL_COMPLETED)
+            moved_now = {tinyurl_id for future, tinyurl_id in futures.items()
+                         if not future.exception() and future.result()}
+            logger.log(SUCCESS, f'{len(moved_now)}/{len(tinyurls)} tinyurls moved from {domain} to {fallback}')
+            moved |= moved_now
+        return moved
 
-    def _ping_sweep_thread_pool(self):
-        futures = [self.executor.submit(self.ping_check, url, False) for url in self.tinyurl_target_mapping]
+    def _move_to_fallback(self, tinyurl_id, fallback) -> bool:
+        if not self._may_repair(tinyurl_id):
+            return False
+        alias = self.id_url_mapping[tinyurl_id].split('/')[-1]
+        domain = self.id_target_mapping[tinyurl_id]
+        original = self.displaced.get(tinyurl_id) or (domain, self._current_target(tinyurl_id, domain))
+        try:
+            data = self.api_client.update_tinyurl_redirect_service(alias, fallback, retry=1)
+        except (TinyUrlUpdateError, NetworkError, RequestError, NoTokenAvailable, ValueError) as e:
+            logger.warning(e)
+            return False
+        self.displaced[tinyurl_id] = original
+        self._record_repair(tinyurl_id, alias, data)
+        return True
+
+    def _current_target(self, tinyurl_id, domain: str) -> str:
+        """
+        Full url tinyurl redirects to (first hop), heartbeat itself keeps only target domains.
+        """
+        try:
+            response = self.api_client.preflight_session.head(self.id_url_mapping[tinyurl_id], allow_redirects=False,
+                                                              timeout=self.api_client.timeout)
+            location = response.headers.get('Location')
+        except RequestException:
+            location = None
+        if location and get_final_domain(location) == domain:
+            return location
+        return 'https://' + domain if not urlparse(domain).scheme else domain
+
+    def _restore_displaced(self, domains: set):
+        """
+        Moves tinyurls from the fallback back to their original target once its domain passes a check again.
+        """
+        domains = {domain for domain in domains if self.domain_health.is_healthy(domain)}
+        tinyurl_ids = [tinyurl_id for tinyurl_id, (domain, _) in self.displaced.items()
+                       if domain in domains and self._may_repair(tinyurl_id)]
+        if not tinyurl_ids:
+            return
+        futures = [self.executor.submit(self.limiter.run, self._restore, tinyurl_id) for tinyurl_id in tinyurl_ids]
+        wait(futures, return_when=ALL_COMPLETED)
+        restored = sum(1 for future in futures if not future.exception() and future.result())
+        logger.log(SUCCESS, f'{restored}/{len(tinyurl_ids)} tinyurls moved back to their original target')
+
+    def _restore(self, tinyurl_id) -> bool:
+        original = self.displaced.get(tinyurl_id)
+        if not original or tinyurl_id not in self.id_url_mapping:
+            return False
+        alias = self.id_url_mapping[tinyurl_id].split('/')[-1]
+        try:
+            data = self.api_client.update_tinyurl_redirect_service(alias, original[1], retry=1)
+        except (TinyUrlUpdateError, NetworkError, RequestError, NoTokenAvailable, ValueError) as e:
+            logger.warning(e)
+            return False  # Still displaced, next healthy check tries again
+        self.displaced.pop(tinyurl_id, None)
+        self._record_repair(tinyurl_id, alias, data)
+        return True
+
+    def _record_repair(self, tinyurl_id, alias, data):
+        """
+        Tinyurl now redirects to data['url'], main thread gets the new target with next feedback.
+        """
+        full_url = 'https://' + data['url'] if not urlparse(data['url']).scheme else data['url']
+        target_domain = get_final_domain(full_url)
+        self.id_target_mapping[tinyurl_id] = target_domain
+        self.preview_errors.pop(tinyurl_id, None)
+        self.errors.pop(tinyurl_id, None)
+        self.scheduler.record_repaired(tinyurl_id)
+        self.queue_data[alias] = {'full_url': full_url, 'domain': target_domain}
+        if self.coordinator:
+            self.coordinator.publish_target(self.id_url_mapping[tinyurl_id], full_url, target_domain)
+
+    def _due_for_deep_check(self, tinyurl_ids) -> set:
+        if not self.deep_check_interval:
+            return set()
+        now = time.monotonic()
+        deep = {tinyurl_id for tinyurl_id in tinyurl_ids
+                if now - self.last_deep_check.get(tinyurl_id, 0) >= self.deep_check_interval}
+        self.last_deep_check.update({tinyurl_id: now for tinyurl_id in deep})
+        return deep
+
+    def _ping_sweep(self, tinyurl_ids: list = None):
+        if self.probe_engine:
+            self._ping_sweep_async(tinyurl_ids)
+        else:
+            self._ping_sweep_thread_pool(tinyurl_ids)
+
+    def _ping_sweep_async(self, tinyurl_ids: list = None):
+        tinyurl_ids = list(self.id_url_mapping) if tinyurl_ids is None else tinyurl_ids
+        targets = {tinyurl_id: (self.id_url_mapping[tinyurl_id], self.id_target_mapping[tinyurl_id])
+                   for tinyurl_id in tinyurl_ids if tinyurl_id in self.id_url_mapping}
+        results = self.probe_engine.probe_many(targets, deep=self._due_for_deep_check(targets))
+        self.last_sweep = time.time()
+        for tinyurl_id, (verdict, detail) in results.items():
+            if self._apply_verdict(tinyurl_id, verdict, detail):
+                self.scheduler.record_healthy(tinyurl_id)
+            else:
+                self.scheduler.record_failure(tinyurl_id)
+        self._log_sweep(len(targets))
+
+    def _ping_sweep_thread_pool(self, tinyurl_ids: list = None):
+        """
+        :param tinyurl_ids: tinyurls to probe, default is all of them
+        """
+        tinyurl_ids = list(self.id_url_mapping) if tinyurl_ids is None else tinyurl_ids
+        tinyurl_ids = [tinyurl_id for tinyurl_id in tinyurl_ids if tinyurl_id in self.id_url_mapping]
+        deep = self._due_for_deep_check(tinyurl_ids)
+        futures = {self.executor.submit(self.limiter.run, self.ping_check, tinyurl_id, False, tinyurl_id in deep):
+                   tinyurl_id for tinyurl_id in tinyurl_ids}
         wait(futures, return_when=ALL_COMPLETED, timeout=60)
         self.last_sweep = time.time()
+        for future, tinyurl_id in futures.items():
+            if future.done() and not future.exception() and future.result():
+                self.scheduler.record_healthy(tinyurl_id)
+            else:
+                self.scheduler.record_failure(tinyurl_id)
+        self._log_sweep(len(tinyurl_ids))
 
+    def _log_sweep(self, count: int):
+        concurrency = self.limiter.stats()
+        if concurrency['target'] != self.last_concurrency_target:
+            self.last_concurrency_target = concurrency['target']
+            logger.info(f"Concurrency: {concurrency['current']} running, target {concurrency['target']}"
+                        f"/{concurrency['max']}")
         if not self.errors and not self.preview_errors:
-            logger.log(SUCCESS, f"{AnsiCodes.GREEN}All redirects point to the right domain!")
+            logger.debug(f"{AnsiCodes.GREEN}{count} redirects point to the right domain!")
         else:
             error_ids = []
             if self.errors:
-                error_urls = [url for url in self.errors]
-                error_ids.extend(id for id in [self.tinyurl_id_mapping[url] for url in error_urls])
+                error_ids.extend(self.errors)
             if self.preview_errors:
-                error_urls = [url for url in self.preview_errors]
-                error_ids.extend(id for id in [self.tinyurl_id_mapping[url] for url in error_urls])
+                error_ids.extend(self.preview_errors)
                 error_ids = ','.join(['ID[' + str(id) + ']' for id in error_ids])
                 logger.warning(f"Tinyurls with errors: {error_ids}")
 
     def _fix_errors_thread_pool(self):
-        error_urls = {}  # url: True/False,  True to skip self-update to fix preview
-        for url_fix in self.errors:
-            error_urls[url_fix] = True
-        for url_fix in self.preview_errors:
-            error_urls[url_fix] = False
-        if error_urls:
-            futures = [self.executor.submit(self.fix_tinyurl_redirect, url, flag,) for url, flag in error_urls.items()]
+        error_ids = {}  # id: True/False,  True to skip self-update to fix preview
+        for id_fix in list(self.errors):
+            error_ids[id_fix] = True
+        for id_fix in list(self.preview_errors):
+            error_ids[id_fix] = False
+        if error_ids:
+            futures = [self.executor.submit(self.limiter.run, self.fix_tinyurl_redirect, tinyurl_id, flag)
+                       for tinyurl_id, flag in error_ids.items()]
             wait(futures, return_when=ALL_COMPLETED, timeout=60)
 
-    def fix_tinyurl_redirect(self, tinyurl, flag=False):
+    def fix_tinyurl_redirect(self, tinyurl_id, flag=False):
         """
         First attempting to self-update with same redirect by sending request 3 times and checking destination.
         After these attempts use alternate urls from fallback list and update redirect to them.
+        If nothing works tinyurl is replaced by a spare, or deleted when there is none.
 
         :param flag:
-        :param tinyurl:
+        :param tinyurl_id:
         :return:
         """
+        if tinyurl_id not in self.id_url_mapping or not self._may_repair(tinyurl_id):
+            return
         if self.preview_errors:
-            logger.info(f'Fixing for Tinyurl [{self.tinyurl_id_mapping[tinyurl]}]...')
+            logger.info(f'Fixing for Tinyurl [{tinyurl_id}]...')
+        tinyurl = self.id_url_mapping[tinyurl_id]
         alias = tinyurl.split('/')[-1]
-        target_url = self.tinyurl_target_mapping[tinyurl]
+        target_url = self.id_target_mapping[tinyurl_id]
         if not flag:
             try:
                 data = self.api_client.update_tinyurl_redirect_service(alias, target_url, retry=3)
-                self.tinyurl_target_mapping[tinyurl] = get_final_domain(data['url'])
-                if self.ping_check(tinyurl):
-                    self.preview_errors.pop(tinyurl, None)
-                    self.errors.pop(tinyurl, None)
+                self.id_target_mapping[tinyurl_id] = get_final_domain(data['url'])
+                if self.ping_check(tinyurl_id):
+                    self.preview_errors.pop(tinyurl_id, None)
+                    self.errors.pop(tinyurl_id, None)
+                    self.scheduler.record_repaired(tinyurl_id)
                     return
-            except (TinyUrlUpdateError, NetworkError, HTTPError, RequestError, ValueError):
+            except CircuitOpenError as e:
+                logger.warning(e)
+                return  # Api is down, keep tinyurl and try again next sweep
+            except (TinyUrlUpdateError, NetworkError, HTTPError, RequestError, NoTokenAvailable, ValueError):
                 pass
-        attempts = 0
-        if self.api_client.tunneling_service.tunneler:
-            while attempts < self.api_client.tunneling_service.length:
-                try:
-                    logger.debug(f'Attempting to update {tinyurl} redirect to'
-                                        f' {self.api_client.tunneling_service.tunneler}...')
-                    data = self.api_client.update_tinyurl_redirect_service(alias,
-                                                                           self.api_client.tunneling_service.tunneler,
-                                                                           retry=1, timeout=3)
-                    full_url = 'https://' + data['url'] if not urlparse(data['url']).scheme else data['url']
-                    target_domain = get_final_domain(data['url'])
-                    self.tinyurl_target_mapping[tinyurl] = get_final_domain(data['url'])
-                    if self.ping_check(tinyurl):
-                        self.preview_errors.pop(tinyurl, None)
-                        self.errors.pop(tinyurl, None)
-                    self.tinyurl_target_mapping[tinyurl] = target_domain
-                    self.preview_errors.pop(tinyurl, None)
-                    self.errors.pop(tinyurl, None)
-                    logger.log(SUCCESS, f'Tinyurl [{self.tinyurl_id_mapping[tinyurl]}] '
-                                        f'updated to new redirect domain: https://{target_domain}')
-                    break
-                except (TinyUrlUpdateError, NetworkError, RequestError, ValueError) as e:
-                    time.sleep(random.uniform(2, 6))
-                    logger.warning(e)
-                    attempts += 1
-                    self.api_client.tunneling_service.cycle_next()
-        if self.tinyurl_target_mapping.get(tinyurl):  # Check if it has been deleted by main script
-            self.delete_instance(tinyurl)
+        tunneling_service = self.api_client.tunneling_service
+        tried = set()
+        while len(tried) < tunneling_service.length:
+            fallback = tunneling_service.choose(exclude=tried)  # Best scoring first, ties spread the load
+            tried.add(fallback)
+            if self.api_client.circuit_breakers.get(fallback).is_open():
+                tunneling_service.record_failure(fallback)
+                continue
+            try:
+                logger.debug(f'Attempting to update {tinyurl} redirect to {fallback}...')
+                data = self.api_client.update_tinyurl_redirect_service(alias, fallback, retry=1, timeout=3)
+                self._record_repair(tinyurl_id, alias, data)
+                logger.log(SUCCESS, f'Tinyurl [{tinyurl_id}] '
+                                    f'updated to new redirect domain: https://{get_final_domain(data["url"])}')
+                return
+            except CircuitOpenError as e:
+                logger.warning(e)
+                return
+            except (TinyUrlUpdateError, NetworkError, RequestError, NoTokenAvailable, ValueError) as e:
+                logger.warning(e)
+                self.api_client.retry_policy.sleep(len(tried) - 1)
+        if self.id_target_mapping.get(tinyurl_id):  # Check if it has been deleted by main script
+            if not self.replace_instance(tinyurl_id):
+                self.delete_instance(tinyurl_id)
 
     def _get_next_item(self):
         try:
@@ -194,62 +466,101 @@ class HeartbeatService:
         except Empty:
             pass
 
-    def _enqueue_data(self):
-        while self.control_event.is_set():
-            time.sleep(0.1)
+    def _enqueue_data(self, data: dict = None):
+        """
+        Sends data (default is collected queue_data) to main thread and waits until it's processed.
+        """
+        self.control_event.wait_clear()  # Main thread's message must be consumed first, queue is shared
         try:
-            self.shared_queue.put(self.queue_data)
+            self.shared_queue.put(data or dict(self.queue_data))
             self.feedback_event.set()
             self.shared_queue.join()
-            self.queue_data.clear()
+            if data is None:
+                self.queue_data.clear()
         except Full:
             print('Error, queue full!')
 
+    def _add_update(self, update: dict):
+        self._remember(update['id'], update['tinyurl'], update['domain'])
+        self.displaced.pop(update['id'], None)  # New target from the user replaces the one kept for restore
+        self.scheduler.add(update['id'], delay=0)  # New or changed, check soon and keep it tight
+
     def _process_data(self, data):
         for key, value in data.items():
             if key == 'update':
-                self.tinyurl_target_mapping.update({value['tinyurl']: value['domain']})
-                self.tinyurl_id_mapping[value['tinyurl']] = value['id']
+                self._add_update(value)
+            elif key == 'updates':  # Bulk retarget sends the whole batch as one message
+                for update in value:
+                    self._add_update(update)
             elif key == 'delete':
-                self.tinyurl_target_mapping.pop(value)
-                self.tinyurl_id_mapping.pop(value)
+                if value in self.id_url_mapping:
+                    self._forget(value)
             elif key == 'delay':
                 self.delay = value
+                self.scheduler.set_bounds(min_interval=value)
                 logger.info(f'Pinging interval changed to: {self.delay} seconds!')
             elif key == 'threads':
+                old_executor = self.executor
+                self.limiter.set_max(value)
                 self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=value)
+                old_executor.shutdown(wait=False)
             elif key == 'exit':
                 self.terminate = True
             elif key == 'ping':
-                self.last_sweep = time.time() - 10000
+                self.scheduler.reset_all()
             else:
                 logger.error(f'Error! Unknown data received in queue!{data}')
+        self.wakeup.set()
+
+    def load_list(self, load_data: dict):
+        """
+        :param load_data: {id: {tinyurl: target domain}}
+        """
+        for tinyurl_id, nested_dict in load_data.items():
+            for tinyurl, domain in nested_dict.items():
+                self._remember(tinyurl_id, tinyurl, domain)
+                self.scheduler.add(tinyurl_id)
+
+    def _remember(self, tinyurl_id, tinyurl, domain):
+        self.id_url_mapping[tinyurl_id] = tinyurl
+        self.id_target_mapping[tinyurl_id] = sys.intern(domain)  # Also when it came pickled from another process
+
+    def delete_instance(self, tinyurl_id):
+        logger.warning(f'Faulty Tinyurl[{tinyurl_id}] deleted!')
+        self._forget(tinyurl_id)
+        self._enqueue_data({'delete': tinyurl_id})
+
+    def replace_instance(self, tinyurl_id) -> bool:
+        """
+        Points a spare to the target of tinyurl and swaps them, main thread keeps the same id.
 
-    def load_list(self, tinyurl_target: dict):
-        self.tinyurl_target_mapping.update(tinyurl_target)
+        :return: False if there is no spare to use
+        """
+        if not self.spare_pool:
+            return False
+        data = self.spare_pool.claim(self.id_target_mapping[tinyurl_id], ref=tinyurl_id, no_check=True)
+        if not data:
+            return False
+        self._forget(tinyurl_id)
+        new_tinyurl, domain = claimed_tinyurl(data)
+        self._remember(tinyurl_id, new_tinyurl, domain)
+        self.scheduler.add(tinyurl_id, delay=0)
+        logger.log(SUCCESS, f'Faulty Tinyurl[{tinyurl_id}] replaced by {new_tinyurl}')
+        self._enqueue_data({'replace': {'id': tinyurl_id, 'data': data}})
+        return True
 
-    def delete_instance(self, tinyurl):
-        logger.warning(f'Faulty Tinyurl[{self.tinyurl_id_mapping[tinyurl]}] deleted!')
-        deleted_id = self.tinyurl_id_mapping.pop(tinyurl)
-        self.tinyurl_target_mapping.pop(tinyurl)
-        self.errors.pop(tinyurl, None)
-        self.preview_errors.pop(tinyurl, None)
-        self.queue_data = {'delete':  deleted_id}
-        self._enqueue_data()
+    def _forget(self, tinyurl_id):
+        self.id_target_mapping.pop(tinyurl_id)
+        self.scheduler.remove(tinyurl_id)
+        self.last_deep_check.pop(tinyurl_id, None)
+        self.errors.pop(tinyurl_id, None)
+        self.preview_errors.pop(tinyurl_id, None)
+        self.displaced.pop(tinyurl_id, None)
+        return self.id_url_mapping.pop(tinyurl_id)
 
     def _start_terminal_logger(self):
-        terminal = app_config['terminal_emulator']
-        path = app_config['logs_path'] + '/.tum_logs/temp'
-        if terminal == 'gnome':
-            package_installer.install_gnome_terminal()
-            self.process = Popen(['gnome-terminal', '--disable-factory', '--', 'tail', '-f', f'{path}'],
-                                 preexec_fn=os.setpgrp)
-        else:
-            package_installer.install_xfce4_terminal()
-            self.process = Popen(['xfce4-terminal', '--disable-server', '--execute', 'tail', '-f', f'{path}'],
-                                 preexec_fn=os.setpgrp)
+        self.process = start_terminal_logger(app_config)
         self.pid = self.process.pid
-        time.sleep(1)
 
     def start_heartbeat_service(self):
         consumer_thread = Thread(target=self._consumer_thread, daemon=True)
@@ -257,13 +568,48 @@ class HeartbeatService:
         self._start_terminal_logger()
         logger.info('\033[?25lLive logger turned on!')
         logger.info(f'Ping interval is set to {self.delay} seconds!')
+        if self.coordinator:
+            self.coordinator.start()
         consumer_thread.start()
         heartbeat_thread.start()
+        self.started.set()
         consumer_thread.join()
+        if self.probe_engine:
+            self.probe_engine.close()
+        if self.coordinator:
+            self.coordinator.close()
         self.kill_terminal_process(self.pid)
+        self.stopped.set()
 
     @staticmethod
     def kill_terminal_process(pid):
         logger.info('Live logger turned off! Shutting down...')
         time.sleep(1)
         os.killpg(pid, signal.SIGINT)
+
+
+def claimed_tinyurl(data: dict):
+    """
+    :return: (tinyurl, target domain) of a claimed spare
+    """
+    tinyurl = data.get('tiny_url') or f"https://tinyurl.com/{data['alias']}"
+    full_url = 'https://' + data['url'] if not urlparse(data['url']).scheme else data['url']
+    return tinyurl, get_final_domain(full_url)
+
+
+def start_terminal_logger(config: dict) -> Popen:
+    """
+    Opens a terminal that follows the live log.
+    """
+    terminal = config['terminal_emulator']
+    path = config['logs_path'] + '/.tum_logs/temp'
+    if terminal == 'gnome':
+        package_installer.install_gnome_terminal()
+        process = Popen(['gnome-terminal', '--disable-factory', '--', 'tail', '-f', f'{path}'],
+                        preexec_fn=os.setpgrp)
+    else:
+        package_installer.install_xfce4_terminal()
+        process = Popen(['xfce4-terminal', '--disable-server', '--execute', 'tail', '-f', f'{path}'],
+                        preexec_fn=os.setpgrp)
+    time.sleep(1)
+    return process
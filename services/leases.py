@@ -0,0 +1,204 @@
+import logging
+import math
+import os
+import socket
+import sqlite3
+import time
+from threading import Event, Lock, Thread
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from utility.hash_ring import ring_hash
+
+logger = logging.getLogger('')
+
+DEFAULT_LEASE_SHARDS = 64
+DEFAULT_LEASE_TTL = 30
+DEFAULT_BUSY_TIMEOUT = 10
+LEASE_SAFETY_MARGIN = 0.2  # Part of ttl a lease is treated as lost early, covers clock skew and slow commits
+
+
+class LeaseStore:
+    """
+    Shard leases in a SQLite file every node can reach: local disk for several processes, shared storage for
+    several hosts. Rollback journal (not WAL) because WAL needs shared memory that network filesystems don't have.
+    Every change runs in one BEGIN IMMEDIATE transaction, so two nodes never take the same shard.
+
+    Released leases keep their row with the time they ended, so the next owner knows when the shard was last probed.
+    Targets repaired by one node are published here too, other nodes pull them and stop "fixing" them back.
+    """
+
+    def __init__(self, path: str, busy_timeout: float = DEFAULT_BUSY_TIMEOUT):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        with self.lock:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS nodes (node TEXT PRIMARY KEY, seen REAL NOT NULL)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS leases ('
+                                    'shard INTEGER PRIMARY KEY, node TEXT NOT NULL, expires REAL NOT NULL)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS targets ('
+                                    'tinyurl TEXT PRIMARY KEY, full_url TEXT NOT NULL, domain TEXT NOT NULL, '
+                                    'version INTEGER NOT NULL)')
+            # Every publish asks for MAX(version), every poll for versions after the last one
+            self.connection.execute('CREATE INDEX IF NOT EXISTS targets_version ON targets(version)')
+
+    def balance(self, node: str, shards: int, ttl: float) -> Tuple[FrozenSet[int], Dict[int, float]]:
+        """
+        Renews leases of node and takes free or expired shards up to its fair share (shards / live nodes).
+        Shards above the fair share are released, so a node that just joined gets some.
+
+        :return: (shards node holds for the next ttl seconds, {shard taken from another node: when its lease ended})
+        """
+        now = time.time()
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute('INSERT OR REPLACE INTO nodes (node, seen) VALUES (?, ?)', (node, now))
+                cursor.execute('DELETE FROM nodes WHERE seen < ?', (now - ttl,))
+                live = cursor.execute('SELECT COUNT(*) FROM nodes').fetchone()[0]
+                fair_share = math.ceil(shards / max(1, live))
+                rows = cursor.execute('SELECT shard, node, expires FROM leases').fetchall()
+                held = {shard: owner for shard, owner, expires in rows if expires > now}
+                ended = {shard: expires for shard, owner, expires in rows if expires <= now and owner != node}
+                mine = sorted(shard for shard, owner in held.items() if owner == node)
+                released = mine[fair_share:]
+                mine = mine[:fair_share]
+                # Every node scans free shards in its own order, so joining nodes don't all go for the same ones
+                free = sorted((shard for shard in range(shards) if shard not in held),
+                              key=lambda shard: ring_hash(f'{node}/{shard}'))
+                taken = free[:max(0, fair_share - len(mine))]
+                mine.extend(taken)
+                cursor.executemany('UPDATE leases SET expires = ? WHERE shard = ? AND node = ?',
+                                   [(now, shard, node) for shard in released])
+                cursor.executemany('INSERT OR REPLACE INTO leases (shard, node, expires) VALUES (?, ?, ?)',
+                                   [(shard, node, now + ttl) for shard in mine])
+                cursor.execute('COMMIT')
+            except sqlite3.Error:
+                cursor.execute('ROLLBACK')
+                raise
+        return frozenset(mine), {shard: ended[shard] for shard in taken if shard in ended}
+
+    def release(self, node: str):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute('UPDATE leases SET expires = MIN(expires, ?) WHERE node = ?', (time.time(), node))
+                cursor.execute('DELETE FROM nodes WHERE node = ?', (node,))
+                cursor.execute('COMMIT')
+            except sqlite3.Error:
+                cursor.execute('ROLLBACK')  # Otherwise the shared connection stays in the transaction for good
+                raise
+
+    def publish_target(self, tinyurl: str, full_url: str, domain: str):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                version = cursor.execute('SELECT COALESCE(MAX(version), 0) + 1 FROM targets').fetchone()[0]
+                cursor.execute('INSERT OR REPLACE INTO targets (tinyurl, full_url, domain, version) '
+                               'VALUES (?, ?, ?, ?)', (tinyurl, full_url, domain, version))
+                cursor.execute('COMMIT')
+            except sqlite3.Error:
+                cursor.execute('ROLLBACK')
+                raise
+
+    def targets_since(self, version: int) -> List[Tuple[str, str, str, int]]:
+        """
+        :return: [(tinyurl, full_url, domain, version)] published after version, oldest first
+        """
+        with self.lock:
+            return self.connection.execute('SELECT tinyurl, full_url, domain, version FROM targets '
+                                           'WHERE version > ? ORDER BY version', (version,)).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class LeaseCoordinator:
+    """
+    Splits tinyurls between heartbeat nodes. Tinyurls hash into a fixed number of shards, a node probes and repairs
+    only tinyurls of shards it holds a lease on. Leases are renewed every ttl / 3; a node that dies stops renewing
+    and its shards are taken over by others once they expire.
+
+    A shard taken from another node is left alone until handover_grace seconds after that node's lease ended, the
+    other node may have just probed it. Use the ping interval.
+    """
+
+    def __init__(self, store_path: str, node_id: str = None, shards: int = DEFAULT_LEASE_SHARDS,
+                 ttl: float = DEFAULT_LEASE_TTL, handover_grace: float = 0):
+        self.store = LeaseStore(store_path)
+        self.node_id = node_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.shards = shards
+        self.ttl = ttl
+        self.owned: FrozenSet[int] = frozenset()
+        self.handover_grace = handover_grace
+        self.quiet_until: Dict[int, float] = {}  # Monotonic, shard: end of its handover grace
+        self.valid_until = 0.0  # Monotonic, leases count as lost after it even if renewal is stuck
+        self.targets_version = 0
+        self.stop_renewing = Event()
+        self.renew_thread: Optional[Thread] = None
+
+    def start(self):
+        self.renew()
+        self.renew_thread = Thread(target=self._renew_loop, daemon=True)
+        self.renew_thread.start()
+
+    def _renew_loop(self):
+        while not self.stop_renewing.wait(self.ttl / 3):
+            try:
+                self.renew()
+            except sqlite3.Error as e:
+                logger.warning(f'Lease renewal failed: {e}')
+
+    def renew(self):
+        started = time.monotonic()
+        owned, handed_over = self.store.balance(self.node_id, self.shards, self.ttl)
+        self.valid_until = started + self.ttl * (1 - LEASE_SAFETY_MARGIN)
+        now = time.time()
+        quiet_until = {shard: until for shard, until in self.quiet_until.items() if shard in owned and until > started}
+        quiet_until.update({shard: started + max(0.0, ended + self.handover_grace - now)
+                            for shard, ended in handed_over.items()})
+        self.quiet_until = quiet_until
+        if owned != self.owned:
+            logger.info(f'Node {self.node_id} holds {len(owned)}/{self.shards} heartbeat shards '
+                        f'(+{len(owned - self.owned)} -{len(self.owned - owned)})')
+        self.owned = owned
+
+    def shard_of(self, tinyurl: str) -> int:
+        return ring_hash(tinyurl) % self.shards
+
+    def owns(self, tinyurl: str) -> bool:
+        now = time.monotonic()
+        shard = self.shard_of(tinyurl)
+        return now < self.valid_until and shard in self.owned and self.quiet_until.get(shard, 0) <= now
+
+    def publish_target(self, tinyurl: str, full_url: str, domain: str):
+        try:
+            self.store.publish_target(tinyurl, full_url, domain)
+        except sqlite3.Error as e:
+            logger.warning(f'Publishing repair of {tinyurl} failed: {e}')
+
+    def pull_targets(self) -> List[Tuple[str, str, str]]:
+        """
+        :return: [(tinyurl, full_url, domain)] repaired by any node since the last pull
+        """
+        try:
+            rows = self.store.targets_since(self.targets_version)
+        except sqlite3.Error as e:
+            logger.warning(f'Pulling repairs failed: {e}')
+            return []
+        if rows:
+            self.targets_version = rows[-1][3]
+        return [row[:3] for row in rows]
+
+    def close(self):
+        self.stop_renewing.set()
+        if self.renew_thread:
+            self.renew_thread.join(timeout=self.ttl)
+        try:
+            self.store.release(self.node_id)  # Others can take the shards now instead of after ttl
+        except sqlite3.Error:
+            pass
+        self.store.close()
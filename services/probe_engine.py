@@ -0,0 +1,100 @@
+import asyncio
+from threading import Thread
+from typing import Dict, Hashable, Optional, Set, Tuple
+
+import aiohttp
+
+from api.retry import CircuitBreakerRegistry
+from utility.url_tools import classify_redirect, classify_first_hop, PROBE_ERROR, PROBE_SKIPPED
+
+DEFAULT_PROBE_CONCURRENCY = 500
+DEFAULT_PROBE_PER_HOST = 200
+DEFAULT_PROBE_TIMEOUT = 3
+
+
+class AsyncProbeEngine:
+    """
+    Probes many tinyurls concurrently from one event loop running in a background thread, so heartbeat
+    (which is threaded) can call it synchronously. Concurrency is capped overall and per host.
+    By default only the first hop (tinyurl's own redirect) is requested, deep probes follow the whole chain.
+
+    Usage:
+        engine = AsyncProbeEngine(api_client.circuit_breakers)
+        results = engine.probe_many({tinyurl_id: (tinyurl, intended_domain)})  # {tinyurl_id: (verdict, detail)}
+    """
+
+    def __init__(self, circuit_breakers: CircuitBreakerRegistry, concurrency: int = DEFAULT_PROBE_CONCURRENCY,
+                 per_host: int = DEFAULT_PROBE_PER_HOST, timeout: float = DEFAULT_PROBE_TIMEOUT):
+        self.circuit_breakers = circuit_breakers
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=timeout, sock_read=timeout)
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    async def _open(self):
+        if self.session:
+            return
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    def probe_many(self, targets: Dict[Hashable, Tuple[str, str]], timeout: float = None,
+                   deep: Set[Hashable] = frozenset()) -> Dict[Hashable, Tuple[str, Optional[str]]]:
+        """
+        :param targets: key (tinyurl id): (tinyurl, intended domain)
+        :param timeout: seconds to wait for the whole batch, None waits until every probe is done
+        :param deep: keys of tinyurls to check by following the full redirect chain
+        :return: key: (verdict, redirect url or error message)
+        """
+        future = asyncio.run_coroutine_threadsafe(self._probe_all(targets, deep), self.loop)
+        return future.result(timeout)
+
+    async def _probe_all(self, targets: Dict[Hashable, Tuple[str, str]],
+                         deep: Set[Hashable]) -> Dict[Hashable, Tuple[str, Optional[str]]]:
+        await self._open()
+        results = {}
+        await asyncio.gather(*(self._probe(key, tinyurl, domain, results, key in deep)
+                               for key, (tinyurl, domain) in targets.items()))
+        return results
+
+    async def _probe(self, key: Hashable, tinyurl: str, intended_domain: str, results: dict, deep: bool = False):
+        breaker = self.circuit_breakers.get(tinyurl)
+        trial = breaker.claim()
+        if trial is None:
+            results[key] = (PROBE_SKIPPED, None)
+            return
+        try:
+            async with self.semaphore:
+                async with self.session.head(tinyurl, allow_redirects=deep) as response:
+                    status, location, final_url = response.status, response.headers.get('Location'), str(response.url)
+            if deep:
+                breaker.record_success()  # Status is from the last hop, not from tinyurl
+                results[key] = (classify_redirect(tinyurl, final_url, intended_domain), final_url)
+            else:
+                breaker.record_status(status)
+                results[key] = classify_first_hop(tinyurl, status, location, intended_domain)
+        except asyncio.TimeoutError:
+            breaker.record_failure()
+            results[key] = (PROBE_ERROR, 'Request timed out!')
+        except aiohttp.ClientConnectionError as e:
+            breaker.record_failure()
+            results[key] = (PROBE_ERROR, f'Request Exception: {e}')
+        except (aiohttp.ClientError, ValueError) as e:
+            breaker.record_success()
+            results[key] = (PROBE_ERROR, f'Request Exception: {e}')
+        finally:
+            breaker.release_trial(trial)
+
+    async def _close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    def close(self):
+        if self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._close(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,133 @@
+import heapq
+import random
+import time
+from threading import Lock
+from typing import List, Optional
+
+from utility.id_map import IdMap
+
+DEFAULT_MIN_INTERVAL = 30
+DEFAULT_MAX_INTERVAL = 1800
+DEFAULT_BACKOFF = 2.0
+JITTER = 0.1
+
+
+class ProbeScheduler:
+    """
+    Keeps next due time of every tinyurl (by id) in a heap instead of sweeping all of them every interval.
+    Interval of a healthy tinyurl grows by backoff up to max_interval, a failed or just repaired one
+    goes back to min_interval. Entries are removed lazily: heap items whose due time doesn't match
+    the current one are skipped when popped.
+    """
+
+    def __init__(self, min_interval: float = DEFAULT_MIN_INTERVAL, max_interval: float = DEFAULT_MAX_INTERVAL,
+                 backoff: float = DEFAULT_BACKOFF):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+        self.heap = []
+        self.due = IdMap()  # tinyurl id: due time
+        self.intervals = IdMap()  # tinyurl id: current interval
+        self.lock = Lock()
+
+    def _push(self, tinyurl_id: int, due: float):
+        self.due[tinyurl_id] = due
+        heapq.heappush(self.heap, (due, tinyurl_id))
+
+    def _jittered(self, interval: float) -> float:
+        return interval * random.uniform(1 - JITTER, 1 + JITTER)
+
+    def add(self, tinyurl_id: int, delay: Optional[float] = None):
+        """
+        :param delay: seconds until first probe, default is random within min_interval so a big load is spread out
+        """
+        with self.lock:
+            self.intervals[tinyurl_id] = self.min_interval
+            delay = random.uniform(0, self.min_interval) if delay is None else delay
+            self._push(tinyurl_id, time.monotonic() + delay)
+
+    def remove(self, tinyurl_id: int):
+        with self.lock:
+            self.due.pop(tinyurl_id, None)
+            self.intervals.pop(tinyurl_id, None)
+
+    def __contains__(self, tinyurl_id: int) -> bool:
+        return tinyurl_id in self.due
+
+    def __len__(self) -> int:
+        return len(self.due)
+
+    def _reschedule(self, tinyurl_id: int, interval: float):
+        if tinyurl_id not in self.intervals:
+            return  # Deleted while it was probed
+        self.intervals[tinyurl_id] = interval
+        self._push(tinyurl_id, time.monotonic() + self._jittered(interval))
+
+    def record_healthy(self, tinyurl_id: int):
+        with self.lock:
+            interval = self.intervals.get(tinyurl_id, self.min_interval)
+            self._reschedule(tinyurl_id, min(self.max_interval, interval * self.backoff))
+
+    def record_failure(self, tinyurl_id: int):
+        with self.lock:
+            self._reschedule(tinyurl_id, self.min_interval)
+
+    record_repaired = record_failure
+
+    def pop_due(self, horizon: float = 0.5) -> List[int]:
+        """
+        :param horizon: also takes tinyurls due within next horizon seconds, so probes go out in batches
+        :return: ids of tinyurls to probe now, they are out of the schedule until recorded again
+        """
+        limit = time.monotonic() + horizon
+        result = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= limit:
+                due, tinyurl_id = heapq.heappop(self.heap)
+                if self.due.get(tinyurl_id) != due:
+                    continue  # Stale entry
+                del self.due[tinyurl_id]
+                result.append(tinyurl_id)
+        return result
+
+    def next_due(self) -> Optional[float]:
+        """
+        :return: seconds until the next tinyurl is due (0 if overdue), None if nothing is scheduled
+        """
+        with self.lock:
+            while self.heap and self.due.get(self.heap[0][1]) != self.heap[0][0]:
+                heapq.heappop(self.heap)
+            if not self.heap:
+                return None
+            return max(0.0, self.heap[0][0] - time.monotonic())
+
+    def reset_all(self):
+        """
+        Everything is due now, used by manual ping sweep.
+        """
+        with self.lock:
+            now = time.monotonic()
+            for tinyurl_id in self.intervals:
+                self._push(tinyurl_id, now)
+
+    def set_bounds(self, min_interval: float = None, max_interval: float = None):
+        with self.lock:
+            self.min_interval = min_interval or self.min_interval
+            self.max_interval = max(self.min_interval, max_interval or self.max_interval)
+            now = time.monotonic()
+            for tinyurl_id, interval in self.intervals.items():
+                clamped = min(self.max_interval, max(self.min_interval, interval))
+                self.intervals[tinyurl_id] = clamped
+                if tinyurl_id in self.due and self.due[tinyurl_id] > now + clamped:
+                    self._push(tinyurl_id, now + clamped)
+
+    def stats(self) -> dict:
+        with self.lock:
+            intervals = list(self.intervals.values())
+        return {
+            'tracked': len(intervals),
+            'min_interval': self.min_interval,
+            'max_interval': self.max_interval,
+            'mean_interval': sum(intervals) / len(intervals) if intervals else 0.0,
+            'probes_per_minute': sum(60 / interval for interval in intervals),
+        }
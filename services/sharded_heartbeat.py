@@ -0,0 +1,389 @@
+import logging
+import multiprocessing
+import os
+import sys
+from collections import defaultdict
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue, Empty, Full
+from threading import Event, Lock, RLock, Thread
+from typing import Dict, Iterable, Optional, Tuple
+
+from api.apiclient import ApiClient
+from api.journal import DONE
+from services.heartbeat import HeartbeatService, claimed_tinyurl, start_terminal_logger
+from services.spare_pool import SparePool
+from utility.events import ClearableEvent
+from utility.hash_ring import HashRing
+from utility.id_map import IdMap
+
+SUCCESS = 25
+logger = logging.getLogger('')
+
+WORKER_CHECK_INTERVAL = 1.0  # How often crashed workers are looked for while feedback is quiet
+WORKER_JOIN_TIMEOUT = 5
+
+
+def resolve_shards(value) -> int:
+    """
+    heartbeat_shards option: 'auto' is one worker per core, 0 keeps heartbeat in the cli process.
+    """
+    if str(value).strip().lower() == 'auto':
+        return os.cpu_count() or 1
+    return max(0, int(value or 0))
+
+
+def worker_config(config: dict, shards: int) -> dict:
+    """
+    Workers share the api budget of a single heartbeat and leave state (journal, alias store) and the background
+    fallback probes to the parent.
+    """
+    return dict(config, state_path=None, use_journal=False, fallback_probe_interval=0,
+                token_rate=config.get('token_rate', 2) / shards,
+                token_burst=max(1, config.get('token_burst', 10) // shards),
+                max_threads=max(1, config.get('max_threads', 32) // shards),
+                probe_concurrency=max(1, config.get('probe_concurrency', 500) // shards))
+
+
+class ShardWorker(HeartbeatService):
+    """
+    HeartbeatService of one shard, runs in its own process. Messages come from inbox, feedback goes to the
+    shared outbox without waiting for the parent to consume it. Tinyurls it can't fix are handed over to the
+    parent, which owns the spare pool.
+    """
+
+    def __init__(self, index: int, inbox, outbox, api_client: ApiClient, load_data: dict, config: dict):
+        super().__init__(None, None, None, api_client, load_data=load_data, config=config)
+        self.index = index
+        self.inbox = inbox
+        self.outbox = outbox
+
+    def _consumer_thread(self):
+        while not self.terminate:
+            data = self.inbox.get()
+            try:
+                self.api_client.alias_token_mapping.update_many(data.pop('tokens', {}))
+                if data:
+                    self._process_data(data)
+            except Exception as e:
+                logger.error(f'Heartbeat shard {self.index}: {e}')
+
+    def _enqueue_data(self, data: dict = None):
+        self.outbox.put((self.index, data or dict(self.queue_data)))
+        if data is None:
+            self.queue_data.clear()
+
+    def replace_instance(self, tinyurl_id) -> bool:
+        self._forget(tinyurl_id)
+        self._enqueue_data({'unfixable': {'id': tinyurl_id}})
+        return True
+
+    def start_heartbeat_service(self):
+        heartbeat_thread = Thread(target=self.run_heartbeat_service, daemon=True)
+        heartbeat_thread.start()
+        self.started.set()
+        self._consumer_thread()
+        heartbeat_thread.join(timeout=WORKER_JOIN_TIMEOUT)
+        if self.probe_engine:
+            self.probe_engine.close()
+        self.stopped.set()
+
+
+def _run_worker(index: int, config: dict, load_data: dict, tokens: Dict[str, str], inbox, outbox, log_queue,
+                log_level: int):
+    root = logging.getLogger('')
+    root.handlers = [QueueHandler(log_queue)]  # Parent writes the records, live log stays one file
+    root.setLevel(log_level)
+    api_client = ApiClient(config['auth_tokens'], config.get('fallback_urls'), config=config)
+    api_client.alias_token_mapping.update_many(tokens)
+    try:
+        ShardWorker(index, inbox, outbox, api_client, load_data, config).start_heartbeat_service()
+    finally:
+        api_client.close()
+
+
+class ShardedHeartbeatService:
+    """
+    Heartbeat split across worker processes, so probing and classifying isn't limited by one interpreter.
+
+    Tinyurls are assigned to shards with a consistent hash ring: a new or deleted tinyurl only concerns the worker
+    that owns it, and changing the number of shards moves only the tinyurls whose owner changed. Workers probe and
+    repair on their own, feedback comes back over one multiprocessing queue and is forwarded to the cli the same
+    way HeartbeatService does it. Same interface as HeartbeatService towards the cli.
+    """
+
+    def __init__(self, shared_queue: Queue, control_event: ClearableEvent, feedback_event: ClearableEvent,
+                 api_client: ApiClient = None, load_data: dict = None, config: dict = None,
+                 spare_pool: SparePool = None):
+        self.shared_queue = shared_queue
+        self.control_event = control_event
+        self.feedback_event = feedback_event
+        self.api_client = api_client
+        self.spare_pool = spare_pool
+        self.config = config
+        self.delay = config['ping_interval']
+        self.shards = resolve_shards(config.get('heartbeat_shards')) or 1
+        self.context = multiprocessing.get_context('spawn')  # Forking a process with running threads isn't safe
+        self.outbox = self.context.Queue()
+        self.log_queue = self.context.Queue()
+        self.log_listener: Optional[QueueListener] = None
+        self.ring = HashRing(range(self.shards))
+        self.workers: Dict[int, Tuple[multiprocessing.Process, multiprocessing.Queue]] = {}
+        self.workers_lock = RLock()  # resize runs on the consumer thread, reviving crashed workers on the results one
+        self.lock = Lock()  # Mappings are changed by both the cli messages and worker feedback
+        self.id_url_mapping = IdMap()
+        self.id_target_mapping = IdMap()
+        self.alias_id_mapping: Dict[str, int] = {}
+        if load_data:
+            for tinyurl_id, nested_dict in load_data.items():
+                for tinyurl, domain in nested_dict.items():
+                    self._remember(tinyurl_id, tinyurl, domain)
+        self.process = None
+        self.pid = None
+        self.terminate = False
+        self.started = Event()
+        self.stopped = Event()
+
+    def _remember(self, tinyurl_id, tinyurl, domain):
+        self.id_url_mapping[tinyurl_id] = tinyurl
+        self.id_target_mapping[tinyurl_id] = sys.intern(domain)
+        self.alias_id_mapping[tinyurl.split('/')[-1]] = tinyurl_id
+
+    def _forget(self, tinyurl_id):
+        """
+        :return: the forgotten tinyurl, None if it wasn't known
+        """
+        self.id_target_mapping.pop(tinyurl_id, None)
+        tinyurl = self.id_url_mapping.pop(tinyurl_id, None)
+        if tinyurl:
+            self.alias_id_mapping.pop(tinyurl.split('/')[-1], None)
+        return tinyurl
+
+    def _owner(self, tinyurl_id) -> int:
+        return self.ring.node_for(self.id_url_mapping[tinyurl_id])
+
+    def _shard_load(self, index: int) -> dict:
+        return {tinyurl_id: {tinyurl: self.id_target_mapping[tinyurl_id]}
+                for tinyurl_id, tinyurl in self.id_url_mapping.items() if self.ring.node_for(tinyurl) == index}
+
+    def _tokens_for(self, tinyurls: Iterable[str]) -> Dict[str, str]:
+        tokens = {}
+        for tinyurl in tinyurls:
+            alias = tinyurl.split('/')[-1]
+            token = self.api_client.alias_token_mapping.get(alias)
+            if token:
+                tokens[alias] = token
+        return tokens
+
+    def _start_worker(self, index: int):
+        load_data = self._shard_load(index)
+        tokens = self._tokens_for(url for nested_dict in load_data.values() for url in nested_dict)
+        inbox = self.context.Queue()
+        process = self.context.Process(target=_run_worker, daemon=True,
+                                       args=(index, worker_config(self.config, self.shards), load_data, tokens,
+                                             inbox, self.outbox, self.log_queue, logger.getEffectiveLevel()))
+        process.start()
+        with self.workers_lock:
+            self.workers[index] = (process, inbox)
+        logger.info(f'Heartbeat shard {index} started with {len(load_data)} tinyurls')
+
+    def _send(self, index: int, data: dict):
+        with self.workers_lock:
+            self.workers[index][1].put(data)
+
+    def _broadcast(self, data: dict):
+        with self.workers_lock:
+            for index in self.workers:
+                self._send(index, dict(data))
+
+    def _consumer_thread(self):
+        while not self.terminate:
+            self.control_event.wait()
+            try:
+                item = self.shared_queue.get()
+                self._route(item)
+                self.shared_queue.task_done()
+                self.control_event.clear()
+            except Exception as e:
+                logger.error(f'Exception in sharded heartbeat consumer: {e}')
+
+    def _take_update(self, update: dict) -> int:
+        """
+        Remembers the new or changed tinyurl.
+
+        :return: index of the worker that owns it now
+        """
+        tinyurl = update['tinyurl']
+        with self.lock:
+            old_tinyurl = self.id_url_mapping.get(update['id'])
+            self._remember(update['id'], tinyurl, update['domain'])
+        owner = self.ring.node_for(tinyurl)
+        if old_tinyurl and self.ring.node_for(old_tinyurl) != owner:
+            self._send(self.ring.node_for(old_tinyurl), {'delete': update['id']})  # Same id, other tinyurl
+        return owner
+
+    def _route(self, data: dict):
+        for key, value in data.items():
+            if key == 'update':
+                self._send(self._take_update(value), {'update': value, 'tokens': self._tokens_for([value['tinyurl']])})
+            elif key == 'updates':
+                batches = defaultdict(list)  # Worker index: its part of the batch, still one message per worker
+                for update in value:
+                    batches[self._take_update(update)].append(update)
+                for index, updates in batches.items():
+                    self._send(index, {'updates': updates,
+                                       'tokens': self._tokens_for(update['tinyurl'] for update in updates)})
+            elif key == 'delete':
+                with self.lock:
+                    tinyurl = self._forget(value)
+                if tinyurl is None:
+                    continue  # Worker gave it up meanwhile
+                self._send(self.ring.node_for(tinyurl), {'delete': value})
+            elif key == 'shards':
+                self.resize(value)
+            elif key == 'threads':
+                self._broadcast({'threads': max(1, value // self.shards)})
+            elif key == 'exit':
+                self._broadcast({'exit': True})
+                self.terminate = True
+            else:
+                if key == 'delay':
+                    self.delay = value
+                self._broadcast({key: value})
+
+    def resize(self, shards: int):
+        """
+        Changes the number of workers. Only tinyurls whose owner changed are moved, other workers keep running.
+        """
+        shards = max(1, shards)
+        with self.workers_lock:
+            with self.lock:
+                old_owners = {tinyurl_id: self._owner(tinyurl_id) for tinyurl_id in self.id_url_mapping}
+                for index in range(self.shards, shards):
+                    self.ring.add_node(index)
+                for index in range(shards, self.shards):
+                    self.ring.remove_node(index)
+                self.shards = shards
+                moved = {tinyurl_id: old for tinyurl_id, old in old_owners.items() if self._owner(tinyurl_id) != old}
+            for index in [index for index in self.workers if index >= shards]:
+                self._send(index, {'exit': True})
+                self.workers.pop(index)
+            started = [index for index in range(shards) if index not in self.workers]
+            for index in started:
+                self._start_worker(index)  # Starts with its whole shard, including moved tinyurls
+            for tinyurl_id, old in moved.items():
+                tinyurl = self.id_url_mapping[tinyurl_id]
+                new = self.ring.node_for(tinyurl)
+                if old in self.workers and old not in started:
+                    self._send(old, {'delete': tinyurl_id})
+                if new not in started:
+                    self._send(new, {'update': {'tinyurl': tinyurl, 'domain': self.id_target_mapping[tinyurl_id],
+                                                'id': tinyurl_id},
+                                     'tokens': self._tokens_for([tinyurl])})
+        logger.info(f'Heartbeat resharded to {shards} workers, {len(moved)} tinyurls moved')
+
+    def _results_thread(self):
+        while not self.terminate:
+            try:
+                index, data = self.outbox.get(timeout=WORKER_CHECK_INTERVAL)
+            except Empty:
+                self._revive_workers()
+                continue
+            try:
+                self._handle_feedback(data)
+            except Exception as e:
+                logger.error(f'Exception handling feedback of heartbeat shard {index}: {e}')
+
+    def _revive_workers(self):
+        with self.workers_lock:  # Otherwise a worker resize just stopped could be started again, outside the ring
+            for index, (process, _) in list(self.workers.items()):
+                if not process.is_alive() and not self.terminate:
+                    logger.warning(f'Heartbeat shard {index} died (exit code {process.exitcode}), restarting it...')
+                    self._start_worker(index)
+
+    def _handle_feedback(self, data: dict):
+        repaired = {}
+        for key, value in data.items():
+            if key == 'unfixable':
+                self._replace_or_delete(value['id'])
+                continue
+            # Repair: alias now redirects to value['full_url'], journal it here since workers don't keep one
+            self.api_client.record_mutation(DONE, 'change', alias=key, url=value['full_url'])
+            with self.lock:
+                tinyurl_id = self.alias_id_mapping.get(key)
+                if tinyurl_id is not None:
+                    self.id_target_mapping[tinyurl_id] = sys.intern(value['domain'])
+            repaired[key] = value
+        if repaired:
+            self._enqueue_data(repaired)
+
+    def _replace_or_delete(self, tinyurl_id):
+        with self.lock:
+            target = self.id_target_mapping.get(tinyurl_id)
+        if target is None:
+            return  # Deleted by cli meanwhile
+        data = self.spare_pool.claim(target, ref=tinyurl_id, no_check=True) if self.spare_pool else None
+        with self.workers_lock:  # A concurrent resize can't move or stop its owner until it got the update
+            with self.lock:
+                self._forget(tinyurl_id)
+                if data:
+                    new_tinyurl, domain = claimed_tinyurl(data)
+                    self._remember(tinyurl_id, new_tinyurl, domain)
+            if data:
+                self._send(self.ring.node_for(new_tinyurl), {'update': {'tinyurl': new_tinyurl, 'domain': domain,
+                                                                        'id': tinyurl_id},
+                                                             'tokens': self._tokens_for([new_tinyurl])})
+        if not data:
+            logger.warning(f'Faulty Tinyurl[{tinyurl_id}] deleted!')
+            self._enqueue_data({'delete': tinyurl_id})
+            return
+        logger.log(SUCCESS, f'Faulty Tinyurl[{tinyurl_id}] replaced by {new_tinyurl}')
+        self._enqueue_data({'replace': {'id': tinyurl_id, 'data': data}})
+
+    def _enqueue_data(self, data: dict):
+        """
+        Sends data to main thread and waits until it's processed.
+        """
+        self.control_event.wait_clear()  # Main thread's message must be consumed first, queue is shared
+        try:
+            self.shared_queue.put(data)
+            self.feedback_event.set()
+            self.shared_queue.join()
+        except Full:
+            print('Error, queue full!')
+
+    def start_heartbeat_service(self):
+        self.process = start_terminal_logger(self.config)
+        self.pid = self.process.pid
+        self.log_listener = QueueListener(self.log_queue, *logger.handlers, respect_handler_level=True)
+        self.log_listener.start()
+        logger.info('\033[?25lLive logger turned on!')
+        logger.info(f'Ping interval is set to {self.delay} seconds!')
+        for index in range(self.shards):
+            self._start_worker(index)
+        results_thread = Thread(target=self._results_thread, daemon=True)
+        results_thread.start()
+        self.started.set()
+        self._consumer_thread()
+        with self.workers_lock:
+            processes = [process for process, _ in self.workers.values()]
+        for process in processes:
+            process.join(timeout=WORKER_JOIN_TIMEOUT)
+        results_thread.join(timeout=WORKER_CHECK_INTERVAL * 2)
+        self.log_listener.stop()
+        HeartbeatService.kill_terminal_process(self.pid)
+        self.stopped.set()
+
+
+def build_heartbeat(shared_queue: Queue, control_event: ClearableEvent, feedback_event: ClearableEvent,
+                    api_client: ApiClient, load_data: dict = None, config: dict = None, spare_pool: SparePool = None):
+    """
+    ShardedHeartbeatService when heartbeat_shards is set (and nodes aren't coordinated through a lease store),
+    otherwise HeartbeatService in the cli process.
+    """
+    shards = resolve_shards(config.get('heartbeat_shards'))
+    if shards and config.get('lease_store'):
+        logger.warning('heartbeat_shards is ignored with lease_store, nodes split tinyurls by leases')
+        shards = 0
+    heartbeat_class = ShardedHeartbeatService if shards else HeartbeatService
+    return heartbeat_class(shared_queue, control_event, feedback_event, api_client, load_data=load_data,
+                           config=config, spare_pool=spare_pool)
@@ -0,0 +1,103 @@
+import logging
+from collections import OrderedDict
+from threading import Lock, Thread, Event
+from typing import Dict, Optional
+
+from api.apiclient import ApiClient
+from api.journal import INTENT, DONE, FAILED
+from exceptions.tinyurl_exceptions import TinyUrlCreationError, TinyUrlUpdateError, NetworkError, RequestError, \
+    NoTokenAvailable, CircuitOpenError
+
+logger = logging.getLogger('')
+
+DEFAULT_REFILL_INTERVAL = 30
+
+
+class SparePool:
+    """
+    Tinyurls created ahead of time and parked on a fallback url. Claiming one is a single /change to the wanted
+    target instead of a create (with possible alias retries), heartbeat uses them to replace tinyurls it can't fix.
+
+    A background thread refills the pool up to size, it starts with start() or with the first claim.
+    Spares are created without a ref, so journal replay can tell them apart from managed tinyurls.
+    """
+
+    def __init__(self, api_client: ApiClient, size: int, refill_interval: float = DEFAULT_REFILL_INTERVAL):
+        self.api_client = api_client
+        self.size = size
+        self.refill_interval = refill_interval  # Retry period after a failed refill
+        self.spares: Dict[str, dict] = OrderedDict()  # alias: create response data
+        self.lock = Lock()
+        self.wakeup = Event()
+        self.closed = Event()
+        self.refill_thread = None
+        self.claimed = 0
+
+    def load(self, spares: Dict[str, dict]):
+        with self.lock:
+            self.spares.update(spares)
+
+    def start(self):
+        if self.refill_thread or self.closed.is_set():
+            return
+        self.refill_thread = Thread(target=self._refill_loop, daemon=True)
+        self.refill_thread.start()
+
+    def _refill_loop(self):
+        while not self.closed.is_set():
+            while len(self.spares) < self.size and not self.closed.is_set():
+                try:
+                    self.api_client.concurrency_limiter.run(self._create_spare)
+                except (TinyUrlCreationError, NetworkError, RequestError, NoTokenAvailable, CircuitOpenError,
+                        ValueError) as e:
+                    logger.warning(f'Spare pool refill failed: {e}')
+                    break
+            self.wakeup.wait(self.refill_interval)
+            self.wakeup.clear()
+
+    def _create_spare(self):
+        fallback = self.api_client.tunneling_service.choose()
+        if not fallback:
+            raise ValueError('No fallback url to park spares on')
+        data = self.api_client.create_tinyurl(fallback, no_check=True)
+        with self.lock:
+            self.spares[data['alias']] = data
+
+    def claim(self, target_url: str, ref: int, no_check: bool = False, retry: int = 3) -> Optional[dict]:
+        """
+        Points a spare to target_url and hands it over to tinyurl ref.
+
+        :return: data like a create response, None if the pool is empty or the change failed
+        """
+        self.start()
+        if not no_check:
+            self.api_client.check_target_url(target_url)
+        with self.lock:
+            if not self.spares:
+                return None
+            alias, spare = self.spares.popitem(last=False)
+        # A crash after the change must not leave the alias in the journal as a free spare, see journal replay
+        self.api_client.record_mutation(INTENT, 'claim', alias=alias, url=target_url, tiny_url=spare.get('tiny_url'),
+                                        spare_url=spare['url'], ref=ref)
+        try:
+            data = self.api_client.update_tinyurl_redirect_service(alias, target_url, retry=retry)
+        except (TinyUrlUpdateError, NetworkError, RequestError, NoTokenAvailable, CircuitOpenError) as e:
+            logger.warning(f'Claiming spare {alias} failed: {e}')
+            self.api_client.record_mutation(FAILED, 'claim', alias=alias)
+            with self.lock:
+                self.spares[alias] = spare  # Still parked on its fallback, good for the next claim
+            return None
+        finally:
+            self.wakeup.set()
+        data = {**spare, **data, 'alias': alias}
+        self.api_client.record_mutation(DONE, 'claim', alias=alias, url=data['url'], tiny_url=data.get('tiny_url'),
+                                        ref=ref)
+        self.claimed += 1
+        return data
+
+    def close(self):
+        self.closed.set()
+        self.wakeup.set()
+
+    def stats(self) -> dict:
+        return {'available': len(self.spares), 'size': self.size, 'claimed': self.claimed}
@@ -0,0 +1,42 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from api.alias_store import AliasTokenStore
+
+
+class AliasTokenStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'aliases.db')
+
+    def stored(self) -> dict:
+        connection = sqlite3.connect(self.path)
+        try:
+            return dict(connection.execute('SELECT alias, token FROM alias_token'))
+        finally:
+            connection.close()
+
+    def test_last_batch_is_flushed_without_further_writes(self):
+        store = AliasTokenStore(self.path, flush_interval=0.05)
+        self.addCleanup(store.close)
+        store['alias'] = 'token'
+        deadline = time.monotonic() + 5
+        while not self.stored() and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(self.stored(), {'alias': 'token'})
+
+    def test_close_flushes_and_stops(self):
+        store = AliasTokenStore(self.path, flush_interval=3600)
+        store['alias'] = 'token'
+        self.assertEqual(self.stored(), {})  # Batch still buffered
+        store.close()
+        self.assertEqual(self.stored(), {'alias': 'token'})
+
+
+if __name__ == '__main__':
+    unittest.main()
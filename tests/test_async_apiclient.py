@@ -0,0 +1,60 @@
+import asyncio
+import tempfile
+import unittest
+
+from api.async_apiclient import AsyncApiClient
+from api.journal import MutationJournal, journal_path
+from benchmarks.scenarios import bench_config
+from exceptions.tinyurl_exceptions import TinyUrlUpdateError
+from fakeapi.server import FakeTinyUrlServer
+
+
+class AsyncApiClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeTinyUrlServer().start()
+        self.addCleanup(self.server.stop)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.config = dict(bench_config(self.server.base_url, 4), state_path=self.directory.name)
+
+    def run_client(self, coroutine_function):
+        async def run():
+            async with AsyncApiClient(self.config['auth_tokens'], config=self.config) as client:
+                return await coroutine_function(client)
+
+        return asyncio.run(run())
+
+    def test_mutations_are_journaled(self):
+        async def create_and_change(client):
+            data = await client.create_tinyurl(f'{self.server.landing_url}/a', no_check=True, ref=4)
+            await client.update_tinyurl_redirect_service(data['alias'], f'{self.server.landing_url}/b')
+            return data['alias']
+
+        alias = self.run_client(create_and_change)
+        journal = MutationJournal(journal_path(self.config))
+        self.addCleanup(journal.close)
+        state = journal.replay()
+        self.assertEqual(state.created[4]['alias'], alias)
+        self.assertEqual(state.targets[alias], f'{self.server.landing_url}/b')
+        self.assertFalse(state.pending)
+
+    def test_unknown_alias_is_a_key_error(self):
+        async def change(client):
+            await client.update_tinyurl_redirect_service('unknown', f'{self.server.landing_url}/b')
+
+        self.assertRaises(KeyError, self.run_client, change)
+
+    def test_change_of_foreign_alias_fails_in_journal(self):
+        async def change(client):
+            client.alias_token_mapping['foreign'] = 'other-token'  # Token without a session yet
+            await client.update_tinyurl_redirect_service('foreign', f'{self.server.landing_url}/b', retry=0)
+
+        self.assertRaises(TinyUrlUpdateError, self.run_client, change)
+        journal = MutationJournal(journal_path(self.config))
+        self.addCleanup(journal.close)
+        self.assertFalse(journal.replay().pending)
+
+
+if __name__ == '__main__':
+    unittest.main()
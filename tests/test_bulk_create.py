@@ -0,0 +1,43 @@
+import io
+import json
+import unittest
+from unittest import mock
+
+from benchmarks.scenarios import bench_config
+from fakeapi.server import FakeTinyUrlServer
+from tinyurl.tum import TinyUrlManager
+
+
+class CreateFromStreamTest(unittest.TestCase):
+    """
+    Streamed creates are verified before heartbeat hears of them, like create_from_list does it.
+    """
+
+    def setUp(self):
+        self.server = FakeTinyUrlServer().start()
+        self.addCleanup(self.server.stop)
+        self.tum = TinyUrlManager(app_config=bench_config(self.server.base_url, 4))
+        self.addCleanup(self.tum.api_client.close)
+        self.tum.use_spinner = True
+        self.messages = []
+        self.tum._enqueue = self.messages.append
+
+    def test_invalid_redirect_is_never_registered(self):
+        good, bad = f'{self.server.landing_url}/good', f'{self.server.landing_url}/bad'
+
+        def check_redirect_url(tinyurl, domain):
+            self.assertNotIn(tinyurl, [message['update']['tinyurl'] for message in self.messages])  # Not yet
+            return tinyurl if self.server.state.aliases[tinyurl.split('/')[-1]]['url'] == good else None
+
+        output = io.StringIO()
+        with mock.patch('tinyurl.tum.check_redirect_url', side_effect=check_redirect_url):
+            self.tum.create_from_stream([good], output)
+            self.tum.create_from_stream([bad], output)
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([record['status'] for record in records], ['created', 'invalid_redirect'])
+        self.assertEqual([message['update']['id'] for message in self.messages], [records[0]['id']])
+        self.assertEqual(list(self.tum.id_tinyurl_mapping), [records[0]['id']])
+
+
+if __name__ == '__main__':
+    unittest.main()
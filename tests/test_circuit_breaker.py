@@ -0,0 +1,116 @@
+import unittest
+from unittest import mock
+
+from requests.exceptions import InvalidURL
+from urllib3.exceptions import LocationParseError
+
+from api.apiclient import ApiClient
+from api.retry import CircuitBreaker
+from exceptions.tinyurl_exceptions import CircuitOpenError, RequestError
+
+HOST = 'http://api.test'
+
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+
+def expire(breaker: CircuitBreaker):
+    breaker.opened_at -= breaker.reset_timeout  # As if reset_timeout went by
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker('api.test', failure_threshold=2, reset_timeout=30)
+
+    def test_opens_after_threshold(self):
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertRaises(CircuitOpenError, self.breaker.before_call)
+
+    def test_half_open_allows_single_trial(self):
+        open_breaker(self.breaker)
+        expire(self.breaker)
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_success_closes(self):
+        open_breaker(self.breaker)
+        expire(self.breaker)
+        self.breaker.before_call()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_half_open_failure_opens_again(self):
+        open_breaker(self.breaker)
+        expire(self.breaker)
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_released_trial_can_be_taken_again(self):
+        open_breaker(self.breaker)
+        expire(self.breaker)
+        trial = self.breaker.before_call()
+        self.breaker.release_trial(trial)
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+
+    def test_late_release_does_not_free_newer_trial(self):
+        open_breaker(self.breaker)
+        expire(self.breaker)
+        old_trial = self.breaker.before_call()
+        self.breaker.record_failure()
+        expire(self.breaker)
+        self.breaker.before_call()
+        self.breaker.release_trial(old_trial)
+        self.assertFalse(self.breaker.allow())
+
+    def test_closed_release_is_noop(self):
+        self.breaker.release_trial(self.breaker.before_call())
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+
+class ApiClientBreakerTest(unittest.TestCase):
+    """
+    Non-retryable errors during the half-open trial used to keep the trial slot taken, the host stayed blocked.
+    """
+
+    def setUp(self):
+        self.api_client = ApiClient(['token'], config={'api_base_url': HOST, 'retry_base_delay': 0})
+        self.breaker = self.api_client.circuit_breakers.get(HOST)
+        open_breaker(self.breaker)
+        expire(self.breaker)
+
+    def tearDown(self):
+        self.api_client.close()
+
+    def test_send_non_retryable_error_releases_trial(self):
+        session = self.api_client.get_session('token')
+        with mock.patch.object(session, 'request', side_effect=InvalidURL('bad url')):
+            self.assertRaises(InvalidURL, self.api_client._send, 'PATCH', f'{HOST}/change', 'token', {})
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+
+    def test_preflight_non_retryable_error_releases_trial(self):
+        with mock.patch.object(self.api_client.preflight_session, 'head', side_effect=InvalidURL('bad url')):
+            self.assertRaises(RequestError, self.api_client._preflight, HOST)
+        self.assertTrue(self.breaker.allow())
+
+    def test_preflight_parse_error_releases_trial(self):
+        with mock.patch.object(self.api_client.preflight_session, 'head', side_effect=LocationParseError(HOST)):
+            self.assertRaises(RequestError, self.api_client._preflight, HOST)
+        self.assertTrue(self.breaker.allow())
+
+
+if __name__ == '__main__':
+    unittest.main()
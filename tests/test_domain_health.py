@@ -0,0 +1,117 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from unittest import mock
+
+from requests.exceptions import ConnectTimeout
+
+from api.apiclient import ApiClient
+from services.domain_health import DomainHealth
+from services.heartbeat import HeartbeatService
+from utility.events import ClearableEvent
+
+DOMAIN = 'target.test'
+SAMPLE_URL = 'https://target.test/sample'
+ORIGINAL_URL = 'https://target.test/page?id=1'
+FALLBACK = 'https://fallback.test/'
+
+
+def response(status_code: int, headers: dict = None):
+    return mock.Mock(status_code=status_code, headers=headers or {})
+
+
+class DomainHealthTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api_client = ApiClient(['token'], config={'api_base_url': 'http://api.test', 'breaker_threshold': 100})
+        self.addCleanup(self.api_client.close)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+        self.health = DomainHealth(self.api_client, check_interval=3600, failure_threshold=3)
+        self.health.remember(DOMAIN, SAMPLE_URL)
+
+    def refresh(self, status_code: int) -> set:
+        with mock.patch.object(self.api_client.preflight_session, 'head', return_value=response(status_code)):
+            return self.health.refresh([DOMAIN], self.executor)
+
+    def test_single_failure_is_not_down(self):
+        self.assertEqual(self.refresh(503), set())
+        self.assertFalse(self.health.is_healthy(DOMAIN))
+        self.assertEqual(self.refresh(200), set())  # Suspect domain is checked again despite check_interval
+        self.assertTrue(self.health.is_healthy(DOMAIN))
+
+    def test_consecutive_failures_mark_down(self):
+        self.refresh(503)
+        self.refresh(503)
+        self.assertEqual(self.refresh(503), {DOMAIN})
+        self.assertEqual(self.refresh(503), {DOMAIN})  # Down domain waits for check_interval
+
+    def test_open_breaker_marks_down(self):
+        breaker = self.api_client.circuit_breakers.get(SAMPLE_URL)
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        self.assertEqual(self.refresh(200), {DOMAIN})  # Check isn't even sent
+
+
+class HeartbeatDomainTest(unittest.TestCase):
+    """
+    Tinyurls of a down domain move to a fallback and come back once the domain is healthy.
+    """
+
+    def setUp(self):
+        self.api_client = ApiClient(['token'], config={'api_base_url': 'http://api.test', 'breaker_threshold': 100})
+        self.addCleanup(self.api_client.close)
+        self.heartbeat = HeartbeatService(Queue(), ClearableEvent(), ClearableEvent(), api_client=self.api_client,
+                                          load_data={1: {'https://tinyurl.com/one': DOMAIN}},
+                                          config={'ping_interval': 1, 'probe_engine': 'thread',
+                                                  'domain_check_interval': 1e-6, 'domain_failure_threshold': 2})
+        self.addCleanup(self.heartbeat.executor.shutdown)
+        self.heartbeat.domain_health.remember(DOMAIN, SAMPLE_URL)
+        self.changes = []
+        patcher = mock.patch.object(self.api_client, 'update_tinyurl_redirect_service', side_effect=self.change)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def change(self, alias, target_url, *args, **kwargs):
+        self.changes.append(target_url)
+        return {'alias': alias, 'url': target_url}
+
+    def check_domains(self, domain_status: int, fallback=FALLBACK) -> list:
+        def head(url, **kwargs):
+            if url == SAMPLE_URL:
+                return response(domain_status)
+            return response(301, {'Location': ORIGINAL_URL})  # First hop of the tinyurl
+
+        with mock.patch.object(self.api_client.preflight_session, 'head', side_effect=head), \
+                mock.patch.object(self.heartbeat.domain_health, 'pick_fallback', return_value=fallback):
+            return self.heartbeat._check_domains([1])
+
+    def test_one_failure_does_not_move(self):
+        self.assertEqual(self.check_domains(503), [1])
+        self.assertEqual(self.changes, [])
+
+    def test_moved_tinyurl_is_restored(self):
+        self.check_domains(503)
+        self.assertEqual(self.check_domains(503), [])
+        self.assertEqual(self.changes, [FALLBACK])
+        self.assertEqual(self.heartbeat.displaced[1], (DOMAIN, ORIGINAL_URL))
+        self.check_domains(503)  # Still down, stays on the fallback
+        self.assertEqual(self.changes, [FALLBACK])
+        self.check_domains(200)
+        self.assertEqual(self.changes, [FALLBACK, ORIGINAL_URL])
+        self.assertEqual(self.heartbeat.id_target_mapping[1], DOMAIN)
+        self.assertNotIn(1, self.heartbeat.displaced)
+
+    def test_without_fallback_tinyurls_are_probed_on_their_own(self):
+        self.check_domains(503, fallback=None)
+        self.assertEqual(self.check_domains(503, fallback=None), [1])
+        self.assertEqual(self.changes, [])
+
+    def test_timeouts_count_as_failures(self):
+        with mock.patch.object(self.api_client.preflight_session, 'head', side_effect=ConnectTimeout()):
+            self.heartbeat.domain_health.refresh([DOMAIN], self.heartbeat.executor)
+            self.assertEqual(self.heartbeat.domain_health.refresh([DOMAIN], self.heartbeat.executor), {DOMAIN})
+
+
+if __name__ == '__main__':
+    unittest.main()
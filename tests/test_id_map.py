@@ -0,0 +1,55 @@
+import unittest
+
+from utility.id_map import IdMap, MIN_GAP
+
+
+class IdMapTest(unittest.TestCase):
+
+    def test_mapping(self):
+        id_map = IdMap([(3, 'c'), (1, 'a')])
+        self.assertEqual(id_map[1], 'a')
+        self.assertEqual(id_map.get(2, 'missing'), 'missing')
+        self.assertNotIn(-1, id_map)
+        self.assertNotIn('1', id_map)
+        self.assertEqual(id_map.pop(1), 'a')
+        self.assertRaises(KeyError, id_map.__getitem__, 1)
+        self.assertEqual(id_map.pop(1, None), None)
+        self.assertRaises(KeyError, id_map.__setitem__, -1, 'x')
+        self.assertRaises(ValueError, id_map.__setitem__, 1, None)
+        self.assertEqual(len(id_map), 1)
+
+    def test_large_id_does_not_grow_list(self):
+        id_map = IdMap([(1, 'a')])
+        id_map[10 ** 9] = 'far'
+        self.assertLess(len(id_map.slots), MIN_GAP * 2)
+        self.assertEqual(id_map[10 ** 9], 'far')
+        self.assertEqual(list(id_map.items()), [(1, 'a'), (10 ** 9, 'far')])
+        self.assertEqual(id_map.pop(10 ** 9), 'far')
+        self.assertEqual(len(id_map), 1)
+
+    def test_sparse_ids_move_into_list(self):
+        id_map = IdMap()
+        id_map[200] = 'far'
+        for tinyurl_id in range(200):
+            id_map[tinyurl_id] = tinyurl_id
+        self.assertEqual(list(id_map), list(range(201)))
+        id_map[201] = 'next'  # The list reaches 200
+        self.assertFalse(id_map.sparse)
+        self.assertEqual(id_map[200], 'far')
+        self.assertEqual(len(id_map), 202)
+
+    def test_holes_are_reclaimed(self):
+        id_map = IdMap((tinyurl_id, tinyurl_id) for tinyurl_id in range(1000))
+        for tinyurl_id in range(990, 1000):  # Trailing holes are trimmed
+            del id_map[tinyurl_id]
+        self.assertEqual(len(id_map.slots), 990)
+        for tinyurl_id in range(10, 990):  # Mostly holes, the rest moves to the dict
+            del id_map[tinyurl_id]
+        self.assertLessEqual(len(id_map.slots), MIN_GAP)
+        self.assertEqual(list(id_map.items()), [(tinyurl_id, tinyurl_id) for tinyurl_id in range(10)])
+        id_map[10] = 10
+        self.assertEqual(list(id_map.values()), list(range(11)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+
+from api.journal import MutationJournal, INTENT, DONE, FAILED
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.journal = MutationJournal(os.path.join(self.directory.name, 'journal.jsonl'))
+        self.journal.append('create', DONE, alias='spare1', token='t1', url='https://fallback.test',
+                            tiny_url='https://tinyurl.com/spare1')
+
+    def tearDown(self):
+        self.journal.close()
+        self.directory.cleanup()
+
+    def claim_intent(self):
+        self.journal.append('claim', INTENT, alias='spare1', url='https://target.test',
+                            tiny_url='https://tinyurl.com/spare1', spare_url='https://fallback.test', ref=7)
+
+    def test_unclaimed_spare_is_free(self):
+        self.assertIn('spare1', self.journal.replay().spares)
+
+    def test_crash_during_claim_does_not_free_spare(self):
+        self.claim_intent()
+        self.journal.append('change', DONE, alias='spare1', url='https://target.test')  # Landed, then crash
+        state = self.journal.replay()
+        self.assertNotIn('spare1', state.spares)
+        self.assertEqual(state.pending[('claim', 'spare1')]['ref'], 7)
+
+    def test_refused_claim_puts_spare_back(self):
+        self.claim_intent()
+        self.journal.append('claim', FAILED, alias='spare1')
+        state = self.journal.replay()
+        self.assertEqual(state.spares['spare1']['url'], 'https://fallback.test')
+        self.assertNotIn(('claim', 'spare1'), state.pending)
+
+    def test_done_claim_hands_spare_to_ref(self):
+        self.claim_intent()
+        self.journal.append('claim', DONE, alias='spare1', url='https://target.test',
+                            tiny_url='https://tinyurl.com/spare1', ref=7)
+        state = self.journal.replay()
+        self.assertNotIn('spare1', state.spares)
+        self.assertEqual(state.created[7]['alias'], 'spare1')
+        self.assertFalse(state.pending)
+
+    def test_compact_keeps_unresolved_intents(self):
+        self.journal.append('create', INTENT, alias='orphan', url='https://target.test', ref=3)  # Timed out
+        self.journal.append('change', INTENT, alias='spare1', url='https://moved.test')
+        self.journal.append('change', INTENT, alias='other', url='https://moved.test')
+        self.journal.append('change', FAILED, alias='other', status=404)
+        self.journal.compact([{'op': 'create', 'phase': DONE, 'alias': 'spare1', 'token': 't1',
+                               'url': 'https://fallback.test', 'tiny_url': 'https://tinyurl.com/spare1'}])
+        state = self.journal.replay()
+        self.assertEqual(set(state.pending), {('create', 'orphan'), ('change', 'spare1')})
+        self.assertEqual(state.pending[('create', 'orphan')]['ref'], 3)
+        self.assertIn('spare1', state.spares)
+
+    def test_compact_drops_resolved_intents(self):
+        self.journal.append('change', INTENT, alias='spare1', url='https://moved.test')
+        self.journal.append('change', DONE, alias='spare1', url='https://moved.test')
+        self.journal.compact([])
+        self.assertFalse(self.journal.replay().pending)
+
+    def test_append_after_close_is_ignored(self):
+        self.journal.close()
+        self.journal.append('change', INTENT, alias='spare1', url='https://moved.test')
+        self.journal.compact([])
+        self.assertNotIn(('change', 'spare1'), self.journal.replay().pending)
+
+
+if __name__ == '__main__':
+    unittest.main()
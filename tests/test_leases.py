@@ -0,0 +1,174 @@
+import math
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from services.leases import LeaseCoordinator, LeaseStore
+
+SHARDS = 16
+TTL = 1.5
+SETTLE_TIMEOUT = 15
+
+
+def run_node(path: str, node_id: str, commands, replies):
+    """
+    One heartbeat node in its own process, driven by the test through commands.
+    """
+    coordinator = LeaseCoordinator(path, node_id=node_id, shards=SHARDS, ttl=TTL)
+    coordinator.start()
+    while True:
+        command, *args = commands.get()
+        if command == 'owned':
+            replies.put(sorted(shard for shard in coordinator.owned if time.monotonic() < coordinator.valid_until))
+        elif command == 'publish':
+            coordinator.publish_target(*args)
+            replies.put(True)
+        elif command == 'pull':
+            replies.put(coordinator.pull_targets())
+        elif command == 'exit':
+            coordinator.close()
+            replies.put(True)
+            return
+
+
+class Node:
+
+    def __init__(self, context, path: str, node_id: str):
+        self.commands = context.Queue()
+        self.replies = context.Queue()
+        self.process = context.Process(target=run_node, args=(path, node_id, self.commands, self.replies),
+                                       daemon=True)
+        self.process.start()
+
+    def ask(self, command: str, *args):
+        self.commands.put((command, *args))
+        return self.replies.get(timeout=SETTLE_TIMEOUT)
+
+
+class FailingCursor:
+    """
+    Cursor that fails on the statement containing fail_on, like a busy timeout or I/O error in the middle.
+    """
+
+    def __init__(self, cursor, fail_on: str):
+        self.cursor = cursor
+        self.fail_on = fail_on
+
+    def execute(self, sql, *args):
+        if self.fail_on in sql:
+            raise sqlite3.OperationalError('disk I/O error')
+        return self.cursor.execute(sql, *args)
+
+
+class FailingConnection:
+
+    def __init__(self, connection, fail_on: str):
+        self.connection = connection
+        self.fail_on = fail_on
+
+    def cursor(self):
+        return FailingCursor(self.connection.cursor(), self.fail_on)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+class LeaseStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = LeaseStore(os.path.join(self.directory.name, 'leases.db'))
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def assert_failure_rolls_back(self, fail_on: str, call):
+        connection = self.store.connection
+        self.store.connection = FailingConnection(connection, fail_on)
+        self.assertRaises(sqlite3.OperationalError, call)
+        self.store.connection = connection
+        self.assertFalse(connection.in_transaction)
+        owned, _ = self.store.balance('node', SHARDS, TTL)  # Next transaction on the connection still works
+        self.assertEqual(len(owned), SHARDS)
+
+    def test_release_rolls_back_on_error(self):
+        self.assert_failure_rolls_back('DELETE FROM nodes', lambda: self.store.release('node'))
+
+    def test_publish_rolls_back_on_error(self):
+        self.assert_failure_rolls_back('INSERT OR REPLACE INTO targets',
+                                       lambda: self.store.publish_target('https://tinyurl.com/a', 'https://b.com/',
+                                                                         'b.com'))
+
+    def test_targets_since(self):
+        self.store.publish_target('https://tinyurl.com/a', 'https://a.com/', 'a.com')
+        self.store.publish_target('https://tinyurl.com/b', 'https://b.com/', 'b.com')
+        rows = self.store.targets_since(0)
+        self.assertEqual([row[0] for row in rows], ['https://tinyurl.com/a', 'https://tinyurl.com/b'])
+        self.assertEqual(self.store.targets_since(rows[0][3])[0][0], 'https://tinyurl.com/b')
+
+
+class LeaseProcessesTest(unittest.TestCase):
+    """
+    Several nodes as separate processes on one lease file.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'leases.db')
+        self.context = multiprocessing.get_context('spawn')
+        self.nodes = [Node(self.context, self.path, f'node-{index}') for index in range(3)]
+
+    def tearDown(self):
+        for node in self.nodes:
+            if node.process.is_alive():
+                node.process.kill()
+            node.process.join()
+        self.directory.cleanup()
+
+    def wait_for_split(self, nodes):
+        """
+        :return: owned shards per node once every shard has exactly one owner and nobody holds more than its share
+        """
+        fair_share = math.ceil(SHARDS / len(nodes))
+        deadline = time.monotonic() + SETTLE_TIMEOUT
+        while True:
+            owned = [node.ask('owned') for node in nodes]
+            shards = [shard for node_shards in owned for shard in node_shards]
+            balanced = all(len(node_shards) <= fair_share for node_shards in owned)
+            if (sorted(shards) == list(range(SHARDS)) and balanced) or time.monotonic() > deadline:
+                return owned
+            time.sleep(TTL / 6)
+
+    def assert_split(self, owned):
+        self.assertEqual(sorted(shard for node_shards in owned for shard in node_shards), list(range(SHARDS)))
+        fair_share = math.ceil(SHARDS / len(owned))
+        self.assertTrue(all(0 < len(node_shards) <= fair_share for node_shards in owned), owned)
+
+    def test_every_shard_has_one_owner(self):
+        self.assert_split(self.wait_for_split(self.nodes))
+
+    def test_expired_lease_is_taken_over(self):
+        self.assert_split(self.wait_for_split(self.nodes))
+        dead = self.nodes[0]
+        dead_shards = dead.ask('owned')
+        dead.process.kill()  # No release, its leases have to expire
+        dead.process.join()
+        owned = self.wait_for_split(self.nodes[1:])
+        self.assert_split(owned)
+        self.assertTrue(set(dead_shards) <= set(owned[0]) | set(owned[1]))
+
+    def test_published_targets_are_pulled_by_others(self):
+        self.nodes[0].ask('publish', 'https://tinyurl.com/a', 'https://new.com/', 'new.com')
+        for node in self.nodes[1:]:
+            self.assertEqual(node.ask('pull'), [('https://tinyurl.com/a', 'https://new.com/', 'new.com')])
+            self.assertEqual(node.ask('pull'), [])
+        for node in self.nodes:
+            node.ask('exit')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+from unittest import mock
+
+from requests.exceptions import ConnectionError, Timeout
+
+from api.apiclient import ApiClient
+from exceptions.tinyurl_exceptions import NetworkError, RequestError
+
+URL = 'http://target.test/page'
+
+
+def traceback_depth(error: Exception) -> int:
+    depth, traceback = 0, error.__traceback__
+    while traceback:
+        depth, traceback = depth + 1, traceback.tb_next
+    return depth
+
+
+class PreflightCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api_client = ApiClient(['token'], config={'api_base_url': 'http://api.test', 'breaker_threshold': 100})
+        self.addCleanup(self.api_client.close)
+
+    def failures(self, side_effect, error_type):
+        with mock.patch.object(self.api_client.preflight_session, 'head', side_effect=side_effect) as head:
+            errors = []
+            for _ in range(3):
+                with self.assertRaises(error_type) as context:
+                    self.api_client.check_target_url(URL)
+                errors.append(context.exception)
+        self.assertEqual(head.call_count, 1)  # Hits come from the cache
+        return errors
+
+    def test_cached_failure_is_raised_as_new_exception(self):
+        errors = self.failures(Timeout(), NetworkError)
+        self.assertEqual(len({id(error) for error in errors}), 3)
+        self.assertEqual({str(error) for error in errors}, {str(errors[0])})
+        self.assertEqual(traceback_depth(errors[1]), traceback_depth(errors[2]))  # No frames of earlier callers
+
+    def test_cached_request_error_keeps_url(self):
+        errors = self.failures(ConnectionError(), RequestError)
+        self.assertEqual(str(errors[0]), str(errors[2]))
+        self.assertEqual(errors[2].url, URL)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from api.apiclient import ApiClient
+from api.token_scheduler import TokenScheduler, parse_retry_after, DEFAULT_RETRY_AFTER
+from exceptions.tinyurl_exceptions import NoTokenAvailable
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class TokenSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('api.token_scheduler.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.scheduler = TokenScheduler(['a', 'b'], rate=1.0, burst=2, quarantine_time=300)
+
+    def test_burst_then_rate(self):
+        self.assertEqual(self.scheduler.reserve_for('a'), 0)
+        self.assertEqual(self.scheduler.reserve_for('a'), 0)
+        self.assertAlmostEqual(self.scheduler.reserve_for('a'), 1.0)
+        self.clock.advance(2)
+        self.assertEqual(self.scheduler.reserve_for('a'), 0)
+
+    def test_reserve_spreads_over_tokens(self):
+        tokens = [self.scheduler.reserve()[0] for _ in range(4)]
+        self.assertEqual(sorted(tokens), ['a', 'a', 'b', 'b'])
+
+    def test_preferred_token(self):
+        self.assertEqual(self.scheduler.reserve(preferred='b'), ('b', 0))
+
+    def test_blocked_preferred_token_is_skipped(self):
+        self.scheduler.report_rate_limited('a', '30')
+        self.assertEqual(self.scheduler.reserve(preferred='a'), ('b', 0))
+        self.scheduler.reserve_for('b')
+        self.scheduler.reserve_for('b')  # Both buckets empty now, b refills first
+        self.assertEqual(self.scheduler.reserve(preferred='a')[0], 'b')
+        self.clock.advance(30)
+        self.assertEqual(self.scheduler.reserve(preferred='a'), ('a', 0))
+
+    def test_rate_limited_token_waits_retry_after(self):
+        self.assertEqual(self.scheduler.report_rate_limited('a', '30'), 30)
+        self.assertAlmostEqual(self.scheduler.reserve_for('a'), 30)
+        self.assertEqual(self.scheduler.reserve(), ('b', 0))  # The other token is picked meanwhile
+        self.clock.advance(30)
+        self.assertEqual(self.scheduler.reserve_for('a'), 0)
+
+    def test_rate_limited_without_retry_after(self):
+        self.scheduler.report_rate_limited('a')
+        self.assertAlmostEqual(self.scheduler.usage()['a']['available_in'], DEFAULT_RETRY_AFTER)
+
+    def test_unauthorized_token_is_quarantined(self):
+        self.scheduler.report_unauthorized('a')
+        self.assertTrue(self.scheduler.usage()['a']['quarantined'])
+        self.assertRaises(NoTokenAvailable, self.scheduler.reserve_for, 'a')
+        self.assertEqual(self.scheduler.reserve(preferred='a')[0], 'b')
+        self.clock.advance(300)
+        self.assertEqual(self.scheduler.reserve_for('a'), 0)
+
+    def test_all_tokens_quarantined(self):
+        self.scheduler.report_unauthorized('a')
+        self.scheduler.report_unauthorized('b')
+        self.assertRaises(NoTokenAvailable, self.scheduler.reserve)
+        self.scheduler.release_quarantine('b')
+        self.assertEqual(self.scheduler.reserve()[0], 'b')
+
+    def test_usage_counts(self):
+        self.scheduler.reserve_for('a')
+        self.scheduler.report_success('a')
+        self.scheduler.report_rate_limited('a', '1')
+        usage = self.scheduler.usage()['a']
+        self.assertEqual((usage['requests'], usage['successes'], usage['rate_limited']), (1, 1, 1))
+
+
+class ApiClientTokenTest(unittest.TestCase):
+    """
+    _send feeds 429 and 401/403 responses to the scheduler and retries with another token.
+    """
+
+    def setUp(self):
+        self.api_client = ApiClient(['a', 'b'], config={'api_base_url': 'http://api.test', 'retry_base_delay': 0})
+        self.addCleanup(self.api_client.close)
+
+    def respond(self, token: str, status_code: int, headers: dict = None):
+        response = mock.Mock(status_code=status_code, headers=headers or {})
+        patcher = mock.patch.object(self.api_client.get_session(token), 'request', return_value=response)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rate_limited_token_is_swapped(self):
+        self.respond('a', 429, {'Retry-After': '30'})
+        self.respond('b', 200)
+        token, response = self.api_client._send('POST', 'http://api.test/create', None, {})
+        self.assertEqual((token, response.status_code), ('b', 200))
+        usage = self.api_client.get_token_usage()
+        self.assertEqual(usage['a']['rate_limited'], 1)
+        self.assertGreater(usage['a']['available_in'], 25)
+
+    def test_cycling_tokens_does_not_pin(self):
+        self.assertEqual(self.api_client.cycle_next_token(), 'b')
+        self.assertIsNone(self.api_client.pinned_token)
+
+    def test_unauthorized_token_is_quarantined(self):
+        self.respond('a', 401)
+        self.respond('b', 200)
+        token, _ = self.api_client._send('POST', 'http://api.test/create', None, {})
+        self.assertEqual(token, 'b')
+        self.assertTrue(self.api_client.get_token_usage()['a']['quarantined'])
+        self.assertRaises(NoTokenAvailable, self.api_client._send, 'PATCH', 'http://api.test/change', 'a', {})
+
+
+class ParseRetryAfterTest(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after('12'), 12)
+        self.assertEqual(parse_retry_after('-5'), 0)
+
+    def test_http_date(self):
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=120)
+        self.assertAlmostEqual(parse_retry_after(format_datetime(retry_at, usegmt=True)), 120, delta=2)
+
+    def test_missing_or_invalid(self):
+        self.assertEqual(parse_retry_after(None), DEFAULT_RETRY_AFTER)
+        self.assertEqual(parse_retry_after('soon', default=7), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+from unittest import mock
+
+from requests.exceptions import ConnectTimeout
+
+from api.apiclient import ApiClient
+from services.sharded_heartbeat import worker_config
+
+FALLBACK = 'https://fallback.test/'
+
+
+class FallbackProbeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api_client = ApiClient(['token'], [FALLBACK], config={'api_base_url': 'http://api.test',
+                                                                   'fallback_probe_interval': 0,
+                                                                   'breaker_threshold': 2})
+        self.addCleanup(self.api_client.close)
+        self.tunneling_service = self.api_client.tunneling_service
+
+    def test_probe_uses_preflight_session(self):
+        with mock.patch.object(self.api_client.preflight_session, 'head',
+                               return_value=mock.Mock(status_code=200)) as head:
+            self.assertTrue(self.tunneling_service.probe(FALLBACK))
+        head.assert_called_once()
+        self.assertEqual(self.tunneling_service.health()[FALLBACK]['successes'], 1)
+
+    def test_failures_open_breaker_and_stop_probes(self):
+        with mock.patch.object(self.api_client.preflight_session, 'head', side_effect=ConnectTimeout()) as head:
+            for _ in range(3):
+                self.assertFalse(self.tunneling_service.probe(FALLBACK))
+        self.assertEqual(head.call_count, 2)  # Third one is skipped, the breaker is open
+        self.assertTrue(self.api_client.circuit_breakers.get(FALLBACK).is_open())
+        self.assertEqual(self.tunneling_service.health()[FALLBACK]['failures'], 3)
+
+    def test_shard_workers_do_not_probe(self):
+        config = worker_config({'fallback_probe_interval': 60}, shards=4)
+        api_client = ApiClient(['token'], [FALLBACK], config=dict(config, api_base_url='http://api.test'))
+        self.addCleanup(api_client.close)
+        self.assertIsNone(api_client.tunneling_service.probe_thread)
+        parent_client = ApiClient(['token'], [FALLBACK], config={'api_base_url': 'http://api.test',
+                                                                 'fallback_probe_interval': 60})
+        self.addCleanup(parent_client.close)
+        self.assertIsNotNone(parent_client.tunneling_service.probe_thread)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,2 +1,3 @@
 from .tum import TinyUrlManager
 from .tinyurl import TinyUrl
+from .async_tum import AsyncTinyUrlManager
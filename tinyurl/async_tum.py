@@ -0,0 +1,108 @@
+import asyncio
+from typing import List, Dict
+from urllib.parse import urlparse
+
+from api.async_apiclient import AsyncApiClient
+from api.journal import DONE
+from exceptions.tinyurl_exceptions import TinyUrlCreationError, TinyUrlUpdateError, NetworkError, RequestError
+from .registry import TinyUrlRegistry
+from .tinyurl import TinyUrl
+from utility.ansi_codes import AnsiCodes
+
+
+class AsyncTinyUrlManager:
+    """
+    Asyncio counterpart of TinyUrlManager for API usage without the heartbeat service. It writes the same mutation
+    journal, TinyUrlManager.restore_from_journal replays it.
+
+    Usage:
+        async with AsyncTinyUrlManager(app_config=config) as tum:
+            result = await tum.create_from_list(urls)
+    """
+
+    def __init__(self, app_config: Dict[str, List[str]] = None):
+        self.auth_tokens: List[str] = app_config.get('auth_tokens')
+        self.fallback_urls: List[str] = app_config.get('fallback_urls', [])
+        self.id_tinyurl_mapping = TinyUrlRegistry()
+        self.api_client = AsyncApiClient(self.auth_tokens, self.fallback_urls, config=app_config)
+        self.selected_id = None
+
+    async def __aenter__(self):
+        await self.api_client.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.api_client.close()
+
+    async def create_tinyurl(self, url: str, no_check: bool = False, new_id: int = None):
+        new_id = new_id or self.get_next_available_id()
+        try:
+            new_tinyurl = TinyUrl(new_id)
+            data = await self.api_client.create_tinyurl(url, no_check=no_check, ref=new_tinyurl.id)
+            new_tinyurl.load_created(data)
+            self.id_tinyurl_mapping[new_tinyurl.id] = new_tinyurl
+            return new_tinyurl
+        except (TinyUrlCreationError, RequestError, NetworkError, ValueError) as e:
+            raise e
+
+    async def update_tinyurl(self, url: str, tinyurl_id: int = None):
+        try:
+            updated_tinyurl: TinyUrl = self.id_tinyurl_mapping[tinyurl_id or self.selected_id]
+            data = await self.api_client.update_tinyurl_redirect_user(updated_tinyurl.alias, url)
+            updated_tinyurl.load_updated(data)
+            self.id_tinyurl_mapping.reindex(updated_tinyurl.id)
+            return updated_tinyurl
+        except (TinyUrlUpdateError, RequestError, NetworkError) as e:
+            raise e
+
+    async def create_from_list(self, urls_list: List[str], wait_time: int = 60):
+        result = {'errors': [], 'created': [], 'invalid_redirect': []}
+        urls = [url if urlparse(url).scheme else 'https://' + url for url in urls_list]
+        assigned_id = self.id_tinyurl_mapping.allocate_id(len(urls))
+
+        async def create_and_verify(url, new_id):
+            new_tinyurl = await self.create_tinyurl(url, True, new_id)
+            valid = await self.api_client.check_redirect_url(new_tinyurl.tinyurl, new_tinyurl.domain)
+            return new_tinyurl, valid
+
+        tasks = [asyncio.ensure_future(create_and_verify(url, assigned_id + i)) for i, url in enumerate(urls)]
+        done, pending = await asyncio.wait(tasks, timeout=wait_time)
+        for task in pending:
+            task.cancel()
+            result['errors'].append(asyncio.TimeoutError())
+        for task in done:
+            try:
+                new_tinyurl, valid = task.result()
+            except Exception as e:
+                result['errors'].append(e)
+                continue
+            if valid:
+                result['created'].append({'url': new_tinyurl.tinyurl, 'redirect': new_tinyurl.final_url})
+            else:
+                result['invalid_redirect'].append(new_tinyurl.tinyurl)
+                self.id_tinyurl_mapping.pop(new_tinyurl.id)
+                self.api_client.record_mutation(DONE, 'delete', ref=new_tinyurl.id, alias=new_tinyurl.alias)
+        return result
+
+    async def self_check(self, timeout=60):
+        result = {}
+        tinyurls = list(self.id_tinyurl_mapping.values())
+        checks = [self.api_client.check_redirect_url(t.tinyurl, t.domain) for t in tinyurls]
+        try:
+            verdicts = await asyncio.wait_for(asyncio.gather(*checks), timeout=timeout)
+        except asyncio.TimeoutError as e:
+            return {t.tinyurl: str(e) for t in tinyurls}
+        for tinyurl, valid in zip(tinyurls, verdicts):
+            if not valid:
+                result[tinyurl.tinyurl] = f'Invalid target domain: {tinyurl.domain}'
+        return result
+
+    def get_all(self):
+        return self.id_tinyurl_mapping
+
+    def print_all(self):
+        for tinyurl in self.id_tinyurl_mapping.values():
+            print(f'\n{AnsiCodes.YELLOW}{tinyurl}')
+
+    def get_next_available_id(self):
+        return self.id_tinyurl_mapping.allocate_id()
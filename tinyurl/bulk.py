@@ -0,0 +1,63 @@
+import json
+import os
+import sys
+from typing import Dict, TextIO
+
+CREATED = 'created'
+INVALID_REDIRECT = 'invalid_redirect'
+ERROR = 'error'
+SKIPPED = 'skipped'
+DONE_STATUSES = (CREATED, INVALID_REDIRECT)  # Errors are tried again when a run is resumed
+
+
+class DoneLines:
+    """
+    Input line numbers finished by a previous run, one byte per line so resuming millions of lines stays cheap.
+    """
+
+    def __init__(self):
+        self.lines = bytearray()
+        self.count = 0
+
+    def add(self, line: int):
+        if line >= len(self.lines):
+            self.lines.extend(bytes(line + 1 - len(self.lines)))
+        if not self.lines[line]:
+            self.lines[line] = 1
+            self.count += 1
+
+    def __contains__(self, line: int) -> bool:
+        return line < len(self.lines) and bool(self.lines[line])
+
+    def __len__(self) -> int:
+        return self.count
+
+    @classmethod
+    def load(cls, output_path: str) -> 'DoneLines':
+        """
+        :param output_path: JSONL results of create_from_stream, missing file means nothing is done yet
+        """
+        done = cls()
+        if not os.path.exists(output_path):
+            return done
+        with open(output_path) as file:
+            for row in file:
+                try:
+                    record = json.loads(row)
+                except ValueError:
+                    continue  # Last line of a killed run can be cut in half
+                if record.get('status') in DONE_STATUSES:
+                    done.add(record['line'])
+        return done
+
+
+def open_source(source: str) -> TextIO:
+    """
+    :param source: file path, '-' is stdin
+    """
+    return sys.stdin if source == '-' else open(source)
+
+
+def print_progress(counts: Dict[str, int], file: TextIO = sys.stderr):
+    print(f"\r{counts[CREATED]} created, {counts[INVALID_REDIRECT]} invalid redirect, {counts[ERROR]} errors, "
+          f"{counts[SKIPPED]} skipped", end='', file=file, flush=True)
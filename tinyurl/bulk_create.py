@@ -0,0 +1,34 @@
+import argparse
+import sys
+
+from config import load_config
+from .bulk import DoneLines, open_source, print_progress, ERROR
+from .tum import TinyUrlManager
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m tinyurl.bulk_create',
+                                     description='Creates tinyurls for every line of a file or stdin, writes results '
+                                                 'as JSONL. Run it again with the same output to resume.')
+    parser.add_argument('source', help="file with one url per line, '-' reads stdin")
+    parser.add_argument('--output', '-o', required=True, help='JSONL result file, appended to')
+    parser.add_argument('--window', type=int, help='creates in flight, default is max_threads')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = load_config()
+    tum = TinyUrlManager(app_config=config)
+    done = DoneLines.load(args.output)
+    try:
+        with open_source(args.source) as urls, open(args.output, 'a') as output:
+            counts = tum.create_from_stream(urls, output, window=args.window, skip=done, progress=print_progress)
+    finally:
+        tum.close()
+    print(file=sys.stderr)
+    return 1 if counts[ERROR] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
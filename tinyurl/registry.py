@@ -0,0 +1,117 @@
+from collections.abc import MutableMapping
+from threading import RLock
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from utility.id_map import IdMap
+from .tinyurl import TinyUrl
+
+
+class TinyUrlRegistry(MutableMapping):
+    """
+    id -> TinyUrl mapping with secondary indexes by alias and target domain, lookups by tinyurl go through its alias.
+    Drop-in replacement for the old OrderedDict, except iteration is in id order.
+
+    TinyUrl objects don't know the registry, so after changing one in place call reindex(id).
+    Ids come from allocate_id(), which is atomic: parallel creates never get the same id and ids aren't reused.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self.tinyurls = IdMap()  # id: TinyUrl
+        self.by_alias: Dict[str, int] = {}
+        self.by_domain: Dict[str, Set[int]] = {}
+        self.indexed = IdMap()  # id: (alias, domain) the indexes hold
+        self.next_id = 1
+
+    def allocate_id(self, count: int = 1) -> int:
+        """
+        Reserves count consecutive ids.
+
+        :return: the first of them
+        """
+        with self.lock:
+            first_id = self.next_id
+            self.next_id += count
+            return first_id
+
+    def __getitem__(self, tinyurl_id: int) -> TinyUrl:
+        return self.tinyurls[tinyurl_id]
+
+    def __setitem__(self, tinyurl_id: int, tinyurl: TinyUrl):
+        with self.lock:
+            self._unindex(tinyurl_id)
+            self.tinyurls[tinyurl_id] = tinyurl
+            self._index(tinyurl_id, tinyurl)
+            self.next_id = max(self.next_id, tinyurl_id + 1)
+
+    def __delitem__(self, tinyurl_id: int):
+        with self.lock:
+            del self.tinyurls[tinyurl_id]
+            self._unindex(tinyurl_id)
+
+    def __contains__(self, tinyurl_id) -> bool:
+        return tinyurl_id in self.tinyurls
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(list(self.tinyurls))  # Copy, heartbeat feedback can change it while cli iterates
+
+    def __len__(self) -> int:
+        return len(self.tinyurls)
+
+    def items(self) -> List[Tuple[int, TinyUrl]]:
+        with self.lock:
+            return list(self.tinyurls.items())
+
+    def values(self) -> List[TinyUrl]:
+        with self.lock:
+            return list(self.tinyurls.values())
+
+    def _index(self, tinyurl_id: int, tinyurl: TinyUrl):
+        keys = (tinyurl.alias, tinyurl.domain)
+        self.indexed[tinyurl_id] = keys
+        alias, domain = keys
+        if alias:
+            self.by_alias[alias] = tinyurl_id
+        if domain:
+            self.by_domain.setdefault(domain, set()).add(tinyurl_id)
+
+    def _unindex(self, tinyurl_id: int):
+        keys = self.indexed.pop(tinyurl_id, None)
+        if not keys:
+            return
+        alias, domain = keys
+        if self.by_alias.get(alias) == tinyurl_id:
+            del self.by_alias[alias]
+        ids = self.by_domain.get(domain)
+        if ids is not None:
+            ids.discard(tinyurl_id)
+            if not ids:
+                del self.by_domain[domain]
+
+    def reindex(self, tinyurl_id: int):
+        with self.lock:
+            tinyurl = self.tinyurls.get(tinyurl_id)
+            if tinyurl is None:
+                return
+            if self.indexed.get(tinyurl_id) != (tinyurl.alias, tinyurl.domain):
+                self._unindex(tinyurl_id)
+                self._index(tinyurl_id, tinyurl)
+
+    def get_by_alias(self, alias: str) -> Optional[TinyUrl]:
+        tinyurl_id = self.by_alias.get(alias)
+        return self.tinyurls.get(tinyurl_id) if tinyurl_id is not None else None
+
+    def get_by_tinyurl(self, url: str) -> Optional[TinyUrl]:
+        tinyurl = self.get_by_alias(url.rstrip('/').split('/')[-1])
+        return tinyurl if tinyurl and tinyurl.tinyurl == url else None
+
+    def in_domain(self, domain: str) -> List[TinyUrl]:
+        with self.lock:
+            return [self.tinyurls[tinyurl_id] for tinyurl_id in sorted(self.by_domain.get(domain, ()))]
+
+    def domains(self) -> Dict[str, int]:
+        """
+        :return: target domain: number of tinyurls pointing to it
+        """
+        with self.lock:
+            return {domain: len(ids) for domain, ids in self.by_domain.items()}
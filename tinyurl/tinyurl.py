@@ -9,6 +9,7 @@ SUCCESS = 25
 
 
 class TinyUrl:
+    __slots__ = ('tinyurl', 'alias', 'domain', 'final_url', 'id')  # No per instance __dict__, there can be millions
 
     def __init__(self, new_id):
         self.tinyurl = None
@@ -17,21 +18,36 @@ class TinyUrl:
         self.final_url = None
         self.id = new_id
 
-    def instantiate_tinyurl(self, url: str, api_client: ApiClient, expires_at=None, no_check=False):
-        data = api_client.create_tinyurl(url, expires_at=expires_at, no_check=no_check)
+    def instantiate_tinyurl(self, url: str, api_client: ApiClient, expires_at=None, no_check=False, spare_pool=None):
+        """
+        :param spare_pool: claim a pre-created tinyurl if there is one (not for expiring tinyurls)
+        """
+        data = None
+        if spare_pool and not expires_at:
+            data = spare_pool.claim(url, ref=self.id, no_check=no_check)
+        if data is None:
+            data = api_client.create_tinyurl(url, expires_at=expires_at, no_check=no_check, ref=self.id)
+        self.load_created(data)
+
+    def load_created(self, data: dict, log: bool = True):
         self.final_url = f'https://{data["url"]}'.strip('/') if not urlparse(data['url']).scheme else data['url'].strip(
             '/')  # Because tinyurl response sometimes omits scheme
         self.domain = get_final_domain(self.final_url)
-        self.tinyurl = f"https://tinyurl.com/{data['alias']}"
+        self.tinyurl = data.get('tiny_url') or f"https://tinyurl.com/{data['alias']}"
         self.alias = data['alias']
-        logger.log(SUCCESS, f'Tinyurl[{self.id}] created --> {self.final_url}')
+        if log:
+            logger.log(SUCCESS, f'Tinyurl[{self.id}] created --> {self.final_url}')
 
     def update_redirect(self, url: str, api_client: ApiClient):
         data = api_client.update_tinyurl_redirect_user(self.alias, url)
+        self.load_updated(data)
+
+    def load_updated(self, data: dict, log: bool = True):
         self.final_url = f'https://{data["url"]}' if not urlparse(data['url']).scheme else data[
             'url']  # Because tinyurl response sometimes omits scheme
         self.domain = get_final_domain(self.final_url)
-        logger.log(SUCCESS, f'Tinyurl[{self.id}] updated --> {self.final_url}')
+        if log:
+            logger.log(SUCCESS, f'Tinyurl[{self.id}] updated --> {self.final_url}')
 
     def __str__(self):
         return f'\033[1;33mTinyurl[{self.id}]' \
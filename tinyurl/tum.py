@@ -1,30 +1,41 @@
+import json
+import logging
+import sys
 import time
-from collections import OrderedDict
-from concurrent.futures import ThreadPoolExecutor, as_completed, wait, ALL_COMPLETED, TimeoutError
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED, TimeoutError
 from queue import Queue, Full
-from threading import Event
-from typing import List, Dict, Optional
+from typing import Callable, Container, Dict, Iterable, List, Optional, TextIO, Tuple
 from urllib.parse import urlparse
 
-from api.apiclient import ApiClient
+from api.apiclient import ApiClient, ALIAS_NOT_AVAILABLE
+from api.journal import DONE
 from exceptions.tinyurl_exceptions import TinyUrlCreationError, TinyUrlUpdateError, NetworkError, \
     RequestError, UnwantedDomain, NetworkException
+from services.spare_pool import SparePool
+from .bulk import CREATED, INVALID_REDIRECT, ERROR, SKIPPED
+from .registry import TinyUrlRegistry
 from .tinyurl import TinyUrl
 from utility.ansi_codes import AnsiCodes
+from utility.events import ClearableEvent
+from utility.pipeline import Pipeline, Stage
 from utility.url_network_tools import get_valid_urls, check_redirect_url
+from utility.url_tools import get_final_domain
 from spinner_utilities.spinner import Spinner
 
+logger = logging.getLogger('')
+PROGRESS_INTERVAL = 1.0
+
 
 class TinyUrlManager:
     use_spinner = False
 
-    def __init__(self, shared_queue: Queue = None, control_event: Event = None, feedback_event: Event = None,
-                 app_config: Dict[str, List[str]] = None):
+    def __init__(self, shared_queue: Queue = None, control_event: ClearableEvent = None,
+                 feedback_event: ClearableEvent = None, app_config: Dict[str, List[str]] = None):
 
         if shared_queue:
             self.shared_queue: Optional[Queue] = shared_queue
-            self.control_event: Optional[Event] = control_event
-            self.feedback_event: Optional[Event] = feedback_event
+            self.control_event: Optional[ClearableEvent] = control_event
+            self.feedback_event: Optional[ClearableEvent] = feedback_event
             self.fallback_urls: List[str] = get_valid_urls(app_config.get('fallback_urls'))
             self.auth_tokens: List[str] = app_config['auth_tokens']
             self.ping_interval: int = app_config['ping_interval']
@@ -35,30 +46,49 @@ class TinyUrlManager:
             self.fallback_urls: List[str] = app_config.get('fallback_urls', [])
             self.use_spinner = False
 
-        self.id_tinyurl_mapping = OrderedDict()
-        self.api_client = ApiClient(self.auth_tokens, self.fallback_urls)
+        self.id_tinyurl_mapping = TinyUrlRegistry()
+        self.api_client = ApiClient(self.auth_tokens, self.fallback_urls, config=app_config)
         self.token_id = 1
+        self.spare_pool: Optional[SparePool] = None
+        if app_config.get('spare_pool_size') and self.fallback_urls:
+            self.spare_pool = SparePool(self.api_client, app_config['spare_pool_size'])
 
     @Spinner(text='Sending request to create...', spinner_type='bouncing_ball', color='cyan', delay=0.03, special=True)
     def create_tinyurl(self, url: str, no_check: bool = False, new_id: int = None):
+        return self._create_tinyurl(url, no_check, new_id, spare_pool=self.spare_pool)
+
+    def _create_tinyurl(self, url: str, no_check: bool = False, new_id: int = None, spare_pool: SparePool = None):
+        new_tinyurl = self._new_tinyurl(url, no_check, new_id, spare_pool)
+        self._register(new_tinyurl)
+        return new_tinyurl
+
+    def _new_tinyurl(self, url: str, no_check: bool = False, new_id: int = None,
+                     spare_pool: SparePool = None) -> TinyUrl:
+        """
+        Creates it through the api, but it isn't managed (nor checked by heartbeat) until _register.
+
+        :param spare_pool: only for single creates, bulk runs would drain the spares kept for new and for repairs
+        """
         new_id = new_id or self.get_next_available_id()
         try:
             new_tinyurl = TinyUrl(new_id)
-            new_tinyurl.instantiate_tinyurl(url, self.api_client, no_check=no_check)
-            queue_data = {'update': {'tinyurl': new_tinyurl.tinyurl,
-                                     'domain': new_tinyurl.domain, 'id': new_tinyurl.id}}
-            if self.use_spinner:
-                self._enqueue(queue_data)
-            self.id_tinyurl_mapping[new_tinyurl.id] = new_tinyurl
+            new_tinyurl.instantiate_tinyurl(url, self.api_client, no_check=no_check, spare_pool=spare_pool)
             return new_tinyurl
         except (TinyUrlCreationError, RequestError, NetworkError, ValueError) as e:
             raise e
 
+    def _register(self, new_tinyurl: TinyUrl):
+        if self.use_spinner:
+            self._enqueue({'update': {'tinyurl': new_tinyurl.tinyurl, 'domain': new_tinyurl.domain,
+                                      'id': new_tinyurl.id}})
+        self.id_tinyurl_mapping[new_tinyurl.id] = new_tinyurl
+
     @Spinner(text='Sending request to update...', spinner_type='bouncing_ball', color='cyan', delay=0.03, special=True)
     def update_tinyurl(self, url: str):
         try:
             updated_tinyurl: TinyUrl = self.id_tinyurl_mapping[self.selected_id]
             updated_tinyurl.update_redirect(url, self.api_client)
+            self.id_tinyurl_mapping.reindex(updated_tinyurl.id)
             queue_data = {'update': {'tinyurl': updated_tinyurl.tinyurl, 'domain': updated_tinyurl.domain,
                                      'id': updated_tinyurl.id}}
             if self.use_spinner:
@@ -66,45 +96,205 @@ class TinyUrlManager:
         except (TinyUrlUpdateError, RequestError, NetworkError) as e:
             raise e
 
-    def create_from_list(self, urls_list: List[str], wait_time: int = 60):
-        assigned_id = self.get_next_available_id()
-        urls = []
+    def select_tinyurls(self, domain: str = None, id_range: Tuple[int, int] = None,
+                        predicate: Callable[[TinyUrl], bool] = None) -> List[TinyUrl]:
+        """
+        :param domain: current target domain, a host or url works too (www.example.com -> example.com)
+        :param id_range: (first, last), both included
+        :param predicate: called with every candidate
+        :return: tinyurls matching all given filters, in id order
+        """
+        if domain is not None:
+            tinyurls = self.id_tinyurl_mapping.in_domain(
+                get_final_domain(domain if '//' in domain else 'https://' + domain))  # host:port has a 'scheme' too
+        else:
+            tinyurls = self.id_tinyurl_mapping.values()
+        if id_range is not None:
+            first, last = id_range
+            tinyurls = [t for t in tinyurls if first <= t.id <= last]
+        if predicate is not None:
+            tinyurls = [t for t in tinyurls if predicate(t)]
+        return tinyurls
+
+    def retarget(self, url: str, domain: str = None, id_range: Tuple[int, int] = None,
+                 predicate: Callable[[TinyUrl], bool] = None, max_workers: int = None,
+                 progress: Callable[[Dict[str, int]], None] = None) -> dict:
+        """
+        Points every tinyurl matching the filters (see select_tinyurls) to url, e.g. when a landing domain moves.
+        The target gets one preflight check for the whole batch, then /change calls run in parallel. Each one uses
+        the token owning its alias, so they're spread over the tokens and paced by the token scheduler and the
+        adaptive limiter. Changes are journaled like single updates. Heartbeat gets one 'updates' message at the end.
+
+        :param progress: called with {'updated', 'failed', 'total'} about once a second and at the end
+        :return: {'updated': [ids], 'failed': {id: exception}, 'total': number of matching tinyurls}
+        """
+        if domain is None and id_range is None and predicate is None:
+            raise ValueError('Retarget needs a domain, an id range or a predicate')
+        url = url if urlparse(url).scheme else 'https://' + url
+        tinyurls = self.select_tinyurls(domain, id_range, predicate)
+        result = {'updated': [], 'failed': {}, 'total': len(tinyurls)}
+        if not tinyurls:
+            return result
+        self.api_client.check_target_url(url, use_cache=False)  # Raises before anything is changed
+        limiter = self.api_client.concurrency_limiter
+        counts = {'updated': 0, 'failed': 0, 'total': len(tinyurls)}
+        last_progress = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers or limiter.max_limit) as executor:
+                futures = {executor.submit(limiter.run, self.api_client.update_tinyurl_redirect_service, t.alias, url):
+                           t for t in tinyurls}
+                for future in as_completed(futures):
+                    tinyurl = futures[future]
+                    try:
+                        data = future.result()
+                    except Exception as e:  # One failed change doesn't stop the others, it's reported
+                        result['failed'][tinyurl.id] = e
+                        counts['failed'] += 1
+                    else:
+                        tinyurl.load_updated(data, log=False)
+                        self.id_tinyurl_mapping.reindex(tinyurl.id)
+                        result['updated'].append(tinyurl.id)
+                        counts['updated'] += 1
+                    if progress and time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                        last_progress = time.monotonic()
+                        progress(counts)
+        finally:
+            # Interrupted or not, heartbeat has to know about the ones already changed
+            if self.use_spinner and result['updated']:
+                self._enqueue({'updates': [{'tinyurl': t.tinyurl, 'domain': t.domain, 'id': t.id}
+                                           for t in map(self.id_tinyurl_mapping.get, result['updated']) if t]})
+        result['updated'].sort()
+        if progress:
+            progress(counts)
+        logger.info(f'Retargeted {len(result["updated"])} of {len(tinyurls)} tinyurls to {url}')
+        return result
+
+    def create_from_list(self, urls_list: List[str], wait_time: int = 60, max_workers: int = None,
+                         verify_workers: int = None):
+        """
+        Runs as a pipeline: normalize -> create -> verify -> register. Every stage has its own threads and a bounded
+        queue in front of it, so redirects of finished creates are verified while other creates are still running.
+        Only verified tinyurls are registered and handed to heartbeat. After wait_time no new creates are started,
+        the ones already created are still verified and registered.
+
+        :param max_workers: create threads, running creates are limited by the api client's adaptive limiter
+        :param verify_workers: redirect check threads, default is the same as max_workers
+        :return: {'created', 'invalid_redirect', 'errors', 'stages': per stage throughput and queue depth}
+        """
+        limiter = self.api_client.concurrency_limiter
+        workers = max_workers or limiter.max_limit
         result = {'errors': [], 'created': [], 'invalid_redirect': []}
+        ids = iter(range(self.id_tinyurl_mapping.allocate_id(len(urls_list)), sys.maxsize))
 
-        for url in urls_list:
-            if not urlparse(url).scheme:
-                url_with_schema = 'https://' + url
-            else:
-                url_with_schema = url
-            urls.append(url_with_schema)
+        def normalize(url: str):
+            return next(ids), url if urlparse(url).scheme else 'https://' + url  # One thread, ids follow input order
+
+        def create(item):
+            new_id, url = item
+            return limiter.run(self._new_tinyurl, url, True, new_id)
+
+        def verify(new_tinyurl: TinyUrl):
+            if check_redirect_url(new_tinyurl.tinyurl, new_tinyurl.domain):
+                return new_tinyurl
+            result['invalid_redirect'].append(new_tinyurl.tinyurl)
+            self.api_client.record_mutation(DONE, 'delete', ref=new_tinyurl.id, alias=new_tinyurl.alias)
+
+        def register(new_tinyurl: TinyUrl):
+            self._register(new_tinyurl)
+            result['created'].append({'url': new_tinyurl.tinyurl, 'redirect': new_tinyurl.final_url})
+
+        pipeline = Pipeline([Stage('normalize', normalize),
+                             Stage('create', create, workers=workers),
+                             Stage('verify', verify, workers=verify_workers or workers, finish_on_cancel=True),
+                             Stage('register', register, finish_on_cancel=True)],
+                            on_error=lambda stage, item, e: result['errors'].append(e))
+        if not pipeline.run(urls_list, timeout=wait_time):
+            result['errors'].append(TimeoutError(f'Bulk create did not finish in {wait_time} seconds'))
+        result['stages'] = pipeline.stats()
+        return result
 
-        with ThreadPoolExecutor(max_workers=8) as executor:
-            futures = [executor.submit(self.create_tinyurl, url, True, assigned_id + i) for i, url in
-                       enumerate(urls)]
+    def create_from_stream(self, urls: Iterable[str], output: TextIO, window: int = None, skip: Container[int] = (),
+                           progress: Callable[[Dict[str, int]], None] = None) -> Dict[str, int]:
+        """
+        create_from_list for inputs that don't fit in memory. urls is read lazily, at most window creates (and their
+        redirect checks) are in flight, and every result is written to output as one JSONL record once it's known:
+        {"line", "url", "status": created|invalid_redirect|error, "id", "tinyurl", "redirect" or "error"}.
+        Created tinyurls are kept like with create_from_list, nothing else grows with the input.
+
+        :param urls: e.g. an open file, one url per line, empty lines and lines starting with # are left out
+        :param output: records are flushed after every finished batch, so a killed run loses at most that batch
+        :param skip: line numbers done by a previous run (see bulk.DoneLines), they are not sent again
+        :param progress: called with counts about once a second and at the end
+        :return: number of lines per status
+        """
+        limiter = self.api_client.concurrency_limiter
+        window = window or limiter.max_limit
+        counts = {CREATED: 0, INVALID_REDIRECT: 0, ERROR: 0, SKIPPED: 0}
+        lines = enumerate(urls, start=1)
+        pending = set()
+        last_progress = time.monotonic()
+        with ThreadPoolExecutor(max_workers=window) as executor:
             try:
-                for future in as_completed(futures, timeout=wait_time):
-                    tinyurl = future.result().tinyurl
-                    target_domain = future.result().domain
-                    final_redirect = future.result().final_url
-                    valid = check_redirect_url(tinyurl, target_domain)
-                    if valid:
-                        result['created'].append({'url': tinyurl, 'redirect': final_redirect})
-                    else:
-                        result['invalid_redirect'].append(future.result().tinyurl)
-                        self.id_tinyurl_mapping.pop(future.result().id)
-                    wait(futures, return_when=ALL_COMPLETED)
-
-            except TimeoutError as e:
-                result['errors'].append(e)
-            except Exception as e:
-                result['errors'].append(e)
-            return result
+                while True:
+                    for line, url in lines:  # Tops the window up, the rest of the input stays unread
+                        url = url.strip()
+                        if not url or url.startswith('#'):
+                            continue
+                        if line in skip:
+                            counts[SKIPPED] += 1
+                            continue
+                        pending.add(executor.submit(limiter.run, self._create_record, line, url))
+                        if len(pending) >= window:
+                            break
+                    if not pending:
+                        break
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self._write_records(done, output, counts)
+                    if progress and time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                        last_progress = time.monotonic()
+                        progress(counts)
+            finally:
+                # Stopped by input error or ctrl+c: creates already sent still get their record, resume skips them
+                self._write_records(as_completed(pending), output, counts)
+        if progress:
+            progress(counts)
+        return counts
+
+    @staticmethod
+    def _write_records(futures: Iterable, output: TextIO, counts: Dict[str, int]):
+        for future in futures:
+            record = future.result()
+            counts[record['status']] += 1
+            output.write(json.dumps(record) + '\n')
+        output.flush()
+
+    def _create_record(self, line: int, url: str) -> dict:
+        """
+        Same order as the create_from_list pipeline: create, verify, only then register (and hand to heartbeat).
+        """
+        record = {'line': line, 'url': url}
+        try:
+            new_tinyurl = self._new_tinyurl(url if urlparse(url).scheme else 'https://' + url, no_check=True)
+        except Exception as e:
+            record.update(status=ERROR, error=str(e))
+            return record
+        record.update(id=new_tinyurl.id, tinyurl=new_tinyurl.tinyurl, redirect=new_tinyurl.final_url)
+        if check_redirect_url(new_tinyurl.tinyurl, new_tinyurl.domain):
+            self._register(new_tinyurl)
+            record['status'] = CREATED
+        else:
+            record['status'] = INVALID_REDIRECT
+            self.api_client.record_mutation(DONE, 'delete', ref=new_tinyurl.id, alias=new_tinyurl.alias)
+        return record
 
     def self_check(self, timeout=60):
         result = {}
-        with ThreadPoolExecutor(max_workers=8) as executor:
-            futures = [executor.submit(check_redirect_url, t.tinyurl, t.domain, True) for t in self.id_tinyurl_mapping.values()]
-            for future, tinyurl, domain in as_completed(futures, timeout=timeout):
+        limiter = self.api_client.concurrency_limiter
+        with ThreadPoolExecutor(max_workers=limiter.max_limit) as executor:
+            futures = {executor.submit(limiter.run, check_redirect_url, t.tinyurl, t.domain, True): t.tinyurl
+                       for t in self.id_tinyurl_mapping.values()}
+            for future in as_completed(futures, timeout=timeout):
+                tinyurl = futures[future]
                 try:
                     future.result()
                 except UnwantedDomain as e:
@@ -119,6 +309,11 @@ class TinyUrlManager:
     def cycle_next_token(self):
         return self.api_client.cycle_next_token()
 
+    def close(self):
+        if self.spare_pool:
+            self.spare_pool.close()
+        self.api_client.close()
+
     def get_token(self):
         return self.api_client.token_selected
 
@@ -139,32 +334,139 @@ class TinyUrlManager:
                 print(f'{AnsiCodes.YELLOW}{id}. {tinyurl.tinyurl}{extra_space}-->  {tinyurl.final_url} ')
 
     def print_tokens(self):
+        usage = self.api_client.get_token_usage()
         for index, token in enumerate(self.auth_tokens):
-            print(f'{AnsiCodes.WHITE}{index + 1}. - {token}')
+            stats = usage[token]
+            status = f'{AnsiCodes.RED}quarantined' if stats['quarantined'] else f'{AnsiCodes.GREEN}ok'
+            print(f'{AnsiCodes.WHITE}{index + 1}. - {token}  [{status}{AnsiCodes.WHITE}] '
+                  f'requests: {stats["requests"]}, rate limited: {stats["rate_limited"]}')
         print(
             f'\n{AnsiCodes.BWHITE}Current token:\n{self.token_id}. - {AnsiCodes.GREEN}{self.api_client.auth_tokens[self.token_id - 1]}')
 
     def get_next_available_id(self):
-        if self.id_tinyurl_mapping.keys():
-            last_id = max(self.id_tinyurl_mapping.keys())
-            assigned_id = last_id + 1
-        else:
-            assigned_id = 1
-        return assigned_id
+        """
+        Allocates the id, calling it twice gives two different ids even from parallel threads.
+        """
+        return self.id_tinyurl_mapping.allocate_id()
+
+    def remove_tinyurl(self, tinyurl_id: int):
+        tinyurl = self.id_tinyurl_mapping.pop(tinyurl_id)
+        self.api_client.record_mutation(DONE, 'delete', ref=tinyurl_id, alias=tinyurl.alias)
+        return tinyurl
+
+    def build_load_data(self) -> Dict[int, Dict[str, str]]:
+        return {key: {value.tinyurl: value.domain} for key, value in self.id_tinyurl_mapping.items()}
+
+    def restore_from_journal(self, redo_pending: bool = True) -> dict:
+        """
+        Rebuilds tinyurls and alias tokens from the mutation journal, then compacts it.
+        Changes that were sent but never confirmed are sent again (same alias and target, so it's idempotent).
+        Creates are re-sent with the journaled alias: if it's free the create never landed, if it's taken
+        we can't tell whose it is, so it's only reported. Unconfirmed spare claims are finished, the spare is never
+        put back in the pool since its tinyurl may already point to the claimed target. Unresolved intents stay in the
+        compacted journal, so the next restore tries again.
+
+        :return: {'restored': int, 'redone': int, 'unresolved': [aliases]}
+        """
+        journal = self.api_client.journal
+        summary = {'restored': 0, 'redone': 0, 'unresolved': []}
+        if not journal:
+            return summary
+        state = journal.replay()
+        self.api_client.alias_token_mapping.update_many(state.alias_tokens)
+        if self.spare_pool:
+            self.spare_pool.load({alias: {**data, 'url': state.targets.get(alias, data['url'])}
+                                  for alias, data in state.spares.items()})
+        for ref, data in sorted(state.created.items()):
+            tinyurl = TinyUrl(ref)
+            tinyurl.load_created({**data, 'url': state.targets.get(data['alias'], data['url'])}, log=False)
+            self.id_tinyurl_mapping[ref] = tinyurl
+        summary['restored'] = len(state.created)
+
+        if redo_pending:
+            for (op, alias), record in state.pending.items():
+                if op == 'create' and record.get('ref') is None:
+                    continue  # Unconfirmed spare, pool just creates another one
+                try:
+                    if op == 'change':
+                        self._redo_change(alias, record['url'])
+                    elif op == 'claim':
+                        self._redo_claim(alias, record)
+                    elif op == 'create':
+                        self._redo_create(alias, record)
+                    summary['redone'] += 1
+                except (TinyUrlCreationError, TinyUrlUpdateError, RequestError, NetworkError, KeyError) as e:
+                    logger.warning(f'Journal: {op} of {alias} not resolved: {e}')
+                    summary['unresolved'].append(alias)
+        self.compact_journal()
+        return summary
+
+    def _redo_change(self, alias: str, url: str):
+        data = self.api_client.update_tinyurl_redirect_service(alias, url)
+        tinyurl = self.id_tinyurl_mapping.get_by_alias(alias)
+        if tinyurl:
+            tinyurl.load_updated(data, log=False)
+            self.id_tinyurl_mapping.reindex(tinyurl.id)
+
+    def _redo_claim(self, alias: str, record: dict):
+        """
+        Spare claim that may or may not have landed: finishes it, the spare goes to tinyurl ref (replacing the broken
+        tinyurl heartbeat claimed it for, if it's there).
+        """
+        data = self.api_client.update_tinyurl_redirect_service(alias, record['url'])
+        ref = record['ref']
+        tinyurl = self.id_tinyurl_mapping.get(ref) or TinyUrl(ref)
+        tinyurl.load_created({'alias': alias, 'url': data['url'], 'tiny_url': record.get('tiny_url')}, log=False)
+        self.id_tinyurl_mapping[ref] = tinyurl
+        self.api_client.record_mutation(DONE, 'claim', alias=alias, url=data['url'], tiny_url=record.get('tiny_url'),
+                                        ref=ref)
+
+    def _redo_create(self, alias: str, record: dict):
+        ref = record.get('ref')
+        if ref is None or ref in self.id_tinyurl_mapping:
+            ref = self.get_next_available_id()
+        try:
+            data = self.api_client.create_tinyurl(record['url'], no_check=True, ref=ref, alias=alias)
+        except TinyUrlCreationError as e:
+            if ALIAS_NOT_AVAILABLE in e.errors:
+                raise TinyUrlCreationError([f'{alias} already exists, it may or may not be ours'], e.status_code)
+            raise
+        tinyurl = TinyUrl(ref)
+        tinyurl.load_created(data)
+        self.id_tinyurl_mapping[ref] = tinyurl
+
+    def compact_journal(self):
+        journal = self.api_client.journal
+        if not journal:
+            return
+        records = [{'op': 'create', 'phase': DONE, 'alias': t.alias,
+                    'token': self.api_client.alias_token_mapping.get(t.alias), 'url': t.final_url,
+                    'tiny_url': t.tinyurl, 'ref': t.id} for t in self.id_tinyurl_mapping.values()]
+        if self.spare_pool:
+            records.extend({'op': 'create', 'phase': DONE, 'alias': alias,
+                            'token': self.api_client.alias_token_mapping.get(alias), 'url': data['url'],
+                            'tiny_url': data.get('tiny_url')} for alias, data in list(self.spare_pool.spares.items()))
+        journal.compact(records)
 
     def process_item(self, data):
         for key, value in data.items():
             if key == 'delete':
-                self.id_tinyurl_mapping.pop(value)
+                self.remove_tinyurl(value)
                 return value
-            for tinyurl in self.id_tinyurl_mapping.values():
-                if key == tinyurl.alias:
-                    tinyurl.final_url = value['full_url']
-                    tinyurl.domain = value['domain']
+            if key == 'replace':  # Heartbeat swapped a broken tinyurl for a spare, id stays the same
+                tinyurl = self.id_tinyurl_mapping.get(value['id'])
+                if tinyurl:
+                    tinyurl.load_created(value['data'], log=False)
+                    self.id_tinyurl_mapping.reindex(tinyurl.id)
+                continue
+            tinyurl = self.id_tinyurl_mapping.get_by_alias(key)
+            if tinyurl:
+                tinyurl.final_url = value['full_url']
+                tinyurl.domain = sys.intern(value['domain'])  # Unpickled copy when it came from a heartbeat shard
+                self.id_tinyurl_mapping.reindex(tinyurl.id)
 
     def _enqueue(self, data: dict):
-        while self.feedback_event.is_set():
-            time.sleep(0.2)
+        self.feedback_event.wait_clear()  # Heartbeat's feedback must be consumed first, queue is shared
         try:
             self.control_event.set()
             self.shared_queue.put(data)
@@ -1,18 +1,22 @@
+import logging
 import os
 import random
 import re
 import subprocess
 import sys
-import time
 from queue import Queue, Empty
-from threading import Thread, Event
+from threading import Thread
+from typing import Optional, Union
 from urllib.parse import urlparse
 
 from exceptions.tinyurl_exceptions import TinyUrlCreationError, TinyUrlUpdateError, InputException
 from services.heartbeat import HeartbeatService
+from services.sharded_heartbeat import ShardedHeartbeatService, build_heartbeat
 from spinner_utilities.spinner import Spinner
+from .bulk import DoneLines, print_progress, CREATED, INVALID_REDIRECT, ERROR
 from .tum import TinyUrlManager
 from utility.ansi_codes import AnsiCodes, slow_print
+from utility.events import ClearableEvent
 
 menu = f"""
 {AnsiCodes.BYELLOW}SYNOPSIS:
@@ -22,9 +26,12 @@ ________________________________________________________________________________
 {AnsiCodes.BWHITE}update <url>   - {AnsiCodes.YELLOW}Update the redirect for the selected TinyURL
 {AnsiCodes.BWHITE}delete <id>    - {AnsiCodes.YELLOW}Delete a TinyURL with the selected ID
 {AnsiCodes.BWHITE}current        - {AnsiCodes.YELLOW}Display the currently selected TinyURL instance
+{AnsiCodes.BWHITE}bulk <file>    - {AnsiCodes.YELLOW}Create TinyURLs for every line of a file, results in <file>.jsonl
+{AnsiCodes.BWHITE}retarget <..>  - {AnsiCodes.YELLOW}'retarget <domain|id-id> <url>' updates all TinyURLs that match
 _____________________________________________________________________________________
 {AnsiCodes.BWHITE}delay <sec>    - {AnsiCodes.YELLOW}Change the pinging interval (e.g., 'delay 5 s' or 'delay 1 m')
 {AnsiCodes.BWHITE}ping           - {AnsiCodes.YELLOW}Ping sweep all TinyURLs and check their status
+{AnsiCodes.BWHITE}shards <n>     - {AnsiCodes.YELLOW}Change the number of heartbeat worker processes (sharded mode)
 {AnsiCodes.BWHITE}stop           - {AnsiCodes.YELLOW}Stop ping checking service
 {AnsiCodes.BWHITE}start          - {AnsiCodes.YELLOW}Start ping checking service
 {AnsiCodes.BWHITE}token <id>     - {AnsiCodes.YELLOW}Select a token by ID
@@ -39,6 +46,8 @@ ________________________________________________________________________________
 {AnsiCodes.BYELLOW}[id] {AnsiCodes.BWHITE} - {AnsiCodes.YELLOW}[tinyurl id] - prompt
 """
 
+logger = logging.getLogger('')
+
 service_threads = []
 service_active = True
 app_config = None
@@ -46,8 +55,22 @@ app_config = None
 
 class TumCLI(TinyUrlManager):
 
-    def __init__(self, shared_queue: Queue, control_event: Event, feedback_event: Event, config):
+    def __init__(self, shared_queue: Queue, control_event: ClearableEvent, feedback_event: ClearableEvent, config):
         super().__init__(shared_queue, control_event, feedback_event, app_config=config)
+        self.heartbeat: Optional[Union[HeartbeatService, ShardedHeartbeatService]] = None
+
+    def send_to_heartbeat(self, data: dict):
+        """
+        Returns once heartbeat consumed the message.
+        """
+        self.control_event.set()
+        self.shared_queue.put(data)
+        self.shared_queue.join()
+
+    def stop_heartbeat(self):
+        self.send_to_heartbeat({'exit': True})
+        if self.heartbeat:
+            self.heartbeat.stopped.wait(timeout=5)
 
     def handle_user_input(self):
         global service_active
@@ -69,11 +92,48 @@ class TumCLI(TinyUrlManager):
             self.id_tinyurl_mapping.update({new_tinyurl.id: new_tinyurl})
             self.selected_id = new_tinyurl.id
 
+        elif command == 'bulk':
+            try:
+                source = parsed_input[1]
+            except IndexError:
+                raise InputException(' '.join(parsed_input))
+            if not os.path.isfile(source):
+                print(f'{AnsiCodes.RED}File {source} not found!')
+                return True
+            output_path = parsed_input[2] if len(parsed_input) > 2 and parsed_input[2] else f'{source}.jsonl'
+            done = DoneLines.load(output_path)  # Same output again resumes where the last run stopped
+            if done:
+                print(f'{AnsiCodes.YELLOW}Resuming, {len(done)} lines already done in {output_path}')
+            with open(source) as urls, open(output_path, 'a') as output:
+                counts = self.create_from_stream(urls, output, skip=done,
+                                                 progress=lambda counts: print_progress(counts, sys.stdout))
+            print(f'\n{AnsiCodes.GREEN}{counts[CREATED]} tinyurls created, {counts[INVALID_REDIRECT]} invalid '
+                  f'redirects, {counts[ERROR]} errors, results in {output_path}')
+
+        elif command == 'retarget':
+            try:
+                selector, url = parsed_input[1], parsed_input[2]
+            except IndexError:
+                raise InputException(' '.join(parsed_input))
+            id_range = re.fullmatch(r'(\d+)(?:-(\d+))?', selector)
+            if id_range:
+                first = int(id_range.group(1))
+                result = self.retarget(url, id_range=(first, int(id_range.group(2) or first)),
+                                       progress=print_retarget_progress)
+            else:
+                result = self.retarget(url, domain=selector, progress=print_retarget_progress)
+            if not result['total']:
+                print(f'{AnsiCodes.RED}No tinyurls match {selector}!')
+                return True
+            print(f'\n{AnsiCodes.GREEN}{len(result["updated"])} of {result["total"]} tinyurls retargeted!')
+            for tinyurl_id, error in result['failed'].items():
+                print(f'{AnsiCodes.RED}Tinyurl[{tinyurl_id}] not updated: {error}')
+
         elif command == 'select':
             try:
                 num = re.search(r'\d+', parsed_input[1])
                 num = int(num.group())
-                if num not in self.id_tinyurl_mapping.keys():
+                if num not in self.id_tinyurl_mapping:
                     print(f'{AnsiCodes.RED}Tinyurl({num}) is invalid!')
                     print(f'{AnsiCodes.YELLOW}Available tinyurls:\n')
                     self.print_short()
@@ -88,10 +148,10 @@ class TumCLI(TinyUrlManager):
             try:
                 num = re.search(r'\d+', parsed_input[1])
                 num = int(num.group())
-                if num in self.id_tinyurl_mapping.keys():
+                if num in self.id_tinyurl_mapping:
                     self.control_event.set()
-                    self.shared_queue.put({'delete': self.id_tinyurl_mapping[num].tinyurl})
-                    self.id_tinyurl_mapping.pop(num)
+                    self.shared_queue.put({'delete': num})
+                    self.remove_tinyurl(num)
                     print(f'{AnsiCodes.RED}Tinyurl [{num}] deleted from the system!')
                     self.selected_id = None if self.selected_id == num else self.selected_id
                 else:
@@ -122,6 +182,16 @@ class TumCLI(TinyUrlManager):
             self.print_all()
             print(f'{AnsiCodes.GREEN}_______________________')
             print(f"Pinging interval is {self.ping_interval} seconds")
+            concurrency = self.api_client.get_concurrency()
+            print(f"Concurrency: {concurrency['current']} running, target {concurrency['target']}"
+                  f"/{concurrency['max']}, backed off {concurrency['overloads']} times")
+            if self.spare_pool:
+                spares = self.spare_pool.stats()
+                print(f"Spare tinyurls: {spares['available']}/{spares['size']}, claimed {spares['claimed']}")
+            for url, health in self.api_client.tunneling_service.health().items():
+                latency = f"{health['latency'] * 1000:.0f}ms" if health['latency'] is not None else '-'
+                print(f"Fallback {url}: {'up' if health['healthy'] else 'down'}, latency {latency}, "
+                      f"success rate {health['success_rate']:.0%}")
 
         elif command == 'list' or command == 'l':
             self.print_short()
@@ -158,9 +228,7 @@ class TumCLI(TinyUrlManager):
                     if unit in ['h', 'hrs', 'hours']:
                         num = num * 3600
                     with Spinner(text='Changing delay...', spinner_type='star_spinner', color='cyan', delay=0.04):
-                        self.control_event.set()
-                        self.shared_queue.put({'delay': num})
-                        time.sleep(1)
+                        self.send_to_heartbeat({'delay': num})
                     self.ping_interval = num
                     print(f'{AnsiCodes.GREEN}Pinging interval changed to {num} seconds!', flush=False)
                 except (IndexError, ValueError, AttributeError):
@@ -169,23 +237,32 @@ class TumCLI(TinyUrlManager):
             else:
                 print(f'{AnsiCodes.RED}Service inactive!')
 
+        elif command == 'shards':
+            if not service_active:
+                print(f'{AnsiCodes.RED}Service inactive!')
+            elif not isinstance(self.heartbeat, ShardedHeartbeatService):
+                print(f'{AnsiCodes.RED}Heartbeat is not sharded, set heartbeat_shards in config!')
+            else:
+                try:
+                    num = int(parsed_input[1])
+                except (IndexError, ValueError):
+                    raise InputException(' '.join(parsed_input))
+                with Spinner(text='Resharding heartbeat...', spinner_type='star_spinner', color='cyan', delay=0.04):
+                    self.send_to_heartbeat({'shards': num})
+                print(f'{AnsiCodes.GREEN}Heartbeat runs on {max(1, num)} worker processes!')
+
         elif command == 'ping':
             if service_active:
                 with Spinner(text='Ping sweeping all urls...', spinner_type='bouncing_ball', color='cyan', delay=0.03):
-                    self.control_event.set()
-                    self.shared_queue.put({'ping': 0})
-                    time.sleep(2)
-                print(f'{AnsiCodes.GREEN}Ping sweeping done. See logs!')
+                    self.send_to_heartbeat({'ping': 0})
+                print(f'{AnsiCodes.GREEN}Ping sweep started. See logs!')
             else:
                 print(f'{AnsiCodes.RED}Service inactive!')
 
         elif command == 'stop':
             if service_active:
                 with Spinner(text='Stopping pinging service...', spinner_type='star_spinner', color='red', delay=0.04):
-                    self.control_event.set()
-                    self.shared_queue.put({'exit': True})
-                    self.shared_queue.join()
-                    time.sleep(2)
+                    self.stop_heartbeat()
                 print(f'{AnsiCodes.RED}Heartbeat service stopped!')
                 service_active = False
             else:
@@ -194,17 +271,16 @@ class TumCLI(TinyUrlManager):
         elif command == 'start':
             if not service_active:
                 with Spinner(text='Starting pinging service...', spinner_type='star_spinner', color='green', delay=0.04):
-                    load_data = {}
-                    for key, value in self.id_tinyurl_mapping.items():
-                        load_data.update({key: {value.tinyurl: value.domain}})
-                    heartbeat = HeartbeatService(self.shared_queue, self.control_event, self.feedback_event,
-                                                 self.api_client, load_data=load_data, config=app_config)
+                    heartbeat = build_heartbeat(self.shared_queue, self.control_event, self.feedback_event,
+                                                self.api_client, load_data=self.build_load_data(), config=app_config,
+                                                spare_pool=self.spare_pool)
+                    self.heartbeat = heartbeat
                     t1 = Thread(target=heartbeat.start_heartbeat_service, daemon=True)
                     t2 = Thread(target=self.listen_for_feedback_event, daemon=True)
                     t1.start()
                     t2.start()
                     service_threads = [t1, t2]
-                    time.sleep(2)
+                    heartbeat.started.wait(timeout=5)
                 service_active = True
                 print(f'{AnsiCodes.GREEN}Heartbeat service started!')
             else:
@@ -219,10 +295,8 @@ class TumCLI(TinyUrlManager):
             command = f'tte {random.choice(animations)}'
             subprocess.run(command, input=exit_text, shell=True)
             if service_active:
-                self.control_event.set()
-                self.shared_queue.put({'exit': True})
-                self.shared_queue.join()
-                time.sleep(1)
+                self.stop_heartbeat()
+            self.close()
             return False
 
         elif command == 'clear' or command == 'cls':
@@ -280,10 +354,13 @@ class TumCLI(TinyUrlManager):
         sys.stdout.write(AnsiCodes.move_cursor_up(1) + AnsiCodes.erase_line(2))
         print(f'\n{AnsiCodes.BWHITE}Thank you for using TUM!{AnsiCodes.CYAN}\u2665\n{AnsiCodes.BYELLOW}[TUM version 2.0]')
         if service_active:
-            self.control_event.set()
-            self.shared_queue.put({'exit': True})
-            self.shared_queue.join()
-        time.sleep(1)  # Still needs time to process shutdown
+            self.stop_heartbeat()
+        self.close()
+
+
+def print_retarget_progress(counts: dict):
+    print(f"\r{AnsiCodes.YELLOW}{counts['updated']}/{counts['total']} updated, {counts['failed']} failed", end='',
+          flush=True)
 
 
 def handle_invalid_input(input, specific: str = None):
@@ -305,10 +382,17 @@ def initialize(config):
     global app_config
     app_config = config
     shared_queue = Queue()
-    control_event = Event()
-    feedback_event = Event()
+    control_event = ClearableEvent()
+    feedback_event = ClearableEvent()
     tum = TumCLI(shared_queue, control_event, feedback_event, app_config)
-    heartbeat = HeartbeatService(shared_queue, control_event, feedback_event, tum.api_client, config=app_config)
+    restored = tum.restore_from_journal()
+    if restored['restored'] or restored['redone']:
+        logger.info(f"Journal: restored {restored['restored']} tinyurls, redone {restored['redone']} mutations")
+    if tum.spare_pool:
+        tum.spare_pool.start()
+    heartbeat = build_heartbeat(shared_queue, control_event, feedback_event, tum.api_client,
+                                load_data=tum.build_load_data(), config=app_config, spare_pool=tum.spare_pool)
+    tum.heartbeat = heartbeat
     if service_active:
         t1 = Thread(target=tum.listen_for_feedback_event, daemon=True)
         t2 = Thread(target=heartbeat.start_heartbeat_service, daemon=True)
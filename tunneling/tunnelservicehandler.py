@@ -1,34 +1,165 @@
-class TunnelServiceHandler:
+import random
+import time
+from threading import Lock, Thread, Event
+from typing import Dict, List, Optional, Iterable
 
-    def __init__(self, urls):
-        self.urls: [] = urls
-        if not self.urls:
-            self.urls_mapping = {}
-            self.tunneler = None
-            return
+import requests
+from requests.exceptions import RequestException
+
+from api.retry import RetryPolicy
+
+DEFAULT_PROBE_INTERVAL = 60
+DEFAULT_PROBE_TIMEOUT = 3
+DEFAULT_LATENCY = 1.0  # Assumed for fallbacks never measured
+EWMA_ALPHA = 0.3
+HEALTHY_SUCCESS_RATE = 0.5
+EQUALLY_GOOD = 0.2  # Fallbacks scoring within 20% of the best one share the load
+
+
+class FallbackStats:
+    def __init__(self):
+        self.latency: Optional[float] = None  # EWMA, seconds
+        self.success_rate = 1.0  # EWMA of 1 (success) / 0 (failure)
+        self.successes = 0
+        self.failures = 0
+        self.last_checked = 0.0
+
+    def record(self, success: bool, latency: float = None):
+        self.success_rate += EWMA_ALPHA * ((1.0 if success else 0.0) - self.success_rate)
+        if success:
+            self.successes += 1
+            if latency is not None:
+                self.latency = latency if self.latency is None else \
+                    self.latency + EWMA_ALPHA * (latency - self.latency)
         else:
-            self.length = len(self.urls)
-        self.urls_mapping: dict = {key: False for key in self.urls}
-        self.tunneler: str = self.set_tunneling_service()
+            self.failures += 1
+        self.last_checked = time.monotonic()
+
+    @property
+    def healthy(self) -> bool:
+        return self.success_rate >= HEALTHY_SUCCESS_RATE
+
+    @property
+    def score(self) -> float:
+        """
+        Expected seconds per successful request, lower is better.
+        """
+        return (self.latency or DEFAULT_LATENCY) / max(self.success_rate, 0.01)
+
+
+class TunnelServiceHandler:
+    """
+    Pool of fallback urls. Tracks latency and success rate of every fallback (from repairs and from
+    background probes) and hands out the best scoring healthy one. Fallbacks that score about the same
+    are picked at random, so repairs don't all land on one host.
+
+    tunneler is the current pick, cycle_next() moves to the next best one not tried in this cycle.
+
+    Probes go through session (the api client's pooled preflight session) and respect the hosts' circuit breakers
+    when they are given.
+    """
+
+    def __init__(self, urls, probe_interval: float = None, session: requests.Session = None,
+                 circuit_breakers=None):
+        self.urls: List[str] = list(urls or [])
+        self.session = session or requests.Session()
+        self.circuit_breakers = circuit_breakers
+        self.length = len(self.urls)
+        self.stats: Dict[str, FallbackStats] = {url: FallbackStats() for url in self.urls}
+        self.tried = set()
+        self.lock = Lock()
+        self.tunneler: Optional[str] = self.choose()
+        self.stop_probing = Event()
+        self.probe_thread = None
+        if probe_interval and self.urls:
+            self.probe_thread = Thread(target=self._probe_loop, args=(probe_interval,), daemon=True)
+            self.probe_thread.start()
+
+    def ranked(self, exclude: Iterable[str] = ()) -> List[str]:
+        """
+        :return: fallbacks from the best to the worst, healthy ones first
+        """
+        exclude = set(exclude)
+        with self.lock:
+            candidates = [url for url in self.urls if url not in exclude]
+            return sorted(candidates, key=lambda url: (not self.stats[url].healthy, self.stats[url].score))
+
+    def choose(self, exclude: Iterable[str] = ()) -> Optional[str]:
+        """
+        Random pick among the healthy fallbacks that score close to the best one.
+        """
+        ranked = self.ranked(exclude)
+        if not ranked:
+            return None
+        best = self.stats[ranked[0]]
+        if not best.healthy:
+            return ranked[0]
+        equally_good = [url for url in ranked if self.stats[url].healthy
+                        and self.stats[url].score <= best.score * (1 + EQUALLY_GOOD)]
+        return random.choice(equally_good)
 
     def set_tunneling_service(self):
-        if not self.urls:
-            return
-        for url, used in self.urls_mapping.items():
-            if not used:
-                return url
-        self.reset_cycle()
+        self.tunneler = self.choose(exclude=self.tried)
+        if not self.tunneler and self.urls:
+            self.reset_cycle()
+        return self.tunneler
 
     def cycle_next(self):
         if not self.urls:
             return
-        self.urls_mapping[self.tunneler] = True
+        self.tried.add(self.tunneler)
         return self.set_tunneling_service()
 
     def reset_cycle(self):
-        self.__init__(urls=self.urls)  # Reset cycle
-        self.set_tunneling_service()
+        self.tried.clear()
+        self.tunneler = self.choose()
+
+    def record_success(self, url: str, latency: float = None):
+        with self.lock:
+            if url in self.stats:
+                self.stats[url].record(True, latency)
 
+    def record_failure(self, url: str):
+        with self.lock:
+            if url in self.stats:
+                self.stats[url].record(False)
+
+    def probe(self, url: str, timeout: float = DEFAULT_PROBE_TIMEOUT) -> bool:
+        breaker = self.circuit_breakers.get(url) if self.circuit_breakers else None
+        trial = breaker.claim() if breaker else 0
+        if trial is None:
+            self.record_failure(url)  # Host is failing, not worth a request
+            return False
+        start = time.monotonic()
+        try:
+            response = self.session.head(url, timeout=timeout)
+            success = response.status_code < 500
+            if breaker:
+                breaker.record_status(response.status_code)
+        except RequestException as e:
+            success = False
+            if breaker and RetryPolicy.is_retryable_exception(e):
+                self.circuit_breakers.record_exception(url, e)
+        finally:
+            if breaker:
+                breaker.release_trial(trial)
+        if success:
+            self.record_success(url, time.monotonic() - start)
+        else:
+            self.record_failure(url)
+        return success
 
+    def _probe_loop(self, interval: float):
+        while not self.stop_probing.is_set():
+            for url in self.urls:
+                self.probe(url)
+            self.stop_probing.wait(interval)
 
+    def close(self):
+        self.stop_probing.set()
 
+    def health(self) -> Dict[str, dict]:
+        with self.lock:
+            return {url: {'healthy': stats.healthy, 'latency': stats.latency, 'success_rate': stats.success_rate,
+                          'successes': stats.successes, 'failures': stats.failures}
+                    for url, stats in self.stats.items()}
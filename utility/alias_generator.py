@@ -0,0 +1,137 @@
+import hashlib
+import math
+import os
+import random
+import string
+from threading import Lock
+from typing import Optional
+
+ALIAS_ALPHABET = string.ascii_letters + string.digits
+MIN_ALIAS_LENGTH = 5
+MAX_ALIAS_LENGTH = 30
+COLLISIONS_PER_LENGTH = 3
+DEFAULT_FILTER_CAPACITY = 1_000_000
+DEFAULT_FILTER_ERROR_RATE = 0.001
+SAVE_EVERY = 1000
+
+
+class BloomFilter:
+    """
+    Compact probabilistic set. False positives are possible, false negatives are not, which is exactly what a
+    "known taken" alias filter needs: at worst a free alias is skipped locally.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_FILTER_CAPACITY, error_rate: float = DEFAULT_FILTER_ERROR_RATE):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def save(self, path: str):
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(self.size.to_bytes(8, 'little'))
+            file.write(self.hash_count.to_bytes(2, 'little'))
+            file.write(self.count.to_bytes(8, 'little'))
+            file.write(self.bits)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'BloomFilter':
+        bloom_filter = cls.__new__(cls)
+        with open(path, 'rb') as file:
+            bloom_filter.size = int.from_bytes(file.read(8), 'little')
+            bloom_filter.hash_count = int.from_bytes(file.read(2), 'little')
+            bloom_filter.count = int.from_bytes(file.read(8), 'little')
+            bloom_filter.bits = bytearray(file.read())
+        if len(bloom_filter.bits) != (bloom_filter.size + 7) // 8:
+            raise ValueError(f'Corrupted alias filter: {path}')
+        return bloom_filter
+
+
+class AliasGenerator:
+    """
+    Generates random aliases, skipping the ones known to be taken. Aliases TinyURL rejected and aliases we
+    created ourselves are both recorded in the filter, which is persisted to filter_path across runs.
+
+    Any object with generate(attempt), mark_taken(alias), record_collision(alias) and save() can be passed to
+    ApiClient instead.
+    """
+
+    def __init__(self, filter_path: Optional[str] = None, alphabet: str = ALIAS_ALPHABET,
+                 min_length: int = MIN_ALIAS_LENGTH, max_length: int = MAX_ALIAS_LENGTH,
+                 capacity: int = DEFAULT_FILTER_CAPACITY):
+        self.alphabet = alphabet
+        self.min_length = min_length
+        self.max_length = max_length
+        self.filter_path = filter_path
+        self.taken = self._load_filter(filter_path, capacity)
+        self.lock = Lock()
+        self.unsaved = 0
+        self.generated = 0
+        self.filter_skips = 0
+        self.collision_retries = 0
+
+    @staticmethod
+    def _load_filter(filter_path: Optional[str], capacity: int) -> BloomFilter:
+        if filter_path and os.path.exists(filter_path):
+            try:
+                return BloomFilter.load(filter_path)
+            except (OSError, ValueError):
+                pass
+        return BloomFilter(capacity)
+
+    def generate(self, attempt: int = 0) -> str:
+        """
+        :param attempt: number of collisions so far for this create, alias grows by one character every
+                        COLLISIONS_PER_LENGTH collisions
+        """
+        length = min(self.max_length, self.min_length + attempt // COLLISIONS_PER_LENGTH)
+        with self.lock:
+            while True:
+                alias = ''.join(random.choices(self.alphabet, k=length))
+                if alias not in self.taken:
+                    self.generated += 1
+                    return alias
+                self.filter_skips += 1
+
+    def mark_taken(self, alias: str):
+        with self.lock:
+            self.taken.add(alias)
+            self.unsaved += 1
+            save = self.unsaved >= SAVE_EVERY
+        if save:
+            self.save()
+
+    def record_collision(self, alias: str):
+        with self.lock:
+            self.collision_retries += 1
+        self.mark_taken(alias)
+
+    def save(self):
+        if not self.filter_path or not self.unsaved:
+            return
+        with self.lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.filter_path)), exist_ok=True)
+            self.taken.save(self.filter_path)
+            self.unsaved = 0
+
+    def stats(self) -> dict:
+        return {'generated': self.generated,
+                'collision_retries': self.collision_retries,
+                'filter_skips': self.filter_skips,
+                'known_taken': self.taken.count}
@@ -0,0 +1,32 @@
+from threading import Condition
+
+
+class ClearableEvent:
+    """
+    threading.Event that can also be waited on until it's cleared, instead of polling is_set() in a sleep loop.
+    """
+
+    def __init__(self):
+        self._cond = Condition()
+        self._flag = False
+
+    def is_set(self) -> bool:
+        return self._flag
+
+    def set(self):
+        with self._cond:
+            self._flag = True
+            self._cond.notify_all()
+
+    def clear(self):
+        with self._cond:
+            self._flag = False
+            self._cond.notify_all()
+
+    def wait(self, timeout: float = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self._flag, timeout)
+
+    def wait_clear(self, timeout: float = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._flag, timeout)
@@ -0,0 +1,49 @@
+import hashlib
+from bisect import bisect, insort
+from typing import Dict, Hashable, Iterable, List, Optional
+
+DEFAULT_REPLICAS = 64
+
+
+def ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent hash ring. Every node owns replicas points on the ring and a key belongs to the node of the first
+    point after the key's hash, so adding or removing a node only moves the keys next to its points (about 1/n).
+    """
+
+    def __init__(self, nodes: Iterable[Hashable] = (), replicas: int = DEFAULT_REPLICAS):
+        self.replicas = replicas
+        self.points: List[int] = []
+        self.owners: Dict[int, Hashable] = {}
+        self.nodes = set()
+        for node in nodes:
+            self.add_node(node)
+
+    def _node_points(self, node: Hashable) -> List[int]:
+        return [ring_hash(f'{node}#{replica}') for replica in range(self.replicas)]
+
+    def add_node(self, node: Hashable):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for point in self._node_points(node):
+            self.owners[point] = node
+            insort(self.points, point)
+
+    def remove_node(self, node: Hashable):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        for point in self._node_points(node):
+            del self.owners[point]
+            self.points.remove(point)
+
+    def node_for(self, key: str) -> Optional[Hashable]:
+        if not self.points:
+            return None
+        index = bisect(self.points, ring_hash(key)) % len(self.points)
+        return self.owners[self.points[index]]
@@ -0,0 +1,107 @@
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+MIN_GAP = 64  # Ids this far past the end of the list still grow it
+
+
+class IdMap(MutableMapping):
+    """
+    Mapping of tinyurl ids to values, backed by a list indexed by id. Ids are handed out consecutively, so this costs
+    one pointer per id where a dict with int keys costs a 24 byte entry plus free slots. None can't be stored, it marks
+    a free slot. Iteration is in id order.
+
+    The list only grows up to double its length (or MIN_GAP), ids further out (e.g. a ref from the journal) go to a
+    plain dict and move into the list once it reaches them. Trailing holes are trimmed and when less than a quarter of
+    the list is used the remaining values move to the dict, so deleted ids don't keep the list alive.
+    """
+
+    def __init__(self, items: Iterable[Tuple[int, Any]] = ()):
+        self.slots: List[Optional[Any]] = []
+        self.sparse: Dict[int, Any] = {}  # Ids past the end of slots
+        self.dense = 0  # Values held in slots
+        self.update(items)
+
+    def __getitem__(self, tinyurl_id: int):
+        value = self.get(tinyurl_id)
+        if value is None:
+            raise KeyError(tinyurl_id)
+        return value
+
+    def get(self, tinyurl_id: int, default=None):
+        if isinstance(tinyurl_id, int) and 0 <= tinyurl_id < len(self.slots):
+            value = self.slots[tinyurl_id]
+        else:
+            try:
+                value = self.sparse.get(tinyurl_id)
+            except TypeError:
+                value = None
+        return default if value is None else value
+
+    def __setitem__(self, tinyurl_id: int, value):
+        if value is None:
+            raise ValueError('IdMap can not hold None')
+        if not isinstance(tinyurl_id, int) or tinyurl_id < 0:
+            raise KeyError(tinyurl_id)
+        if tinyurl_id >= len(self.slots) and tinyurl_id < 2 * len(self.slots) + MIN_GAP:
+            self._grow(tinyurl_id + 1)
+        if tinyurl_id < len(self.slots):
+            if self.slots[tinyurl_id] is None:
+                self.dense += 1
+            self.slots[tinyurl_id] = value
+        else:
+            self.sparse[tinyurl_id] = value
+
+    def __delitem__(self, tinyurl_id: int):
+        self.pop(tinyurl_id)
+
+    def pop(self, tinyurl_id: int, *default):
+        value = self.get(tinyurl_id)
+        if value is None:
+            if default:
+                return default[0]
+            raise KeyError(tinyurl_id)
+        if tinyurl_id < len(self.slots):
+            self.slots[tinyurl_id] = None
+            self.dense -= 1
+            self._shrink()
+        else:
+            del self.sparse[tinyurl_id]
+        return value
+
+    def _grow(self, length: int):
+        start = len(self.slots)
+        self.slots.extend([None] * (length - start))
+        if self.sparse:
+            for tinyurl_id in range(start, length):
+                value = self.sparse.pop(tinyurl_id, None)
+                if value is not None:
+                    self.slots[tinyurl_id] = value
+                    self.dense += 1
+
+    def _shrink(self):
+        slots = self.slots
+        while slots and slots[-1] is None:
+            slots.pop()
+        if len(slots) > MIN_GAP and self.dense * 4 < len(slots):
+            self.sparse.update((tinyurl_id, value) for tinyurl_id, value in enumerate(slots) if value is not None)
+            self.slots = []
+            self.dense = 0
+
+    def __contains__(self, tinyurl_id) -> bool:
+        return self.get(tinyurl_id) is not None
+
+    def __iter__(self) -> Iterator[int]:
+        return iter([tinyurl_id for tinyurl_id, _ in self.items()])
+
+    def __len__(self) -> int:
+        return self.dense + len(self.sparse)
+
+    def items(self) -> List[Tuple[int, Any]]:
+        items = [(tinyurl_id, value) for tinyurl_id, value in enumerate(self.slots) if value is not None]
+        items.extend(sorted(self.sparse.items()))
+        return items
+
+    def values(self) -> List[Any]:
+        values = [value for value in self.slots if value is not None]
+        values.extend(value for _, value in sorted(self.sparse.items()))
+        return values
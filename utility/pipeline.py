@@ -0,0 +1,145 @@
+import time
+from queue import Queue, Full
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+_END = object()  # Sent to every worker of a stage once the previous stage is done
+
+
+class Stage:
+    """
+    One step of a Pipeline: workers threads take items from a bounded inbox, call func and hand every result that
+    isn't None to the next stage. A full inbox blocks the stage before it, so a slow stage slows down the ones in
+    front of it instead of piling up items.
+    """
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1, queue_size: int = None,
+                 finish_on_cancel: bool = False):
+        """
+        :param finish_on_cancel: keeps processing what reaches it after the pipeline is cancelled, for stages past
+            the point of no return (e.g. bookkeeping of something already created)
+        """
+        self.name = name
+        self.finish_on_cancel = finish_on_cancel
+        self.func = func
+        self.workers = max(1, workers)
+        self.inbox = Queue(maxsize=queue_size or self.workers * 2)
+        self.lock = Lock()
+        self.active = 0
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0.0  # Seconds spent in func, summed over workers
+        self.max_depth = 0
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    def record(self, duration: float, failed: bool = False):
+        with self.lock:
+            self.busy += duration
+            if failed:
+                self.failed += 1
+            else:
+                self.processed += 1
+            self.max_depth = max(self.max_depth, self.inbox.qsize())
+
+    def stats(self) -> dict:
+        elapsed = ((self.finished or time.monotonic()) - self.started) if self.started else 0.0
+        return {
+            'workers': self.workers,
+            'processed': self.processed,
+            'failed': self.failed,
+            'queue_depth': self.inbox.qsize(),
+            'max_queue_depth': self.max_depth,
+            'queue_size': self.inbox.maxsize,
+            'throughput': round(self.processed / elapsed, 2) if elapsed else 0.0,
+            'utilization': round(self.busy / (elapsed * self.workers), 2) if elapsed else 0.0,
+        }
+
+
+class Pipeline:
+    """
+    Stages running at the same time, each with its own threads and a bounded queue in front of it.
+
+    Usage:
+        pipeline = Pipeline([Stage('create', create, workers=32), Stage('verify', verify, workers=8)])
+        finished = pipeline.run(urls, timeout=60)
+        pipeline.stats()  # {stage name: {'processed', 'throughput', 'queue_depth', ...}}
+    """
+
+    def __init__(self, stages: List[Stage], on_error: Callable[[Stage, Any, Exception], None] = None):
+        """
+        :param on_error: called with stage, item and exception when func raises, the item is dropped
+        """
+        self.stages = stages
+        self.on_error = on_error
+        self.threads: List[Thread] = []
+        self.cancelled = False
+
+    def start(self):
+        for index, stage in enumerate(self.stages):
+            stage.started = time.monotonic()
+            stage.active = stage.workers
+            for _ in range(stage.workers):
+                thread = Thread(target=self._work, args=(index,), daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def _work(self, index: int):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            item = stage.inbox.get()
+            if item is _END:
+                break
+            if self.cancelled and not stage.finish_on_cancel:
+                continue  # Drain without work, so nobody upstream stays blocked on a full queue
+            start = time.monotonic()
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                stage.record(time.monotonic() - start, failed=True)
+                if self.on_error:
+                    self.on_error(stage, item, e)
+                continue
+            stage.record(time.monotonic() - start)
+            if result is not None and next_stage:
+                next_stage.inbox.put(result)
+        with stage.lock:
+            stage.active -= 1
+            last = stage.active == 0
+        if last:
+            stage.finished = time.monotonic()
+            if next_stage:
+                for _ in range(next_stage.workers):
+                    next_stage.inbox.put(_END)
+
+    def run(self, items: Iterable, timeout: float = None) -> bool:
+        """
+        Feeds items to the first stage and waits until all of them went through every stage.
+        When timeout runs out the rest is cancelled: work in progress finishes, nothing new is started except in
+        finish_on_cancel stages.
+
+        :return: False if it was cancelled
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        self.start()
+        try:
+            for item in items:
+                self.stages[0].inbox.put(item, timeout=self._remaining(deadline))
+        except Full:
+            self.cancelled = True
+        for _ in range(self.stages[0].workers):
+            self.stages[0].inbox.put(_END)
+        for thread in self.threads:
+            thread.join(self._remaining(deadline))
+            if thread.is_alive():
+                self.cancelled = True
+                thread.join()
+        return not self.cancelled
+
+    @staticmethod
+    def _remaining(deadline: Optional[float]) -> Optional[float]:
+        return max(0.0, deadline - time.monotonic()) if deadline is not None else None
+
+    def stats(self) -> Dict[str, dict]:
+        return {stage.name: stage.stats() for stage in self.stages}
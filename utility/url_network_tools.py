@@ -4,7 +4,7 @@ from exceptions.tinyurl_exceptions import UnwantedDomain
 import requests
 from requests.exceptions import *
 
-from utility.url_tools import get_final_domain
+from utility.url_tools import get_final_domain, classify_first_hop, PROBE_ERROR
 
 
 def is_resource_available(url):
@@ -31,11 +31,19 @@ def get_valid_urls(urls):
     return valid_urls
 
 
-def check_redirect_url(url, target_url, raise_exc=False):
+def check_redirect_url(url, target_url, raise_exc=False, deep=False):
+    """
+    Checks where url redirects from its first response only, deep=True follows the whole chain.
+    """
     try:
-        response = requests.head(url, timeout=5, allow_redirects=True)
-        response_domain = get_final_domain(response.url)
+        response = requests.head(url, timeout=5, allow_redirects=deep)
         target_domain = target_url
+        if deep:
+            response_domain = get_final_domain(response.url)
+        else:
+            verdict, detail = classify_first_hop(url, response.status_code, response.headers.get('Location'),
+                                                 target_domain)
+            response_domain = get_final_domain(detail) if verdict != PROBE_ERROR else detail
         if response_domain == target_domain:
             return url
         else:
@@ -46,6 +54,3 @@ def check_redirect_url(url, target_url, raise_exc=False):
         if raise_exc:
             raise UnwantedDomain(url)
         return
-
-
-
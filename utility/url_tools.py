@@ -1,19 +1,65 @@
 import random
 import re
 import string
-from urllib.parse import urlparse
+import sys
+from urllib.parse import urlparse, urljoin
+
+PROBE_OK = 'ok'
+PROBE_PREVIEW = 'preview'
+PROBE_WRONG_DOMAIN = 'wrong_domain'
+PROBE_ERROR = 'error'
+PROBE_SKIPPED = 'skipped'  # Circuit of tinyurl host is open
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
 
 
 def generate_string_5_30(length=5):
-    random_string = ''.join(random.sample(string.ascii_letters, length))
+    random_string = ''.join(random.choices(string.ascii_letters + string.digits, k=length))
     return random_string
 
 
 def get_final_domain(url):
+    """
+    :return: last two labels of the host, interned since many tinyurls share a few target domains
+    """
     parsed_url = urlparse(url)
     domain_parts = re.split(r'\.|/', parsed_url.netloc)  # Split by dots and slashes
     final_domain = ".".join(domain_parts[-2:])  # Join the last two parts
-    return final_domain
+    return sys.intern(final_domain)
+
+
+def preflight_cache_key(url, by_host=True):
+    """
+    Normalized key for preflight results: scheme://host, or scheme://host/path when by_host is False.
+    """
+    parsed_url = urlparse(url if urlparse(url).scheme else f'https://{url}')
+    key = f'{parsed_url.scheme.lower()}://{parsed_url.netloc.lower()}'
+    return key if by_host else key + (parsed_url.path.rstrip('/') or '')
+
+
+def classify_redirect(tinyurl, final_url, intended_domain):
+    """
+    Verdict for a tinyurl that ended up at final_url. Ending on tinyurl (or on its own host) means preview page.
+    """
+    response_domain = get_final_domain(final_url)
+    if 'tinyurl' in response_domain.split('.') or response_domain == get_final_domain(tinyurl):
+        return PROBE_PREVIEW
+    if response_domain != intended_domain:
+        return PROBE_WRONG_DOMAIN
+    return PROBE_OK
+
+
+def classify_first_hop(tinyurl, status, location, intended_domain):
+    """
+    Verdict from the first response of tinyurl only (status and Location header), without following the chain.
+
+    :return: (verdict, location or error message)
+    """
+    if status in REDIRECT_STATUSES and location:
+        location = urljoin(tinyurl, location)
+        return classify_redirect(tinyurl, location, intended_domain), location
+    if status < 300:
+        return PROBE_PREVIEW, tinyurl  # Tinyurl answers itself instead of redirecting
+    return PROBE_ERROR, f'HTTP Error: {status}'
 
 
 def check_format_validity():